@@ -3,10 +3,14 @@ from tkinter import ttk, messagebox, simpledialog
 from datetime import datetime
 from user_management import UserManagement
 from demo_queries import DemoQueries
-import logging
+import background
+from background import BackgroundRunner
 
 # Enhancements
-from enhancements import generate_loan_pdf, show_admin_graphs, run_overdue_scan, simulate_notification
+from enhancements import generate_loan_pdf, show_admin_graphs, overdue_scan_message, simulate_notification
+from overdue import scan_overdue
+from projection import project_collections
+from rollups import monthly_collections
 
 class AdminDashboard:
     def __init__(self, login_window, user, db):
@@ -22,6 +26,9 @@ class AdminDashboard:
         self.window.protocol("WM_DELETE_WINDOW", self.logout)
         self.window.deiconify()
         
+        self.status_var = tk.StringVar()
+        self.tasks = BackgroundRunner(self.window, self.status_var)
+        
         self.setup_ui()
         self.load_dashboard_data()
     
@@ -53,7 +60,7 @@ class AdminDashboard:
                                bg='#8e44ad', fg='white', font=('Arial', 10))
         graphs_btn.pack(side='left', padx=5)
 
-        overdue_btn = tk.Button(button_frame, text="Run Overdue Scan", command=lambda: run_overdue_scan(self.db, self.window),
+        overdue_btn = tk.Button(button_frame, text="Run Overdue Scan", command=self.run_overdue_scan,
                                 bg='#f39c12', fg='white', font=('Arial', 10))
         overdue_btn.pack(side='left', padx=5)
         
@@ -61,6 +68,9 @@ class AdminDashboard:
                               bg='#e74c3c', fg='white', font=('Arial', 10))
         logout_btn.pack(side='left', padx=5)
         
+        tk.Label(self.window, textvariable=self.status_var, anchor='w',
+                fg='#7f8c8d', bg='#ecf0f1').pack(side='bottom', fill='x', padx=10)
+        
         self.notebook = ttk.Notebook(self.window)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
         
@@ -137,7 +147,8 @@ class AdminDashboard:
         
         self.report_var = tk.StringVar()
         report_combo = ttk.Combobox(report_frame, textvariable=self.report_var, width=20, state='readonly')
-        report_combo['values'] = ('Monthly Collection', 'Agent Performance', 'Branch Performance', 'Loan Status Summary')
+        report_combo['values'] = ('Monthly Collection', 'Collections Forecast', 'Agent Performance', 'Branch Performance',
+                                  'Loan Status Summary', 'Query Performance')
         report_combo.pack(side='left', padx=5)
         report_combo.bind('<<ComboboxSelected>>', self.generate_report)
         
@@ -206,50 +217,64 @@ class AdminDashboard:
         scrollbar.pack(side='right', fill='y')
     
     def load_dashboard_data(self):
-        try:
-            stats_queries = {
-                'total_loans': "SELECT COUNT(*) as count FROM Loan",
-                'active_loans': "SELECT COUNT(*) as count FROM Loan WHERE Status = 'Active'",
-                'defaulted_loans': "SELECT COUNT(*) as count FROM Loan WHERE Status = 'Defaulted'",
-                'total_customers': "SELECT COUNT(*) as count FROM Customer",
-                'overdue_installments': "SELECT COUNT(*) as count FROM Installment WHERE Status = 'Overdue'",
-                'seized_vehicles': "SELECT COUNT(*) as count FROM Seizure WHERE SeizureStatus = 'Completed'"
-            }
-            
-            for key, query in stats_queries.items():
-                result = self.db.execute_query(query)
-                if result:
-                    self.stats_labels[key].config(text=result[0]['count'])
-                else:
-                    self.stats_labels[key].config(text="0")
-            
-            transactions_query = """
-                SELECT tl.TransactionDate as Date, tl.LoanID, tl.TransactionType as Type,
-                       tl.DebitAmount as Amount, tl.BalanceAfterTransaction as Balance,
-                       tl.Remarks
-                FROM TransactionLogger tl
-                ORDER BY tl.TransactionDate DESC 
-                LIMIT 20
-            """
-            transactions = self.db.execute_query(transactions_query)
-            if transactions:
-                for trans in transactions:
-                    self.activities_tree.insert('', 'end', values=(
-                        trans['Date'], trans['LoanID'], trans['Type'],
-                        trans['Amount'], trans['Balance'], trans['Remarks']
-                    ))
-            
-            self.load_loans()
-            self.load_seizures()
-            
-        except Exception as e:
-            logging.error(f"Error loading dashboard data: {e}")
-            messagebox.showerror("Error", f"Failed to load dashboard data: {str(e)}")
+        self.tasks.submit('dashboard', self._fetch_dashboard_data, label='dashboard',
+                          on_done=self._show_dashboard_data, on_error=self._show_dashboard_error)
+        self.load_loans()
+        self.load_seizures()
+    
+    def _fetch_dashboard_data(self):
+        """Runs on a worker thread: counters and the latest transactions"""
+        stats_queries = {
+            'total_loans': "SELECT COUNT(*) as count FROM Loan",
+            'active_loans': "SELECT COUNT(*) as count FROM Loan WHERE Status = 'Active'",
+            'defaulted_loans': "SELECT COUNT(*) as count FROM Loan WHERE Status = 'Defaulted'",
+            'total_customers': "SELECT COUNT(*) as count FROM Customer",
+            'overdue_installments': "SELECT COUNT(*) as count FROM Installment WHERE Status = 'Overdue'",
+            'seized_vehicles': "SELECT COUNT(*) as count FROM Seizure WHERE SeizureStatus = 'Completed'"
+        }
+        
+        stats = {}
+        for key, query in stats_queries.items():
+            result = self.db.execute_query(query, cache_ttl=30)
+            stats[key] = result[0]['count'] if result else 0
+        
+        transactions_query = """
+            SELECT tl.TransactionDate as Date, tl.LoanID, tl.TransactionType as Type,
+                   tl.DebitAmount as Amount, tl.BalanceAfterTransaction as Balance,
+                   tl.Remarks
+            FROM TransactionLogger tl
+            ORDER BY tl.TransactionDate DESC 
+            LIMIT 20
+        """
+        transactions = self.db.execute_query(transactions_query)
+        return stats, transactions or []
+    
+    def _show_dashboard_data(self, result):
+        stats, transactions = result
+        for key, count in stats.items():
+            self.stats_labels[key].config(text=count)
+        
+        for item in self.activities_tree.get_children():
+            self.activities_tree.delete(item)
+        for trans in transactions:
+            self.activities_tree.insert('', 'end', values=(
+                trans['Date'], trans['LoanID'], trans['Type'],
+                trans['Amount'], trans['Balance'], trans['Remarks']
+            ))
+    
+    def _show_dashboard_error(self, error):
+        messagebox.showerror("Error", f"Failed to load dashboard data: {str(error)}")
     
     def load_loans(self):
-        for item in self.loans_tree.get_children():
-            self.loans_tree.delete(item)
-        
+        # A refresh while the list is still streaming in is ignored
+        task = self.tasks.submit('loans', self._stream_loans, label='loans',
+                                 on_progress=self._insert_loans,
+                                 on_error=lambda e: messagebox.showerror("Error", f"Failed to load loans: {e}"))
+        if task:
+            for item in self.loans_tree.get_children():
+                self.loans_tree.delete(item)
+    
+    def _stream_loans(self):
         query = """
             SELECT l.LoanID, CONCAT(c.FirstName, ' ', c.LastName) as Customer,
                    l.LoanAmount, l.BalanceAmount, l.Status, a.Name as Agent, b.BranchName as Branch
@@ -260,18 +285,18 @@ class AdminDashboard:
             ORDER BY l.LoanID DESC
         """
         
-        loans = self.db.execute_query(query)
-        if loans:
-            for loan in loans:
-                self.loans_tree.insert('', 'end', values=(
-                    loan['LoanID'], loan['Customer'], loan['LoanAmount'],
-                    loan['BalanceAmount'], loan['Status'], loan['Agent'], loan['Branch']
-                ))
+        # Stream the full loan book so the first rows show up before the rest is read
+        for loans in self.db.iter_query(query, chunk_size=500):
+            background.post(loans)
+    
+    def _insert_loans(self, loans):
+        for loan in loans:
+            self.loans_tree.insert('', 'end', values=(
+                loan['LoanID'], loan['Customer'], loan['LoanAmount'],
+                loan['BalanceAmount'], loan['Status'], loan['Agent'], loan['Branch']
+            ))
     
     def load_seizures(self):
-        for item in self.seizures_tree.get_children():
-            self.seizures_tree.delete(item)
-        
         query = """
             SELECT s.SeizureID, s.LoanID, CONCAT(c.FirstName, ' ', c.LastName) as Customer,
                    v.VehicleNo, s.SeizureDate, s.SeizureStatus, s.Reason
@@ -282,7 +307,12 @@ class AdminDashboard:
             ORDER BY s.SeizureDate DESC
         """
         
-        seizures = self.db.execute_query(query)
+        self.tasks.submit('seizures', self.db.execute_query, query, on_done=self._show_seizures)
+    
+    def _show_seizures(self, seizures):
+        for item in self.seizures_tree.get_children():
+            self.seizures_tree.delete(item)
+        
         if seizures:
             for seizure in seizures:
                 self.seizures_tree.insert('', 'end', values=(
@@ -308,23 +338,21 @@ class AdminDashboard:
             OR b.BranchName LIKE %s
         """
         
-        try:
-            search_param = f"%{search_term}%"
-            loans = self.db.execute_query(query, (search_param, search_param, search_term, search_param, search_param))
-            
-            for item in self.loans_tree.get_children():
-                self.loans_tree.delete(item)
-            
-            if loans:
-                for loan in loans:
-                    self.loans_tree.insert('', 'end', values=(
-                        loan['LoanID'], loan['Customer'], loan['LoanAmount'],
-                        loan['BalanceAmount'], loan['Status'], loan['Agent'], loan['Branch']
-                    ))
-            else:
-                messagebox.showinfo("No Results", "No loans found matching your search criteria")
-        except Exception as e:
-            messagebox.showerror("Search Error", f"Failed to search loans: {str(e)}")
+        search_param = f"%{search_term}%"
+        # Shares the 'loans' slot so a new search supersedes a running load or search
+        self.tasks.submit('loans', self.db.execute_query, query,
+                          (search_param, search_param, search_term, search_param, search_param),
+                          label='search', replace=True, on_done=self._show_search_results,
+                          on_error=lambda e: messagebox.showerror("Search Error", f"Failed to search loans: {str(e)}"))
+    
+    def _show_search_results(self, loans):
+        for item in self.loans_tree.get_children():
+            self.loans_tree.delete(item)
+        
+        if loans:
+            self._insert_loans(loans)
+        else:
+            messagebox.showinfo("No Results", "No loans found matching your search criteria")
     
     def generate_report(self, event=None):
         report_type = self.report_var.get()
@@ -339,27 +367,20 @@ class AdminDashboard:
         self.report_tree['columns'] = ()
         
         if report_type == 'Monthly Collection':
-            query = """
-                SELECT DATE_FORMAT(TransactionDate, '%Y-%m') as Month,
-                       SUM(DebitAmount) as TotalCollection,
-                       COUNT(*) as TotalTransactions
-                FROM TransactionLogger
-                WHERE TransactionType = 'EMI Payment'
-                GROUP BY DATE_FORMAT(TransactionDate, '%Y-%m')
-                ORDER BY Month DESC
-            """
+            # Read from the pre-aggregated rollup after folding in the ledger rows older than a minute;
+            # newer payments show on a later refresh (the ledger itself is read if the rollup cannot be refreshed)
+            query = lambda: monthly_collections(self.db, refresh=True)
             columns = ('Month', 'Total Collection', 'Transactions')
         
         elif report_type == 'Agent Performance':
+            # AgentPerformance reads the trigger-maintained AgentLoanTotals, one row per agent
             query = """
-                SELECT a.Name as Agent, b.BranchName,
-                       COUNT(l.LoanID) as TotalLoans,
-                       SUM(l.LoanAmount) as TotalVolume,
-                       AVG(l.InterestRate) as AvgInterestRate
-                FROM Agent a
-                JOIN Branch b ON a.BranchID = b.BranchID
-                LEFT JOIN Loan l ON a.AgentID = l.AgentID
-                GROUP BY a.AgentID, a.Name, b.BranchName
+                SELECT AgentName as Agent, BranchName,
+                       TotalLoansManaged as TotalLoans,
+                       TotalLoanVolume as TotalVolume,
+                       AvgInterestRate
+                FROM AgentPerformance
+                ORDER BY AgentID
             """
             columns = ('Agent', 'Branch', 'Total Loans', 'Loan Volume', 'Avg Interest Rate')
         
@@ -384,23 +405,69 @@ class AdminDashboard:
                 GROUP BY Status
             """
             columns = ('Status', 'Count', 'Total Amount', 'Avg Interest Rate')
+        
+        elif report_type == 'Collections Forecast':
+            # Computed from the unpaid schedule rather than a single SQL report
+            query = self._forecast_rows
+            columns = ('Month', 'Contractual', 'Scheduled', 'Prepayments', 'Arrears Recovered', 'Expected')
+        
+        elif report_type == 'Query Performance':
+            # In-process statement timings rather than a SQL report
+            query = self._query_performance_rows
+            columns = ('Calls', 'P50 ms', 'P95 ms', 'P99 ms', 'Max ms', 'Avg Wait ms', 'Avg Rows', 'Statement')
         else:
             return
         
-        try:
-            self.report_tree['columns'] = columns
-            
-            for col in columns:
-                self.report_tree.heading(col, text=col)
-                col_width = max(100, len(col) * 8)
-                self.report_tree.column(col, width=col_width)
-            
-            results = self.db.execute_query(query)
-            if results:
-                for row in results:
-                    self.report_tree.insert('', 'end', values=tuple(row.values()))
-        except Exception as e:
-            messagebox.showerror("Report Error", f"Failed to generate report: {str(e)}")
+        self.report_tree['columns'] = columns
+        
+        for col in columns:
+            self.report_tree.heading(col, text=col)
+            col_width = max(100, len(col) * 8)
+            self.report_tree.column(col, width=col_width)
+        
+        # Picking another report while one is running abandons the older one
+        self.tasks.submit('report', self._fetch_report, query, label=report_type.lower(), replace=True,
+                          on_done=self._show_report,
+                          on_error=lambda e: messagebox.showerror("Report Error", f"Failed to generate report: {str(e)}"))
+    
+    def _fetch_report(self, query):
+        if callable(query):
+            return query()
+        return self.db.execute_query(query)
+    
+    def _query_performance_rows(self):
+        return [{k: r[k] for k in ('Calls', 'P50Ms', 'P95Ms', 'P99Ms', 'MaxMs', 'AvgCheckoutMs',
+                                   'AvgRows', 'Statement')}
+                for r in self.db.query_stats.rows()]
+    
+    def _forecast_rows(self):
+        forecast = project_collections(self.db, months=12)
+        if forecast is None:
+            raise RuntimeError("collections projection failed, see the log for details")
+        return [{
+            'Month': month,
+            'Contractual': f"{forecast['contractual'][k]:,.2f}",
+            'Scheduled': f"{forecast['scheduled'][k]:,.2f}",
+            'Prepayments': f"{forecast['prepayment'][k]:,.2f}",
+            'Arrears Recovered': f"{forecast['arrears'][k]:,.2f}",
+            'Expected': f"{forecast['expected'][k]:,.2f}",
+        } for k, month in enumerate(forecast['months'])]
+    
+    def _show_report(self, results):
+        if results:
+            for row in results:
+                self.report_tree.insert('', 'end', values=tuple(row.values()))
+    
+    def run_overdue_scan(self):
+        self.tasks.submit('overdue_scan', scan_overdue, self.db, label='overdue scan',
+                          on_done=self._overdue_scan_finished)
+    
+    def _overdue_scan_finished(self, summary):
+        if summary is None:
+            messagebox.showerror("Error", "Overdue scan failed, see the log for details")
+            return
+        messagebox.showinfo("Overdue Scan", overdue_scan_message(summary))
+        self.load_dashboard_data()
     
     def open_user_management(self):
         try:
@@ -424,10 +491,19 @@ class AdminDashboard:
                 loan_id = simpledialog.askinteger("Loan ID", "Enter Loan ID to export")
             if not loan_id:
                 return
-            generate_loan_pdf(self.db, loan_id, parent=self.window)
+            self.tasks.submit('pdf', generate_loan_pdf, self.db, loan_id, notify=False, label=f"PDF for loan {loan_id}",
+                              on_done=self._pdf_exported,
+                              on_error=lambda e: messagebox.showerror("Error", f"Failed to export PDF: {e}"))
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export PDF: {e}")
     
+    def _pdf_exported(self, fname):
+        if fname:
+            messagebox.showinfo("PDF Generated", f"Loan PDF saved to {fname}")
+        else:
+            messagebox.showerror("Error", "Failed to generate PDF, see the log for details")
+    
     def logout(self):
+        self.tasks.close()
         self.window.destroy()
         self.login_window.deiconify()
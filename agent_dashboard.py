@@ -1,11 +1,15 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
-from utils import LoanCalculator
+from utils import LoanCalculator, DateUtils, DEFAULT_AFTER_DAYS
+from money import Money, to_db
 import logging
+from background import BackgroundRunner
 
 # enhancements
-from enhancements import show_emi_calculator, generate_loan_pdf, foreclose_loan, show_customer_profile, simulate_notification
+from enhancements import (show_emi_calculator, generate_loan_pdf, foreclose_loan, foreclosure_quote_message,
+                          show_foreclosure_result, show_customer_profile, simulate_notification)
+from foreclosure import quote_loan
 
 class AgentDashboard:
     def __init__(self, login_window, user, db):
@@ -23,6 +27,9 @@ class AgentDashboard:
         self.window.protocol("WM_DELETE_WINDOW", self.logout)
         self.window.deiconify()
         
+        self.status_var = tk.StringVar()
+        self.tasks = BackgroundRunner(self.window, self.status_var)
+        
         self.setup_ui()
         self.load_agent_data()
     
@@ -43,6 +50,9 @@ class AgentDashboard:
                             bg='#27ae60', fg='white', font=('Arial', 10))
         emi_btn.pack(side='right', padx=5, pady=20)
         
+        tk.Label(self.window, textvariable=self.status_var, anchor='w',
+                fg='#7f8c8d', bg='#ecf0f1').pack(side='bottom', fill='x', padx=10)
+        
         self.notebook = ttk.Notebook(self.window)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
         
@@ -275,49 +285,52 @@ class AgentDashboard:
         seize_btn.pack(pady=20)
     
     def load_agent_data(self):
-        try:
-            my_loans_query = "SELECT COUNT(*) as count FROM Loan WHERE AgentID = %s"
-            result = self.db.execute_query(my_loans_query, (self.agent_id,))
-            if result:
-                self.stats_labels['my_loans'].config(text=result[0]['count'])
-            
-            active_loans_query = "SELECT COUNT(*) as count FROM Loan WHERE AgentID = %s AND Status = 'Active'"
-            result = self.db.execute_query(active_loans_query, (self.agent_id,))
-            if result:
-                self.stats_labels['active_loans'].config(text=result[0]['count'])
-            
-            overdue_loans_query = """
-                SELECT COUNT(DISTINCT l.LoanID) as count 
-                FROM Loan l 
-                JOIN Installment i ON l.LoanID = i.LoanID 
-                WHERE l.AgentID = %s AND i.Status = 'Overdue'
-            """
-            result = self.db.execute_query(overdue_loans_query, (self.agent_id,))
-            if result:
-                self.stats_labels['overdue_loans'].config(text=result[0]['count'])
-            
-            collection_query = """
-                SELECT SUM(tl.DebitAmount) as total 
-                FROM TransactionLogger tl
-                JOIN Loan l ON tl.LoanID = l.LoanID
-                WHERE l.AgentID = %s AND tl.TransactionType = 'EMI Payment'
-            """
-            result = self.db.execute_query(collection_query, (self.agent_id,))
-            if result and result[0]['total']:
-                self.stats_labels['total_collection'].config(text=f"₹{result[0]['total']:,.2f}")
-            else:
-                self.stats_labels['total_collection'].config(text="₹0.00")
-            
-            self.load_my_loans()
-            
-        except Exception as e:
-            logging.error(f"Error loading agent data: {e}")
-            messagebox.showerror("Error", f"Failed to load agent data: {str(e)}")
+        self.tasks.submit('agent_data', self._fetch_agent_data, label='dashboard',
+                          on_done=self._show_agent_data,
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to load agent data: {str(e)}"))
+        self.load_my_loans()
+    
+    def _fetch_agent_data(self):
+        """Runs on a worker thread: the four counters at the top of the dashboard"""
+        stats = {}
+        my_loans_query = "SELECT COUNT(*) as count FROM Loan WHERE AgentID = %s"
+        result = self.db.execute_query(my_loans_query, (self.agent_id,))
+        if result:
+            stats['my_loans'] = result[0]['count']
+        
+        active_loans_query = "SELECT COUNT(*) as count FROM Loan WHERE AgentID = %s AND Status = 'Active'"
+        result = self.db.execute_query(active_loans_query, (self.agent_id,))
+        if result:
+            stats['active_loans'] = result[0]['count']
+        
+        overdue_loans_query = """
+            SELECT COUNT(DISTINCT l.LoanID) as count 
+            FROM Loan l 
+            JOIN Installment i ON l.LoanID = i.LoanID 
+            WHERE l.AgentID = %s AND i.Status = 'Overdue'
+        """
+        result = self.db.execute_query(overdue_loans_query, (self.agent_id,))
+        if result:
+            stats['overdue_loans'] = result[0]['count']
+        
+        collection_query = """
+            SELECT SUM(tl.DebitAmount) as total 
+            FROM TransactionLogger tl
+            JOIN Loan l ON tl.LoanID = l.LoanID
+            WHERE l.AgentID = %s AND tl.TransactionType = 'EMI Payment'
+        """
+        result = self.db.execute_query(collection_query, (self.agent_id,))
+        if result and result[0]['total']:
+            stats['total_collection'] = f"₹{result[0]['total']:,.2f}"
+        else:
+            stats['total_collection'] = "₹0.00"
+        return stats
+    
+    def _show_agent_data(self, stats):
+        for key, value in stats.items():
+            self.stats_labels[key].config(text=value)
     
     def load_my_loans(self):
-        for item in self.my_loans_tree.get_children():
-            self.my_loans_tree.delete(item)
-        
         query = """
             SELECT l.LoanID, CONCAT(c.FirstName, ' ', c.LastName) as Customer,
                    l.LoanAmount, l.BalanceAmount, l.Status, l.EMAmount as EMI
@@ -327,7 +340,13 @@ class AgentDashboard:
             ORDER BY l.LoanID DESC
         """
         
-        loans = self.db.execute_query(query, (self.agent_id,))
+        self.tasks.submit('my_loans', self.db.execute_query, query, (self.agent_id,), label='loans',
+                          on_done=self._show_my_loans)
+    
+    def _show_my_loans(self, loans):
+        for item in self.my_loans_tree.get_children():
+            self.my_loans_tree.delete(item)
+        
         if loans:
             for loan in loans:
                 self.my_loans_tree.insert('', 'end', values=(
@@ -347,10 +366,12 @@ class AgentDashboard:
             WHERE FirstName LIKE %s OR LastName LIKE %s OR Phone LIKE %s OR Email LIKE %s
         """
         
-        customers = self.db.execute_query(query, 
-                                        (f"%{search_term}%", f"%{search_term}%", 
-                                         f"%{search_term}%", f"%{search_term}%"))
-        
+        self.tasks.submit('customer_search', self.db.execute_query, query,
+                          (f"%{search_term}%", f"%{search_term}%",
+                           f"%{search_term}%", f"%{search_term}%"),
+                          label='customers', replace=True, on_done=self._show_customers)
+    
+    def _show_customers(self, customers):
         for item in self.customer_tree.get_children():
             self.customer_tree.delete(item)
         
@@ -443,9 +464,11 @@ class AgentDashboard:
                 messagebox.showerror("Validation Error", "\n".join(validation_errors))
                 return
             
-            # Calculate financials
+            # Calculate financials; the schedule's last instalment absorbs rounding, so total from it
+            sanction_date = datetime.now().date()
             emi = LoanCalculator.calculate_emi(loan_amount, interest_rate, tenure)
-            total_payable = LoanCalculator.calculate_total_payable(emi, tenure)
+            schedule = LoanCalculator.calculate_installments(loan_amount, interest_rate, tenure, sanction_date)
+            total_payable = sum((Money.of(inst['total_amount']) for inst in schedule), Money())
             
             # Create loan using transaction
             conn = self.db.get_connection()
@@ -469,14 +492,14 @@ class AgentDashboard:
                                     BalanceAmount, Status, BranchID, AgentID)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'Active', %s, %s)
                 """
-                cursor.execute(loan_query, (self.selected_customer_id, vehicle_id, loan_amount,
-                                          datetime.now().date(), tenure, interest_rate, emi,
-                                          total_payable, loan_amount, self.branch_id, self.agent_id))
+                cursor.execute(loan_query, (self.selected_customer_id, vehicle_id, to_db(loan_amount),
+                                          sanction_date, tenure, interest_rate, to_db(emi),
+                                          total_payable.to_decimal(), to_db(loan_amount),
+                                          self.branch_id, self.agent_id))
                 loan_id = cursor.lastrowid
                 
-                # Create installments using procedure
-                cursor.callproc('CreateLoanInstallments', 
-                               (loan_id, loan_amount, interest_rate, tenure, datetime.now().date()))
+                # Create installments in the same transaction, one multi-row INSERT
+                self.db.insert_installments(cursor, loan_id, schedule)
                 
                 # Log transaction
                 transaction_query = """
@@ -484,9 +507,10 @@ class AgentDashboard:
                                                 Remarks, TransactionType)
                     VALUES (%s, %s, %s, 'Loan Disbursement', 'Loan Disbursement')
                 """
-                cursor.execute(transaction_query, (loan_id, loan_amount, loan_amount))
+                cursor.execute(transaction_query, (loan_id, to_db(loan_amount), to_db(loan_amount)))
                 
                 conn.commit()
+                self.db.invalidate_cache('Vehicle', 'Loan', 'Installment', 'TransactionLogger')
                 messagebox.showinfo("Success", "Loan created successfully!")
                 
                 self.clear_loan_form()
@@ -525,8 +549,10 @@ class AgentDashboard:
             WHERE l.AgentID = %s AND l.Status = 'Active'
         """
         
-        loans = self.db.execute_query(query, (self.agent_id,))
-        
+        self.tasks.submit('agent_loans', self.db.execute_query, query, (self.agent_id,), label='active loans',
+                          on_done=self._show_agent_loans)
+    
+    def _show_agent_loans(self, loans):
         self.loan_combo['values'] = []
         if loans:
             loan_values = [f"{loan['LoanID']} - {loan['Display']}" for loan in loans]
@@ -547,8 +573,11 @@ class AgentDashboard:
             ORDER BY DueDate
         """
         
-        installments = self.db.execute_query(query, (loan_id,))
-        
+        # The latest loan picked wins over a load still running for the previous one
+        self.tasks.submit('installments', self.db.execute_query, query, (loan_id,), replace=True,
+                          on_done=self._show_installments)
+    
+    def _show_installments(self, installments):
         for item in self.installments_tree.get_children():
             self.installments_tree.delete(item)
         
@@ -574,17 +603,19 @@ class AgentDashboard:
         installment_id = item['values'][0]
         payment_mode = self.payment_mode.get()
         
-        try:
-            result = self.db.call_procedure('ProcessEMIPayment', (installment_id, payment_mode, datetime.now().date()))
-            
-            if result is not None:
-                messagebox.showinfo("Success", "Payment collected successfully!")
-                self.load_installments()
-                self.load_agent_data()
-            else:
-                messagebox.showerror("Error", "Failed to process payment")
-        except Exception as e:
-            messagebox.showerror("Error", f"Payment processing failed: {str(e)}")
+        # Keyed so a double click cannot post the same payment twice while the first is in flight
+        self.tasks.submit('payment', self.db.call_procedure, 'ProcessEMIPayment',
+                          (installment_id, payment_mode, datetime.now().date()),
+                          on_done=self._payment_collected,
+                          on_error=lambda e: messagebox.showerror("Error", f"Payment processing failed: {str(e)}"))
+    
+    def _payment_collected(self, result):
+        if result is not None:
+            messagebox.showinfo("Success", "Payment collected successfully!")
+            self.load_installments()
+            self.load_agent_data()
+        else:
+            messagebox.showerror("Error", "Failed to process payment")
     
     def open_selected_customer_profile(self):
         try:
@@ -601,9 +632,17 @@ class AgentDashboard:
                 messagebox.showwarning("Select Loan", "Please select a loan first")
                 return
             loan_id = int(self.loan_var.get().split(' - ')[0])
-            generate_loan_pdf(self.db, loan_id, parent=self.window)
+            self.tasks.submit('pdf', generate_loan_pdf, self.db, loan_id, notify=False, label=f"PDF for loan {loan_id}",
+                              on_done=self._pdf_exported,
+                              on_error=lambda e: messagebox.showerror("Error", f"Export failed: {e}"))
         except Exception as e:
             messagebox.showerror("Error", f"Export failed: {e}")
+    
+    def _pdf_exported(self, fname):
+        if fname:
+            messagebox.showinfo("PDF Generated", f"Loan PDF saved to {fname}")
+        else:
+            messagebox.showerror("Error", "Failed to generate PDF, see the log for details")
 
     def foreclose_selected_loan(self):
         try:
@@ -611,17 +650,33 @@ class AgentDashboard:
                 messagebox.showwarning("Select Loan", "Please select a loan first")
                 return
             loan_id = int(self.loan_var.get().split(' - ')[0])
-            ok = messagebox.askyesno("Confirm", f"Foreclose loan {loan_id}? This will mark remaining balance as paid.")
-            if not ok:
-                return
-            success = foreclose_loan(self.db, loan_id, agent_id=self.agent_id, parent=self.window)
-            if success:
-                simulate_notification(self.window, "Loan Foreclosed", f"Loan {loan_id} foreclosed by {self.user.get('AgentName','Agent')}")
-                self.load_agent_data()
-                self.load_installments()
+            self.tasks.submit('foreclosure_quote', quote_loan, self.db, loan_id, label=f"quote for loan {loan_id}",
+                              on_done=lambda quote: self._confirm_foreclosure(loan_id, quote),
+                              on_error=lambda e: messagebox.showerror("Error", f"Foreclosure quote failed: {e}"))
         except Exception as e:
             messagebox.showerror("Error", f"Foreclosure failed: {e}")
     
+    def _confirm_foreclosure(self, loan_id, quote):
+        if quote is None:
+            messagebox.showerror("Error", "Foreclosure quote failed, see the log for details")
+            return
+        if not quote or quote['payoff'] <= 0:
+            messagebox.showinfo("Info", "Loan already closed or no balance")
+            return
+        ok = messagebox.askyesno("Confirm", f"Foreclose loan {loan_id}?\n\n{foreclosure_quote_message(quote)}")
+        if not ok:
+            return
+        self.tasks.submit('foreclosure', foreclose_loan, self.db, loan_id, agent_id=self.agent_id, notify=False,
+                          label=f"foreclosure of loan {loan_id}",
+                          on_done=lambda result: self._foreclosure_done(loan_id, result),
+                          on_error=lambda e: messagebox.showerror("Error", f"Foreclosure failed: {e}"))
+    
+    def _foreclosure_done(self, loan_id, result):
+        if show_foreclosure_result(loan_id, result):
+            simulate_notification(self.window, "Loan Foreclosed", f"Loan {loan_id} foreclosed by {self.user.get('AgentName','Agent')}")
+            self.load_agent_data()
+            self.load_installments()
+    
     def load_defaulted_loans(self):
         query = """
             SELECT DISTINCT l.LoanID, CONCAT(c.FirstName, ' ', c.LastName, ' - Loan ₹', l.LoanAmount) as Display
@@ -629,11 +684,15 @@ class AgentDashboard:
             JOIN Customer c ON l.CustomerID = c.CustomerID
             JOIN Installment i ON l.LoanID = i.LoanID
             WHERE l.AgentID = %s AND i.Status = 'Overdue'
-            AND i.DueDate < DATE_SUB(CURDATE(), INTERVAL 90 DAY)
+            AND i.DueDate <= DATE_SUB(%s, INTERVAL %s DAY)
         """
         
-        loans = self.db.execute_query(query, (self.agent_id,))
-        
+        # Same threshold and business date as the nightly default_delinquent_loans job
+        self.tasks.submit('defaulted_loans', self.db.execute_query, query,
+                          (self.agent_id, DateUtils.today(), DEFAULT_AFTER_DAYS),
+                          label='defaulted loans', on_done=self._show_defaulted_loans)
+    
+    def _show_defaulted_loans(self, loans):
         self.seizure_loan_combo['values'] = []
         if loans:
             loan_values = [f"{loan['LoanID']} - {loan['Display']}" for loan in loans]
@@ -683,5 +742,6 @@ class AgentDashboard:
             messagebox.showerror("Error", f"Seizure initiation failed: {str(e)}")
     
     def logout(self):
+        self.tasks.close()
         self.window.destroy()
         self.login_window.deiconify()
@@ -5,6 +5,8 @@ from admin_dashboard import AdminDashboard
 from agent_dashboard import AgentDashboard
 from customer_dashboard import CustomerDashboard
 import logging
+import background
+from background import BackgroundRunner
 
 class LoginWindow:
     def __init__(self):
@@ -12,6 +14,8 @@ class LoginWindow:
         self.root.title("Vehicle Loan System - Login")
         self.root.geometry("400x400")
         self.root.configure(bg='#2c3e50')
+        self.status_var = tk.StringVar()
+        self.tasks = BackgroundRunner(self.root, self.status_var)
         
         # Configure logging
         logging.basicConfig(level=logging.INFO)
@@ -54,6 +58,8 @@ class LoginWindow:
                              bg='#3498db', fg='white', font=('Arial', 12), width=15)
         login_btn.grid(row=3, column=0, columnspan=2, pady=20)
         
+        tk.Label(main_frame, textvariable=self.status_var, fg='#bdc3c7', bg='#2c3e50').pack()
+        
         info_frame = tk.Frame(form_frame, bg='#34495e')
         info_frame.grid(row=4, column=0, columnspan=2, pady=10)
         
@@ -77,18 +83,18 @@ class LoginWindow:
             messagebox.showerror("Error", "Password must be at least 6 characters")
             return
         
-        try:
-            user = self.db.authenticate_user(username, password, role)
-            
-            if user:
-                logging.info(f"User {username} logged in as {role}")
-                self.root.withdraw()
-                self.open_dashboard(user, role)
-            else:
-                messagebox.showerror("Error", "Invalid credentials or role")
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Authentication failed: {str(e)}")
+        # Password hashing is deliberately slow, so keep it off the Tk thread
+        self.tasks.submit('login', self.db.authenticate_user, username, password, role, label='account',
+                          on_done=lambda user: self.login_finished(user, username, role),
+                          on_error=lambda e: messagebox.showerror("Error", f"Authentication failed: {str(e)}"))
+    
+    def login_finished(self, user, username, role):
+        if user:
+            logging.info(f"User {username} logged in as {role}")
+            self.root.withdraw()
+            self.open_dashboard(user, role)
+        else:
+            messagebox.showerror("Error", "Invalid credentials or role")
     
     def open_dashboard(self, user, role):
         try:
@@ -113,5 +119,7 @@ class LoginWindow:
         try:
             self.root.mainloop()
         finally:
+            self.tasks.close()
+            background.shutdown()
             if hasattr(self, 'db'):
                 self.db.close()
\ No newline at end of file
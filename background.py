@@ -0,0 +1,205 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared by every window so the number of threads hitting the database stays bounded
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+class TaskCancelled(Exception):
+    """Raised inside a worker by post() once its task has been cancelled"""
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv('UI_WORKERS', 4)),
+                                           thread_name_prefix='ui-worker')
+        return _executor
+
+
+def shutdown():
+    """Stop the shared worker pool; tasks still queued are dropped"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def current_task():
+    """The Task the calling worker thread is running, or None on the UI thread"""
+    return getattr(_local, 'task', None)
+
+
+def cancelled():
+    task = current_task()
+    return task is not None and task.cancelled
+
+
+def post(value):
+    """Hand a partial result (e.g. one chunk of rows) to the task's on_progress on the UI thread"""
+    task = current_task()
+    if task is None:
+        return
+    if task.cancelled:
+        raise TaskCancelled(task.key)
+    task.updates.put(value)
+
+
+class Task:
+    """One submitted call; the worker side sees it through current_task()/post()"""
+    def __init__(self, key, label, on_done, on_error, on_progress):
+        self.key = key
+        self.label = label
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.updates = queue.SimpleQueue()
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def run(self, func, args, kwargs):
+        _local.task = self
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.task = None
+
+
+class BackgroundRunner:
+    """Runs blocking calls (queries, PDF exports, password hashing) off the Tk thread.
+
+    Results come back through widget.after() polling, so callbacks always run
+    on the UI thread and may touch widgets.  Tasks are keyed: submitting a key
+    that is still running is ignored unless replace=True, which cancels the
+    running one first.  While anything is running the window shows a busy
+    cursor and, if given, the status variable says what is loading; Escape
+    cancels everything in flight.
+    """
+    def __init__(self, widget, status_var=None, poll_ms=50):
+        self.widget = widget
+        self.status_var = status_var
+        self.poll_ms = poll_ms
+        self.tasks = {}
+        self._polling = None
+        self._idle_cursor = widget.cget('cursor')
+        widget.bind('<Escape>', lambda event: self.cancel_all(), add='+')
+
+    def submit(self, key, func, *args, on_done=None, on_error=None, on_progress=None,
+               replace=False, label=None, **kwargs):
+        """Run func(*args, **kwargs) on the worker pool; returns the Task, or None if key is already running"""
+        running = self.tasks.get(key)
+        if running is not None:
+            if not replace:
+                logging.debug(f"Skipping '{key}': a previous run is still in progress")
+                return None
+            running.cancel()
+
+        task = Task(key, label or key.replace('_', ' '), on_done, on_error, on_progress)
+        task.future = _get_executor().submit(task.run, func, args, kwargs)
+        self.tasks[key] = task
+        self._set_busy()
+        if self._polling is None:
+            self._polling = self.widget.after(self.poll_ms, self._poll)
+        return task
+
+    def is_running(self, key):
+        return key in self.tasks
+
+    def cancel(self, key):
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            self._set_busy()
+
+    def cancel_all(self):
+        for key in list(self.tasks):
+            self.cancel(key)
+
+    def close(self):
+        """Cancel everything and stop polling; call before the widget is destroyed"""
+        self.cancel_all()
+        if self._polling is not None:
+            try:
+                self.widget.after_cancel(self._polling)
+            except Exception:
+                pass
+            self._polling = None
+
+    def _set_busy(self):
+        try:
+            if self.tasks:
+                self.widget.config(cursor='watch')
+                if self.status_var is not None:
+                    labels = ', '.join(t.label for t in self.tasks.values())
+                    self.status_var.set(f"Loading {labels}... (Esc to cancel)")
+            else:
+                self.widget.config(cursor=self._idle_cursor)
+                if self.status_var is not None:
+                    self.status_var.set("")
+        except Exception:
+            # Widget already destroyed
+            pass
+
+    def _poll(self):
+        self._polling = None
+        try:
+            for key, task in list(self.tasks.items()):
+                self._drain(task)
+                if not task.future.done():
+                    continue
+                if self.tasks.get(key) is task:
+                    del self.tasks[key]
+                self._drain(task)
+                if task.cancelled or task.future.cancelled():
+                    continue
+                error = task.future.exception()
+                if isinstance(error, TaskCancelled):
+                    continue
+                if error is not None:
+                    logging.error(f"Background task '{key}' failed: {error}")
+                    self._callback(key, task.on_error, error)
+                else:
+                    self._callback(key, task.on_done, task.future.result())
+        finally:
+            # A callback may have submitted a task, which already scheduled the next poll
+            self._set_busy()
+            if self.tasks and self._polling is None:
+                try:
+                    self._polling = self.widget.after(self.poll_ms, self._poll)
+                except Exception:
+                    self.cancel_all()
+
+    def _callback(self, key, callback, value):
+        """Run a task callback; one that raises is logged so the other tasks keep being polled"""
+        if callback is None:
+            return
+        try:
+            callback(value)
+        except Exception:
+            logging.exception(f"Callback for background task '{key}' failed")
+
+    def _drain(self, task):
+        if task.on_progress is None:
+            return
+        while not task.cancelled:
+            try:
+                value = task.updates.get_nowait()
+            except queue.Empty:
+                return
+            self._callback(task.key, task.on_progress, value)
@@ -0,0 +1,228 @@
+# batch_runner.py
+# Headless end-of-day processing for cron, e.g.
+#   0 2 * * *  cd /opt/vehicle-loans && python batch_runner.py >> batch.log 2>&1
+# Runs without a display and without tkinter installed.  Each stage checkpoints to
+# BATCH_CHECKPOINT_DIR, so re-running the same as-of date resumes where a failed run stopped.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime
+
+from database import Database
+from utils import DateUtils
+import overdue
+import rollups
+
+STAGES = ('overdue', 'late_fees', 'loan_status', 'loan_totals', 'collections', 'rollup')
+
+
+class Checkpoint:
+    """Per as-of-date JSON record of finished stages and the last key done in the running one"""
+    def __init__(self, directory, as_of, dry_run=False):
+        os.makedirs(directory, exist_ok=True)
+        suffix = '_dry_run' if dry_run else ''
+        self.path = os.path.join(directory, f"eod_{as_of.isoformat()}{suffix}.json")
+        self.data = {'as_of': as_of.isoformat(), 'stages': {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def stage(self, name):
+        return self.data['stages'].setdefault(name, {})
+
+    def is_done(self, name):
+        return self.data['stages'].get(name, {}).get('status') == 'done'
+
+    def update(self, name, **fields):
+        self.stage(name).update(fields)
+        self.save()
+
+    def save(self):
+        # Write-then-rename so a crash mid-write never leaves a truncated checkpoint
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=2, default=str)
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.data['stages'] = {}
+        self.save()
+
+
+def _ranged_step(checkpoint, stage, step, func, **kwargs):
+    """Run one chunked overdue.* job, resuming after the last key a previous run committed"""
+    state = checkpoint.stage(stage).setdefault('steps', {}).setdefault(step, {})
+    if state.get('status') == 'done':
+        logging.info(f"{stage}/{step}: already done, skipping")
+        return state
+    start_id = state['last_id'] + 1 if state.get('last_id') is not None else None
+
+    def progress(rows, last_id):
+        state.update(rows=state.get('base_rows', 0) + rows, last_id=last_id)
+        checkpoint.save()
+
+    state['base_rows'] = state.get('rows', 0)
+    summary = func(start_id=start_id, progress=None if kwargs.get('dry_run') else progress, **kwargs)
+    if summary is None:
+        raise RuntimeError(f"{stage}/{step} failed; rerun to resume after id {state.get('last_id')}")
+    state.update(status='done', rows=state.pop('base_rows') + summary['rows'],
+                 seconds=summary['seconds'], rows_per_sec=summary['rows_per_sec'])
+    if summary.get('late_fees') is not None:
+        state['late_fees'] = summary['late_fees']
+    checkpoint.save()
+    return state
+
+
+def stage_overdue(db, checkpoint, as_of, chunk_size, dry_run):
+    _ranged_step(checkpoint, 'overdue', 'mark_overdue', overdue.scan_overdue,
+                 db=db, as_of=as_of, chunk_size=chunk_size, dry_run=dry_run)
+
+
+def stage_late_fees(db, checkpoint, as_of, chunk_size, dry_run):
+    _ranged_step(checkpoint, 'late_fees', 'refresh', overdue.refresh_late_fees,
+                 db=db, as_of=as_of, chunk_size=chunk_size, dry_run=dry_run)
+
+
+def stage_loan_status(db, checkpoint, as_of, chunk_size, dry_run):
+    _ranged_step(checkpoint, 'loan_status', 'close_paid', overdue.close_paid_loans,
+                 db=db, chunk_size=chunk_size, dry_run=dry_run)
+    _ranged_step(checkpoint, 'loan_status', 'default_delinquent', overdue.default_delinquent_loans,
+                 db=db, as_of=as_of, chunk_size=chunk_size, dry_run=dry_run)
+
+
+def stage_loan_totals(db, checkpoint, as_of, chunk_size, dry_run):
+    """Rebuild the customer/agent loan totals set-wise; the Loan triggers keep them current in between"""
+    if dry_run:
+        logging.info("loan_totals: skipped in a dry run")
+        return
+    summary = rollups.refresh_loan_totals(db)
+    if summary is None:
+        raise RuntimeError("loan totals refresh failed")
+    checkpoint.update('loan_totals', **summary)
+
+
+def stage_collections(db, checkpoint, as_of, chunk_size, dry_run):
+    """Fold the day's ledger rows into CollectionRollup (dry run: only report the backlog)"""
+    if dry_run:
+        lag = rollups.collection_rollup_lag(db)
+        if lag is None:
+            raise RuntimeError("collection rollup watermark query failed")
+        checkpoint.update('collections', last_id=lag['LastID'], pending=lag['Pending'])
+        return
+    summary = rollups.refresh_collection_rollup(db, chunk_size=chunk_size)
+    if summary is None:
+        raise RuntimeError("collection rollup refresh failed")
+    checkpoint.update('collections', **summary)
+
+
+ROLLUP_QUERIES = {
+    'installments_by_status': """
+        SELECT Status, COUNT(*) as Count, SUM(TotalAmount) as Amount, SUM(LateFee) as LateFees
+        FROM Installment
+        GROUP BY Status
+    """,
+    'loans_by_status': """
+        SELECT Status, COUNT(*) as Count, SUM(BalanceAmount) as Outstanding
+        FROM Loan
+        GROUP BY Status
+    """,
+    'collections_on_day': """
+        SELECT COUNT(*) as Payments, COALESCE(SUM(DebitAmount), 0) as Collected
+        FROM TransactionLogger
+        WHERE TransactionType = 'EMI Payment' AND DebitAmount > 0
+        AND TransactionDate >= %s AND TransactionDate < %s + INTERVAL 1 DAY
+    """,
+}
+
+
+def stage_rollup(db, checkpoint, as_of, chunk_size, dry_run):
+    """End-of-day portfolio summary, stored in the checkpoint and logged"""
+    summary = {}
+    for name, query in ROLLUP_QUERIES.items():
+        params = (as_of,) * query.count('%s') or None
+        rows = db.execute_query(query, params)
+        if rows is None:
+            raise RuntimeError(f"rollup query '{name}' failed")
+        summary[name] = rows
+        logging.info(f"rollup/{name}: {json.dumps(rows, default=str)}")
+    checkpoint.update('rollup', summary=summary)
+
+
+STAGE_FUNCS = {
+    'overdue': stage_overdue,
+    'late_fees': stage_late_fees,
+    'loan_status': stage_loan_status,
+    'loan_totals': stage_loan_totals,
+    'collections': stage_collections,
+    'rollup': stage_rollup,
+}
+
+
+def run(as_of, stages=STAGES, chunk_size=50000, dry_run=False, restart=False, checkpoint_dir=None):
+    """Run the given stages in order for as_of; returns True when all of them finished"""
+    checkpoint = Checkpoint(checkpoint_dir or os.getenv('BATCH_CHECKPOINT_DIR', 'batch_checkpoints'),
+                            as_of, dry_run)
+    if restart:
+        checkpoint.reset()
+
+    try:
+        db = Database()
+    except Exception as e:
+        logging.error(f"Cannot connect to database: {e}")
+        return False
+    try:
+        for name in stages:
+            if checkpoint.is_done(name):
+                logging.info(f"Stage {name}: already done for {as_of}, skipping")
+                continue
+            logging.info(f"Stage {name}: starting for {as_of}{' (dry run)' if dry_run else ''}")
+            started = time.perf_counter()
+            checkpoint.stage(name).pop('error', None)
+            checkpoint.update(name, status='running', started_at=datetime.now().isoformat())
+            try:
+                STAGE_FUNCS[name](db, checkpoint, as_of, chunk_size, dry_run)
+            except Exception as e:
+                logging.error(f"Stage {name} failed: {e}")
+                checkpoint.update(name, status='failed', error=str(e))
+                return False
+            checkpoint.update(name, status='done', finished_at=datetime.now().isoformat(),
+                              seconds=round(time.perf_counter() - started, 3))
+            logging.info(f"Stage {name}: done in {checkpoint.stage(name)['seconds']}s")
+        return True
+    finally:
+        db.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-of-day batch processing for the vehicle loan system")
+    parser.add_argument('--as-of', type=date.fromisoformat, default=DateUtils.today(),
+                        help="business date to process (YYYY-MM-DD, default $LOAN_AS_OF or today)")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma separated subset of {','.join(STAGES)} (run in that order)")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="ids per UPDATE/commit")
+    parser.add_argument('--dry-run', action='store_true', help="count what would change without writing")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start over")
+    parser.add_argument('--checkpoint-dir', help="where checkpoints go (default $BATCH_CHECKPOINT_DIR or batch_checkpoints)")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGE_FUNCS]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    args.stages = [s for s in STAGES if s in stages]
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    ok = run(args.as_of, args.stages, args.chunk_size, args.dry_run, args.restart, args.checkpoint_dir)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# charts.py
+# Admin analytics charts drawn off the Tk thread with matplotlib's Agg canvas and cached as PNGs.
+# Each chart's file is keyed by the version of the data behind it, so reopening the window shows
+# the last image at once and only redraws when the data changed.  enhancements.show_admin_graphs
+# runs render_chart on the dashboard worker pool.
+
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from rollups import COLLECTION_ROLLUP, LEDGER_MONTHLY_COLLECTION_QUERY, refresh_collection_rollup, monthly_collections
+
+logger = logging.getLogger(__name__)
+
+CHART_SIZE = (4.5, 3.5)
+CHART_DPI = 100
+
+LOAN_STATUS_QUERY = "SELECT Status, COUNT(*) as cnt FROM Loan GROUP BY Status ORDER BY Status"
+
+
+def chart_dir():
+    path = os.getenv('CHART_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'vehicle_loan_charts')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _loan_status_data(db):
+    """(version, rows): the status counts are a handful of rows, so they are their own version"""
+    rows = db.execute_query(LOAN_STATUS_QUERY)
+    if rows is None:
+        return None, None
+    return repr([(r['Status'], r['cnt']) for r in rows]), rows
+
+
+def _draw_loan_status(ax, rows):
+    sizes = [r['cnt'] for r in rows]
+    if sizes:
+        ax.pie(sizes, labels=[r['Status'] or 'Unknown' for r in rows], autopct='%1.1f%%')
+    ax.set_title("Loan Status Distribution")
+
+
+def _monthly_collection_data(db):
+    """(version, rows) from the CollectionRollup watermark; rows are only read when that changed"""
+    if refresh_collection_rollup(db) is None:
+        # A stale rollup would be drawn as current, so group the ledger and key the chart by its rows
+        logger.warning("Collection rollup could not be refreshed; drawing the collection chart from the ledger")
+        rows = db.execute_query(LEDGER_MONTHLY_COLLECTION_QUERY + " LIMIT 12")
+        if rows is None:
+            return None, None
+        return 'ledger:' + repr([(r['Month'], r['TotalCollection']) for r in rows]), rows
+    marks = db.execute_query("SELECT LastID, UpdatedAt FROM RollupWatermark WHERE RollupName = %s",
+                             (COLLECTION_ROLLUP,))
+    if not marks:
+        return None, None
+    version = f"{marks[0]['LastID']}:{marks[0]['UpdatedAt']}"
+    return version, lambda: monthly_collections(db, 12)
+
+
+def _draw_monthly_collection(ax, rows):
+    rows = rows[::-1]
+    mon = [r['Month'] for r in rows]
+    if mon:
+        ax.bar(mon, [float(r['TotalCollection'] or 0) for r in rows])
+        ax.set_xticks(range(len(mon)))
+        ax.set_xticklabels(mon, rotation=45, ha='right')
+    ax.set_title("Monthly EMI Collection")
+
+
+# name -> (status label, data source, drawing function)
+CHARTS = {
+    'loan_status': ("loan status chart", _loan_status_data, _draw_loan_status),
+    'monthly_collection': ("collection chart", _monthly_collection_data, _draw_monthly_collection),
+}
+
+
+def _chart_path(name, version):
+    key = hashlib.md5(str(version).encode()).hexdigest()[:12]
+    return os.path.join(chart_dir(), f"{name}_{key}.png")
+
+
+def _rendered(name):
+    """PNGs on disk for a chart, newest first (files removed meanwhile by another render are skipped)"""
+    found = []
+    for path in glob.glob(os.path.join(chart_dir(), f"{name}_*.png")):
+        try:
+            found.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+    return [path for _, path in sorted(found, reverse=True)]
+
+
+def cached_chart(name):
+    """Most recently rendered PNG for a chart, whatever its data version, or None"""
+    paths = _rendered(name)
+    return paths[0] if paths else None
+
+
+def render_chart(db, name):
+    """Path of the PNG for the current data of a chart in CHARTS, drawing it only if it is not cached.
+
+    Safe to call from worker threads: only the Agg canvas is used, never
+    pyplot.  Once the new version is written, all but the one it replaces
+    are removed.  Returns None if the data could not be read.
+    """
+    _, source, draw = CHARTS[name]
+    version, rows = source(db)
+    if version is None:
+        return None
+    path = _chart_path(name, version)
+    if os.path.isfile(path):
+        return path
+
+    if callable(rows):
+        rows = rows()
+        if rows is None:
+            return None
+    fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    FigureCanvasAgg(fig)
+    draw(fig.add_subplot(111), rows)
+    fig.tight_layout()
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fig.savefig(tmp, format='png')
+    os.replace(tmp, path)
+
+    # The version this one replaces may still be loading in another window, so only older ones go
+    for old in [p for p in _rendered(name) if p != path][1:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    logger.debug(f"Rendered {name} chart for data version {version}")
+    return path
@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime
 from enhancements import show_customer_profile, generate_loan_pdf
+from background import BackgroundRunner
+from utils import DateUtils
 
 class CustomerDashboard:
     def __init__(self, login_window, user, db):
@@ -18,6 +20,9 @@ class CustomerDashboard:
         self.window.protocol("WM_DELETE_WINDOW", self.logout)
         self.window.deiconify()
         
+        self.status_var = tk.StringVar()
+        self.tasks = BackgroundRunner(self.window, self.status_var)
+        
         self.setup_ui()
         self.load_customer_data()
     
@@ -44,6 +49,9 @@ class CustomerDashboard:
                               bg='#e74c3c', fg='white', font=('Arial', 12))
         logout_btn.pack(side='right', padx=20, pady=20)
         
+        tk.Label(self.window, textvariable=self.status_var, anchor='w',
+                fg='#7f8c8d', bg='#ecf0f1').pack(side='bottom', fill='x', padx=10)
+        
         self.notebook = ttk.Notebook(self.window)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
         
@@ -89,7 +97,7 @@ class CustomerDashboard:
         installments_tree_frame.pack(fill='both', expand=True, pady=10)
         
         self.installments_tree = ttk.Treeview(installments_tree_frame,
-                                             columns=('DueDate', 'Amount', 'Status', 'LateFee', 'PaidDate'),
+                                             columns=('DueDate', 'Amount', 'Status', 'DaysOverdue', 'LateFee', 'PaidDate'),
                                              show='headings', height=8)
         
         for col in self.installments_tree['columns']:
@@ -134,9 +142,6 @@ class CustomerDashboard:
         self.load_payment_history()
     
     def load_my_loans(self):
-        for item in self.loans_tree.get_children():
-            self.loans_tree.delete(item)
-        
         query = """
             SELECT l.LoanID, v.VehicleNo as Vehicle, l.LoanAmount, l.BalanceAmount, 
                    l.EMAmount as EMI, l.Status
@@ -146,7 +151,13 @@ class CustomerDashboard:
             ORDER BY l.LoanID DESC
         """
         
-        loans = self.db.execute_query(query, (self.customer_id,))
+        self.tasks.submit('my_loans', self.db.execute_query, query, (self.customer_id,), label='loans',
+                          on_done=self._show_my_loans)
+    
+    def _show_my_loans(self, loans):
+        for item in self.loans_tree.get_children():
+            self.loans_tree.delete(item)
+        
         if loans:
             for loan in loans:
                 self.loans_tree.insert('', 'end', values=(
@@ -164,9 +175,6 @@ class CustomerDashboard:
         self.load_loan_installments(loan_id)
     
     def load_loan_installments(self, loan_id):
-        for item in self.installments_tree.get_children():
-            self.installments_tree.delete(item)
-        
         query = """
             SELECT DueDate, TotalAmount as Amount, Status, LateFee, PaidDate
             FROM Installment
@@ -174,19 +182,29 @@ class CustomerDashboard:
             ORDER BY DueDate
         """
         
-        installments = self.db.execute_query(query, (loan_id,))
+        self.tasks.submit('installments', self.db.execute_query, query, (loan_id,), replace=True,
+                          on_done=self._show_installments)
+    
+    def _show_installments(self, installments):
+        for item in self.installments_tree.get_children():
+            self.installments_tree.delete(item)
+        
         if installments:
+            # Late fee as of today for everything unpaid, so it does not wait for the nightly scan
+            unpaid = [i for i in installments if i['Status'] != 'Paid']
+            fees = DateUtils.late_fee_batch([i['DueDate'] for i in unpaid], [i['Amount'] for i in unpaid])
+            current = {id(inst): (int(days), fee)
+                       for inst, days, fee in zip(unpaid, fees['days_overdue'], fees['late_fee'])}
+            
             for installment in installments:
                 paid_date = installment['PaidDate'] if installment['PaidDate'] else 'Not Paid'
+                days_overdue, late_fee = current.get(id(installment), (0, installment['LateFee']))
                 self.installments_tree.insert('', 'end', values=(
                     installment['DueDate'], installment['Amount'],
-                    installment['Status'], installment['LateFee'], paid_date
+                    installment['Status'], days_overdue, f"{late_fee:.2f}", paid_date
                 ))
     
     def load_payment_history(self):
-        for item in self.history_tree.get_children():
-            self.history_tree.delete(item)
-        
         query = """
             SELECT tl.TransactionDate as Date, tl.LoanID, tl.DebitAmount as Amount,
                    tl.TransactionType as Type, tl.Remarks
@@ -196,7 +214,13 @@ class CustomerDashboard:
             ORDER BY tl.TransactionDate DESC
         """
         
-        transactions = self.db.execute_query(query, (self.customer_id,))
+        self.tasks.submit('history', self.db.execute_query, query, (self.customer_id,), label='payment history',
+                          on_done=self._show_payment_history)
+    
+    def _show_payment_history(self, transactions):
+        for item in self.history_tree.get_children():
+            self.history_tree.delete(item)
+        
         if transactions:
             for trans in transactions:
                 self.history_tree.insert('', 'end', values=(
@@ -215,10 +239,19 @@ class CustomerDashboard:
                     messagebox.showinfo("No loans", "You have no loans")
                     return
                 loan_id = self.loans_tree.item(items[0])['values'][0]
-            generate_loan_pdf(self.db, loan_id, parent=self.window)
+            self.tasks.submit('pdf', generate_loan_pdf, self.db, loan_id, notify=False, label=f"PDF for loan {loan_id}",
+                              on_done=self._pdf_exported,
+                              on_error=lambda e: messagebox.showerror("Error", f"Export failed: {e}"))
         except Exception as e:
             messagebox.showerror("Error", f"Export failed: {e}")
     
+    def _pdf_exported(self, fname):
+        if fname:
+            messagebox.showinfo("PDF Generated", f"Loan PDF saved to {fname}")
+        else:
+            messagebox.showerror("Error", "Failed to generate PDF, see the log for details")
+    
     def logout(self):
+        self.tasks.close()
         self.window.destroy()
         self.login_window.deiconify()
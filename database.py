@@ -1,36 +1,221 @@
 import mysql.connector
-from mysql.connector import Error, pooling
+from mysql.connector import Error
 import hashlib
 import os
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from db_pool import ConnectionPool
+from query_cache import QueryCache, tables_read, tables_written, procedure_tables
+from query_stats import QueryStats, StatementTimer, estimate_payload
+from money import to_db
+
+PREPARABLE_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+# Demo queries over summary views that are cheap to cache for a short while (seconds)
+COMPLEX_QUERY_CACHE_TTL = {'view_demo': 60, 'function_demo': 60, 'aggregate_join': 60}
+LOCKING_READ_CLAUSES = ('FOR UPDATE', 'FOR SHARE', 'LOCK IN SHARE MODE')
+
+INSERT_INSTALLMENT = """
+    INSERT INTO Installment (LoanID, DueDate, PrincipalAmount, InterestAmount, TotalAmount, Status)
+    VALUES (%s, %s, %s, %s, %s, 'Pending')
+"""
+
+def is_read_query(query):
+    """True for plain SELECTs that are safe to serve from a read replica"""
+    text = query.lstrip().upper()
+    if not text.startswith(('SELECT', 'WITH')):
+        return False
+    return not any(clause in text for clause in LOCKING_READ_CLAUSES)
 
 class Database:
-    def __init__(self):
+    def __init__(self, **pool_options):
         self.host = os.getenv('DB_HOST', 'localhost')
         self.user = os.getenv('DB_USER', 'root')
         self.password = os.getenv('DB_PASSWORD', '1234')
         self.database = os.getenv('DB_NAME', 'VehicleLoanDB')
+        
+        # Pool settings: keyword arguments override the DB_POOL_* environment variables
+        self.pool_size = int(pool_options.get('pool_size', os.getenv('DB_POOL_SIZE', 5)))
+        self.pool_max_overflow = int(pool_options.get('max_overflow', os.getenv('DB_POOL_MAX_OVERFLOW', 5)))
+        self.pool_timeout = float(pool_options.get('timeout', os.getenv('DB_POOL_TIMEOUT', 30)))
+        self.pool_recycle = float(pool_options.get('recycle', os.getenv('DB_POOL_RECYCLE', 3600)))
+        self.pool_pre_ping = str(pool_options.get('pre_ping', os.getenv('DB_POOL_PRE_PING', '1'))).lower() in ('1', 'true', 'yes')
+        
+        # Prepared statements kept per pooled connection; 0 disables the cache
+        self.stmt_cache_size = int(pool_options.get('stmt_cache_size', os.getenv('DB_STMT_CACHE_SIZE', 32)))
+        self.stmt_cache_hits = 0
+        self.stmt_cache_misses = 0
+        self._stats_lock = threading.Lock()
+        
+        # Read replicas: DB_REPLICA_HOSTS="host1,host2:3307" (same credentials as the primary)
+        replica_hosts = pool_options.get('replica_hosts', os.getenv('DB_REPLICA_HOSTS', ''))
+        if isinstance(replica_hosts, str):
+            replica_hosts = [h.strip() for h in replica_hosts.split(',') if h.strip()]
+        self.replica_hosts = list(replica_hosts)
+        self.replica_timeout = float(pool_options.get('replica_timeout', os.getenv('DB_REPLICA_TIMEOUT', 2)))
+        self.replica_retry = float(pool_options.get('replica_retry', os.getenv('DB_REPLICA_RETRY', 30)))
+        # Reads stay on the primary for this many seconds after a write so callers see their own changes
+        self.read_your_writes_window = float(pool_options.get('read_your_writes_window',
+                                                              os.getenv('DB_READ_YOUR_WRITES_WINDOW', 5)))
+        self.replica_pools = []
+        self._replica_down_until = {}
+        self._replica_turn = 0
+        # Per thread: primary_session() depth.  The write time is process-wide: follow-up reads
+        # after a commit often run on another worker thread of the dashboard pool
+        self._session = threading.local()
+        self._last_write = 0.0
+        self.routing_counts = {'primary_reads': 0, 'replica_reads': 0, 'replica_fallbacks': 0}
+        
+        # Result cache for execute_query(..., cache_ttl=...); 0 disables it
+        cache_size = int(pool_options.get('query_cache_size', os.getenv('DB_QUERY_CACHE_SIZE', 256)))
+        self.query_cache = QueryCache(cache_size) if cache_size > 0 else None
+        
+        # Per-statement timings; calls slower than DB_SLOW_QUERY_MS go to DB_SLOW_QUERY_LOG
+        self.query_stats = QueryStats(
+            window=int(pool_options.get('stats_window', os.getenv('DB_STATS_WINDOW', 500))),
+            slow_ms=float(pool_options.get('slow_query_ms', os.getenv('DB_SLOW_QUERY_MS', 500))),
+            slow_log=pool_options.get('slow_query_log', os.getenv('DB_SLOW_QUERY_LOG', 'slow_query.log'))
+        )
+        
         self.connection_pool = None
         self.init_pool()
     
     def init_pool(self):
         try:
-            self.connection_pool = pooling.MySQLConnectionPool(
-                pool_name="loan_pool",
-                pool_size=5,
+            self.connection_pool = ConnectionPool(
+                pool_size=self.pool_size,
+                max_overflow=self.pool_max_overflow,
+                timeout=self.pool_timeout,
+                recycle=self.pool_recycle,
+                pre_ping=self.pool_pre_ping,
                 host=self.host,
                 user=self.user,
                 password=self.password,
                 database=self.database,
                 autocommit=False
             )
-            logging.info("Database connection pool created successfully")
+            # Open one connection up front so bad credentials fail at startup
+            self.connection_pool.get_connection().close()
+            logging.info(f"Database connection pool created successfully "
+                         f"(size={self.pool_size}, overflow={self.pool_max_overflow}, timeout={self.pool_timeout}s)")
         except Error as e:
             logging.error(f"Error creating connection pool: {e}")
             raise
+        
+        for replica in self.replica_hosts:
+            host, _, port = replica.partition(':')
+            self.replica_pools.append(ConnectionPool(
+                pool_size=self.pool_size,
+                max_overflow=self.pool_max_overflow,
+                timeout=self.replica_timeout,
+                recycle=self.pool_recycle,
+                pre_ping=self.pool_pre_ping,
+                host=host,
+                port=int(port or 3306),
+                user=self.user,
+                password=self.password,
+                database=self.database,
+                autocommit=False
+            ))
+        if self.replica_pools:
+            logging.info(f"Routing reads to {len(self.replica_pools)} replica(s): {', '.join(self.replica_hosts)}")
+    
+    def statement_cache_stats(self):
+        """Prepared-statement cache hit/miss counters across all pooled connections"""
+        with self._stats_lock:
+            lookups = self.stmt_cache_hits + self.stmt_cache_misses
+            return {
+                'size_per_connection': self.stmt_cache_size,
+                'hits': self.stmt_cache_hits,
+                'misses': self.stmt_cache_misses,
+                'hit_rate': round(self.stmt_cache_hits / lookups, 3) if lookups else 0.0,
+            }
+    
+    def pool_stats(self):
+        """Live connection pool statistics (see ConnectionPool.stats)"""
+        if not self.connection_pool:
+            return {}
+        stats = self.connection_pool.stats()
+        if self.replica_pools:
+            stats['replicas'] = {host: pool.stats() for host, pool in zip(self.replica_hosts, self.replica_pools)}
+            with self._stats_lock:
+                stats['routing'] = dict(self.routing_counts)
+        return stats
+    
+    @contextmanager
+    def primary_session(self):
+        """Pin every read made on this thread inside the block to the primary"""
+        depth = getattr(self._session, 'pinned', 0)
+        self._session.pinned = depth + 1
+        try:
+            yield self
+        finally:
+            self._session.pinned = depth
+    
+    def _mark_write(self, tables=()):
+        """Record a committed write: reads stay on the primary for the read-your-writes window"""
+        self._last_write = time.monotonic()
+        if tables and self.query_cache:
+            self.query_cache.invalidate(tables)
     
-    def get_connection(self):
+    def invalidate_cache(self, *tables):
+        """Drop cached results that read any of tables, and start the read-your-writes window.
+
+        execute_query, execute_batch and call_procedure do this themselves;
+        code that writes through a raw get_connection() must call it after commit.
+        """
+        self._mark_write(tables)
+    
+    def query_cache_stats(self):
+        return self.query_cache.stats() if self.query_cache else {}
+    
+    def dump_query_stats(self, limit=20):
+        """Log and return the per-statement latency table, slowest total time first"""
+        table = self.query_stats.format_table(limit)
+        logging.info(f"Query statistics:\n{table}")
+        return table
+    
+    def _reads_pinned_to_primary(self):
+        if getattr(self._session, 'pinned', 0):
+            return True
+        return time.monotonic() - self._last_write < self.read_your_writes_window
+    
+    def _get_replica_connection(self):
+        """Check out a connection from the next healthy replica, or None if none is usable"""
+        now = time.monotonic()
+        for _ in range(len(self.replica_pools)):
+            with self._stats_lock:
+                index = self._replica_turn % len(self.replica_pools)
+                self._replica_turn += 1
+            if self._replica_down_until.get(index, 0) > now:
+                continue
+            try:
+                return self.replica_pools[index].get_connection()
+            except Error as e:
+                logging.warning(f"Replica {self.replica_hosts[index]} unavailable, skipping for "
+                                f"{self.replica_retry:.0f}s: {e}")
+                self._replica_down_until[index] = now + self.replica_retry
+        return None
+    
+    def get_connection(self, readonly=False):
+        """Check out a connection.
+
+        Writes (the default) always go to the primary.  With readonly=True the
+        connection comes from a read replica when one is configured and the
+        caller is not inside a read-your-writes window or primary_session().
+        """
+        if readonly and self.replica_pools:
+            conn = None if self._reads_pinned_to_primary() else self._get_replica_connection()
+            with self._stats_lock:
+                if conn is not None:
+                    self.routing_counts['replica_reads'] += 1
+                    return conn
+                self.routing_counts['primary_reads'] += 1
+                if not self._reads_pinned_to_primary():
+                    self.routing_counts['replica_fallbacks'] += 1
         try:
             if self.connection_pool:
                 return self.connection_pool.get_connection()
@@ -64,6 +249,7 @@ class Database:
     
     def authenticate_user(self, username, password, role):
         try:
+            # Primary: an account registered moments ago may not have reached the replicas
             conn = self.get_connection()
             cursor = conn.cursor(dictionary=True)
             
@@ -95,22 +281,84 @@ class Database:
                 conn.close()
             return None
     
-    def execute_query(self, query, params=None, fetch=True):
+    def _use_prepared(self, conn, query, params):
+        return (self.stmt_cache_size > 0 and params and isinstance(params, (tuple, list))
+                and hasattr(conn, 'prepared_cursor')
+                and query.lstrip()[:7].upper().startswith(PREPARABLE_STATEMENTS))
+    
+    def _execute_prepared(self, conn, query, params, fetch, timer):
+        """Run a parameterised statement through the connection's prepared-statement cache"""
+        cursor, sql, hit = conn.prepared_cursor(query, self.stmt_cache_size)
+        with self._stats_lock:
+            if hit:
+                self.stmt_cache_hits += 1
+            else:
+                self.stmt_cache_misses += 1
+        try:
+            cursor.execute(sql, tuple(params))
+            timer.lap('execute')
+            rows = cursor.fetchall() if cursor.with_rows else None
+            timer.lap('fetch')
+        except Error:
+            conn.evict_prepared(query)
+            raise
+        
+        if fetch and query.strip().upper().startswith('SELECT'):
+            columns = cursor.column_names
+            return [dict(zip(columns, row)) for row in rows or ()]
+        conn.commit()
+        self._mark_write(tables_written(query))
+        return cursor.lastrowid if not fetch else None
+    
+    def execute_query(self, query, params=None, fetch=True, cache_ttl=None):
+        """Run a statement and return its rows (SELECT), lastrowid (fetch=False) or None on error.
+
+        With cache_ttl (seconds) a SELECT result is served from the in-process
+        query cache until it expires or one of the tables it reads is written.
+        """
+        if not (cache_ttl and fetch and self.query_cache and is_read_query(query)):
+            return self._run_query(query, params, fetch)
+        
+        key = (query, tuple(params or ()))
+        rows = self.query_cache.get(key)
+        if rows is not None:
+            return rows
+        tables = tables_read(query)
+        snapshot = self.query_cache.snapshot(tables)
+        rows = self._run_query(query, params, fetch)
+        if rows is not None:
+            self.query_cache.put(key, rows, cache_ttl, tables, snapshot)
+        return rows
+    
+    def _run_query(self, query, params, fetch):
         conn = None
+        result = None
+        failed = False
+        timer = StatementTimer()
         try:
-            conn = self.get_connection()
+            conn = self.get_connection(readonly=fetch and is_read_query(query))
+            timer.lap('checkout')
+            if self._use_prepared(conn, query, params):
+                result = self._execute_prepared(conn, query, params, fetch, timer)
+                return result
+            
             cursor = conn.cursor(dictionary=True)
             cursor.execute(query, params or ())
+            timer.lap('execute')
             
             if fetch and query.strip().upper().startswith('SELECT'):
                 result = cursor.fetchall()
+                timer.lap('fetch')
             else:
                 conn.commit()
+                timer.lap('execute')
+                self._mark_write(tables_written(query))
                 result = cursor.lastrowid if not fetch else None
             
             cursor.close()
             return result
         except Error as e:
+            failed = True
             logging.error(f"Query error: {e}")
             if conn:
                 conn.rollback()
@@ -118,22 +366,149 @@ class Database:
         finally:
             if conn:
                 conn.close()
+            rows = result if isinstance(result, list) else None
+            self.query_stats.record(query, timer, len(rows) if rows else 0, estimate_payload(rows),
+                                    error=failed, params=params)
+    
+    def iter_query(self, query, params=None, chunk_size=500):
+        """Stream a SELECT through an unbuffered cursor, yielding lists of up to chunk_size rows.
+
+        The pooled connection is held only while the iterator is live and is
+        released once it is exhausted or closed early.
+        """
+        conn = None
+        cursor = None
+        failed = False
+        row_count = 0
+        payload = 0
+        timer = StatementTimer()
+        try:
+            conn = self.get_connection(readonly=is_read_query(query))
+            timer.lap('checkout')
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, params or ())
+            timer.lap('execute')
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                timer.lap('fetch')
+                if not rows:
+                    break
+                row_count += len(rows)
+                payload += estimate_payload(rows)
+                yield rows
+                # Time the caller spends on a chunk is not query time
+                timer.pause()
+        except Error as e:
+            failed = True
+            logging.error(f"Streaming query error: {e}")
+            raise
+        finally:
+            self.query_stats.record(query, timer, row_count, payload, error=failed, params=params)
+            if conn:
+                try:
+                    # Drain whatever the caller did not read so the connection
+                    # goes back to the pool clean
+                    conn.consume_results()
+                    if cursor:
+                        cursor.close()
+                except Error as e:
+                    logging.warning(f"Could not drain streaming cursor: {e}")
+                conn.close()
+    
+    def execute_batch(self, query, rows, chunk_size=1000, progress=None):
+        """Run a write statement for every parameter tuple in rows, committing once per chunk.
+
+        rows may be any iterable, including a generator.  INSERT ... VALUES
+        statements go out as multi-row INSERTs (executemany rewrites them);
+        other statements are executed row by row on one connection.
+        progress, if given, is called with the running row count after each
+        commit.  Returns a dict with rows, chunks, seconds and rows_per_sec,
+        or None on error; chunks committed before the failure are kept.
+        """
+        conn = None
+        done = 0
+        chunks = 0
+        started = time.perf_counter()
+        try:
+            timer = StatementTimer()
+            conn = self.get_connection()
+            timer.lap('checkout')
+            cursor = conn.cursor()
+            it = iter(rows)
+            while True:
+                chunk = list(islice(it, chunk_size))
+                if not chunk:
+                    break
+                timer.pause()
+                cursor.executemany(query, chunk)
+                conn.commit()
+                timer.lap('execute')
+                # One stats entry per chunk so the slow log flags individual slow commits
+                self.query_stats.record(query, timer, len(chunk))
+                timer = StatementTimer()
+                self._mark_write(tables_written(query))
+                done += len(chunk)
+                chunks += 1
+                if progress:
+                    progress(done)
+            cursor.close()
+            
+            elapsed = time.perf_counter() - started
+            stats = {
+                'rows': done,
+                'chunks': chunks,
+                'seconds': round(elapsed, 3),
+                'rows_per_sec': round(done / elapsed, 1) if elapsed > 0 else float(done),
+            }
+            logging.info(f"Batch write: {done} rows in {chunks} chunks, "
+                         f"{stats['seconds']}s ({stats['rows_per_sec']} rows/sec)")
+            return stats
+        except Error as e:
+            logging.error(f"Batch write error after {done} committed rows: {e}")
+            if conn:
+                conn.rollback()
+            return None
+        finally:
+            if conn:
+                conn.close()
+    
+    def insert_installments(self, cursor, loan_id, schedule):
+        """Write a LoanCalculator.calculate_installments schedule as one multi-row INSERT.
+
+        Runs on the caller's cursor so the rows join the transaction that
+        created the loan; the caller commits and invalidates the cache.
+        """
+        rows = [(loan_id, inst['due_date'], to_db(inst['principal_amount']), to_db(inst['interest_amount']),
+                 to_db(inst['total_amount'])) for inst in schedule]
+        timer = StatementTimer()
+        cursor.executemany(INSERT_INSTALLMENT, rows)
+        timer.lap('execute')
+        self.query_stats.record(INSERT_INSTALLMENT, timer, len(rows))
+        return len(rows)
     
     def call_procedure(self, procedure_name, params=None):
         conn = None
+        results = []
+        failed = False
+        timer = StatementTimer()
         try:
             conn = self.get_connection()
+            timer.lap('checkout')
             cursor = conn.cursor(dictionary=True)
             cursor.callproc(procedure_name, params or ())
+            timer.lap('execute')
             
-            results = []
             for result in cursor.stored_results():
                 results.extend(result.fetchall())
+            timer.lap('fetch')
             
             conn.commit()
+            timer.lap('execute')
+            self._mark_write(procedure_tables(procedure_name))
             cursor.close()
             return results
         except Error as e:
+            failed = True
             logging.error(f"Procedure error: {e}")
             if conn:
                 conn.rollback()
@@ -141,9 +516,13 @@ class Database:
         finally:
             if conn:
                 conn.close()
+            placeholders = ', '.join(['%s'] * len(params or ()))
+            self.query_stats.record(f"CALL {procedure_name}({placeholders})", timer, len(results),
+                                    estimate_payload(results), error=failed, params=params)
     
     def get_all_branches(self):
-        return self.execute_query("SELECT BranchID, BranchName FROM Branch WHERE BranchID IS NOT NULL")
+        return self.execute_query("SELECT BranchID, BranchName FROM Branch WHERE BranchID IS NOT NULL",
+                                  cache_ttl=300)
     
     def create_agent(self, branch_id, name, role, phone, email, salary, hire_date, username, password):
         conn = None
@@ -172,6 +551,7 @@ class Database:
             cursor.execute(user_query, (agent_id, username, hashed_password))
             
             conn.commit()
+            self.invalidate_cache('Agent', 'Users')
             return True
             
         except Exception as e:
@@ -210,6 +590,7 @@ class Database:
             cursor.execute(user_query, (customer_id, username, hashed_password))
             
             conn.commit()
+            self.invalidate_cache('Customer', 'Users')
             return True
             
         except Exception as e:
@@ -234,7 +615,7 @@ class Database:
         """
         return self.execute_query(query)
     
-    def execute_complex_query(self, query_type):
+    def complex_query_sql(self, query_type):
         queries = {
             'nested_query': """
                 SELECT CustomerID, CONCAT(FirstName, ' ', LastName) as CustomerName,
@@ -296,17 +677,18 @@ class Database:
                 ORDER BY DaysOverdue DESC
             """,
             'function_demo': """
-                SELECT CustomerID, CONCAT(FirstName, ' ', LastName) as CustomerName,
-                       CalculateCreditScore(CustomerID) as CreditScore,
+                SELECT c.CustomerID, CONCAT(c.FirstName, ' ', c.LastName) as CustomerName,
+                       s.CreditScore,
                        CASE 
-                           WHEN CalculateCreditScore(CustomerID) >= 750 THEN 'Excellent'
-                           WHEN CalculateCreditScore(CustomerID) >= 650 THEN 'Good'
-                           WHEN CalculateCreditScore(CustomerID) >= 550 THEN 'Fair'
+                           WHEN s.CreditScore >= 750 THEN 'Excellent'
+                           WHEN s.CreditScore >= 650 THEN 'Good'
+                           WHEN s.CreditScore >= 550 THEN 'Fair'
                            ELSE 'Poor'
                        END as CreditRating
-                FROM Customer
-                WHERE CustomerID IN (SELECT DISTINCT CustomerID FROM Loan)
-                ORDER BY CreditScore DESC
+                FROM CustomerLoanTotals s
+                JOIN Customer c ON s.CustomerID = c.CustomerID
+                WHERE s.TotalLoans > 0
+                ORDER BY s.CreditScore DESC
             """,
             'procedure_demo': """
                 SELECT LoanID, CustomerID, LoanAmount, InterestRate, TenureMonths, SanctionDate
@@ -316,11 +698,29 @@ class Database:
             """
         }
         
-        if query_type in queries:
-            return self.execute_query(queries[query_type])
+        return queries.get(query_type)
+    
+    def execute_complex_query(self, query_type):
+        query = self.complex_query_sql(query_type)
+        if query:
+            return self.execute_query(query, cache_ttl=COMPLEX_QUERY_CACHE_TTL.get(query_type))
         return None
     
+    def iter_complex_query(self, query_type, chunk_size=500):
+        query = self.complex_query_sql(query_type)
+        if not query:
+            return iter(())
+        if query_type in COMPLEX_QUERY_CACHE_TTL:
+            # Small cached summaries come back in one chunk
+            rows = self.execute_complex_query(query_type)
+            return iter([rows] if rows else [])
+        return self.iter_query(query, chunk_size=chunk_size)
+    
     def close(self):
         """Close all connections in pool"""
         if self.connection_pool:
-            self.connection_pool._remove_connections()
\ No newline at end of file
+            logging.info(f"Connection pool stats at shutdown: {self.pool_stats()}")
+            self.dump_query_stats()
+            self.connection_pool.close_all()
+        for pool in self.replica_pools:
+            pool.close_all()
\ No newline at end of file
@@ -179,6 +179,56 @@ CREATE TABLE Users (
     FOREIGN KEY (AgentID) REFERENCES Agent(AgentID) ON DELETE CASCADE
 );
 
+-- CollectionRollup Table: TransactionLogger summed per month, branch, agent and type.
+-- Kept current by rollups.py from RollupWatermark; read by the collection report and charts.
+CREATE TABLE CollectionRollup (
+    Month DATE NOT NULL, -- first day of the month
+    BranchID INT NOT NULL,
+    AgentID INT NOT NULL,
+    TransactionType ENUM('EMI Payment', 'Late Fee', 'Prepayment', 'Loan Disbursement') NOT NULL,
+    Transactions INT NOT NULL DEFAULT 0,
+    DebitAmount DECIMAL(14,2) NOT NULL DEFAULT 0,
+    CreditAmount DECIMAL(14,2) NOT NULL DEFAULT 0,
+    UpdatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (Month, BranchID, AgentID, TransactionType)
+);
+
+-- CustomerLoanTotals Table: per-customer loan counts and sums, and the credit score derived from them.
+-- Loan triggers keep the row current; RefreshLoanTotals recomputes every row in one pass.
+-- The scoring rule lives in the generated column: 850, less 100 per defaulted loan and 50 for
+-- more than 2 active loans, never below 300.
+CREATE TABLE CustomerLoanTotals (
+    CustomerID INT PRIMARY KEY,
+    TotalLoans INT NOT NULL DEFAULT 0,
+    ActiveLoans INT NOT NULL DEFAULT 0,
+    DefaultedLoans INT NOT NULL DEFAULT 0,
+    TotalLoanAmount DECIMAL(16,2) NOT NULL DEFAULT 0,
+    TotalBalance DECIMAL(16,2) NOT NULL DEFAULT 0,
+    CreditScore INT AS (GREATEST(300, 850 - 100 * DefaultedLoans - IF(ActiveLoans > 2, 50, 0))) STORED,
+    UpdatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (CustomerID) REFERENCES Customer(CustomerID) ON DELETE CASCADE,
+    INDEX idx_credit_score (CreditScore)
+);
+
+-- AgentLoanTotals Table: per-agent loan counts and sums, maintained like CustomerLoanTotals
+CREATE TABLE AgentLoanTotals (
+    AgentID INT PRIMARY KEY,
+    TotalLoans INT NOT NULL DEFAULT 0,
+    ActiveLoans INT NOT NULL DEFAULT 0,
+    DefaultedLoans INT NOT NULL DEFAULT 0,
+    TotalLoanAmount DECIMAL(16,2) NOT NULL DEFAULT 0,
+    InterestRateSum DECIMAL(14,2) NOT NULL DEFAULT 0, -- for the average rate
+    UpdatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (AgentID) REFERENCES Agent(AgentID) ON DELETE CASCADE
+);
+
+-- RollupWatermark Table: last source row (e.g. TransactionID) folded into each rollup
+CREATE TABLE RollupWatermark (
+    RollupName VARCHAR(50) PRIMARY KEY,
+    LastID INT NOT NULL DEFAULT 0,
+    UpdatedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
 -- =============================================
 -- Insert Sample Data (15+ records per table)
 -- =============================================
@@ -327,13 +377,18 @@ INSERT INTO Users (CustomerID, AgentID, Username, Password, Role) VALUES
 (2, NULL, 'priya_patel', '98a08a01449065a6d1170fd0ed0fbb8bf92d6011989a544cdee95efcfaa95e8f84c12bf876cba5c1d6f0c149c919a7a2882741397e1abc73c984020a17c7ac29', 'customer');
 
 
+-- Rollups start empty; the first refresh (python batch_runner.py --stages collections) backfills them
+INSERT INTO RollupWatermark (RollupName, LastID) VALUES ('CollectionRollup', 0);
+
 -- =============================================
 -- Stored Procedures
 -- =============================================
 
 DELIMITER //
 
--- Procedure to calculate and create installments for a loan
+-- Procedure to calculate and create installments for a loan (flat interest).
+-- The application no longer calls this: AgentDashboard.create_loan builds the reducing-balance,
+-- calendar-month schedule with LoanCalculator.calculate_installments and inserts it in one statement.
 CREATE PROCEDURE CreateLoanInstallments(
     IN p_LoanID INT,
     IN p_LoanAmount DECIMAL(12,2),
@@ -406,46 +461,53 @@ BEGIN
     END IF;
 END//
 
--- Function to calculate credit score
+-- Credit score of one customer, read from CustomerLoanTotals (kept current by the Loan triggers)
 CREATE FUNCTION CalculateCreditScore(p_CustomerID INT) 
 RETURNS INT
 READS SQL DATA
-DETERMINISTIC
 BEGIN
-    DECLARE v_score INT DEFAULT 850;
-    DECLARE v_default_count INT;
-    DECLARE v_active_loans INT;
-    DECLARE v_total_loans INT;
-    
-    -- Check for defaults
-    SELECT COUNT(*) INTO v_default_count
-    FROM Loan 
-    WHERE CustomerID = p_CustomerID AND Status = 'Defaulted';
-    
-    -- Count active loans
-    SELECT COUNT(*) INTO v_active_loans
-    FROM Loan 
-    WHERE CustomerID = p_CustomerID AND Status = 'Active';
-    
-    -- Count total loans
-    SELECT COUNT(*) INTO v_total_loans
-    FROM Loan 
-    WHERE CustomerID = p_CustomerID;
-    
-    -- Deduct for defaults
-    SET v_score = v_score - (v_default_count * 100);
-    
-    -- Adjust for loan burden
-    IF v_active_loans > 2 THEN
-        SET v_score = v_score - 50;
-    END IF;
-    
-    -- Ensure score doesn't go below 300
-    IF v_score < 300 THEN
-        SET v_score = 300;
-    END IF;
-    
-    RETURN v_score;
+    RETURN COALESCE((SELECT CreditScore FROM CustomerLoanTotals WHERE CustomerID = p_CustomerID), 850);
+END//
+
+-- Procedure to recompute CustomerLoanTotals and AgentLoanTotals from Loan, one statement per table.
+-- Every customer and agent gets a row, so the summary views can join on the primary key.
+CREATE PROCEDURE RefreshLoanTotals()
+BEGIN
+    INSERT INTO CustomerLoanTotals (CustomerID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, TotalBalance)
+    SELECT c.CustomerID,
+           COUNT(l.LoanID),
+           COALESCE(SUM(l.Status = 'Active'), 0),
+           COALESCE(SUM(l.Status = 'Defaulted'), 0),
+           COALESCE(SUM(l.LoanAmount), 0),
+           COALESCE(SUM(l.BalanceAmount), 0)
+    FROM Customer c
+    LEFT JOIN Loan l ON c.CustomerID = l.CustomerID
+    GROUP BY c.CustomerID
+    ON DUPLICATE KEY UPDATE TotalLoans = VALUES(TotalLoans),
+                            ActiveLoans = VALUES(ActiveLoans),
+                            DefaultedLoans = VALUES(DefaultedLoans),
+                            TotalLoanAmount = VALUES(TotalLoanAmount),
+                            TotalBalance = VALUES(TotalBalance);
+
+    INSERT INTO AgentLoanTotals (AgentID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, InterestRateSum)
+    SELECT a.AgentID,
+           COUNT(l.LoanID),
+           COALESCE(SUM(l.Status = 'Active'), 0),
+           COALESCE(SUM(l.Status = 'Defaulted'), 0),
+           COALESCE(SUM(l.LoanAmount), 0),
+           COALESCE(SUM(l.InterestRate), 0)
+    FROM Agent a
+    LEFT JOIN Loan l ON a.AgentID = l.AgentID
+    GROUP BY a.AgentID
+    ON DUPLICATE KEY UPDATE TotalLoans = VALUES(TotalLoans),
+                            ActiveLoans = VALUES(ActiveLoans),
+                            DefaultedLoans = VALUES(DefaultedLoans),
+                            TotalLoanAmount = VALUES(TotalLoanAmount),
+                            InterestRateSum = VALUES(InterestRateSum);
+
+    SELECT (SELECT COUNT(*) FROM CustomerLoanTotals) AS Customers,
+           (SELECT COUNT(*) FROM AgentLoanTotals) AS Agents,
+           (SELECT AVG(CreditScore) FROM CustomerLoanTotals WHERE TotalLoans > 0) AS AvgCreditScore;
 END//
 
 DELIMITER ;
@@ -461,9 +523,11 @@ CREATE TRIGGER UpdateInstallmentStatus
 BEFORE UPDATE ON Installment
 FOR EACH ROW
 BEGIN
-    IF NEW.DueDate < CURDATE() AND NEW.Status = 'Pending' THEN
+    IF NEW.DueDate < CURDATE() AND NEW.Status IN ('Pending', 'Partial') THEN
         SET NEW.Status = 'Overdue';
-        SET NEW.LateFee = NEW.TotalAmount * 0.02; -- 2% late fee
+        -- Same rule as utils.DateUtils.calculate_late_fee and overdue.py:
+        -- 2% per month overdue (15+ days counts as a month), at least one month, capped at 20%
+        SET NEW.LateFee = ROUND(NEW.TotalAmount * LEAST(0.02 * GREATEST(1, FLOOR((DATEDIFF(CURDATE(), NEW.DueDate) + 14) / 30)), 0.20), 2);
     END IF;
 END//
 
@@ -479,46 +543,166 @@ BEGIN
     END IF;
 END//
 
+-- Triggers to keep CustomerLoanTotals and AgentLoanTotals in step with Loan.  A loan's old values
+-- are taken out of its customer's and agent's rows and its new values added, so a payment (a new
+-- BalanceAmount), a status change or a reassignment is a few primary-key updates.
+CREATE TRIGGER AddLoanToTotals
+AFTER INSERT ON Loan
+FOR EACH ROW
+BEGIN
+    INSERT INTO CustomerLoanTotals (CustomerID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, TotalBalance)
+    VALUES (NEW.CustomerID, 1, NEW.Status <=> 'Active', NEW.Status <=> 'Defaulted', NEW.LoanAmount, NEW.BalanceAmount)
+    ON DUPLICATE KEY UPDATE TotalLoans = TotalLoans + 1,
+                            ActiveLoans = ActiveLoans + (NEW.Status <=> 'Active'),
+                            DefaultedLoans = DefaultedLoans + (NEW.Status <=> 'Defaulted'),
+                            TotalLoanAmount = TotalLoanAmount + NEW.LoanAmount,
+                            TotalBalance = TotalBalance + NEW.BalanceAmount;
+    INSERT INTO AgentLoanTotals (AgentID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, InterestRateSum)
+    VALUES (NEW.AgentID, 1, NEW.Status <=> 'Active', NEW.Status <=> 'Defaulted', NEW.LoanAmount, NEW.InterestRate)
+    ON DUPLICATE KEY UPDATE TotalLoans = TotalLoans + 1,
+                            ActiveLoans = ActiveLoans + (NEW.Status <=> 'Active'),
+                            DefaultedLoans = DefaultedLoans + (NEW.Status <=> 'Defaulted'),
+                            TotalLoanAmount = TotalLoanAmount + NEW.LoanAmount,
+                            InterestRateSum = InterestRateSum + NEW.InterestRate;
+END//
+
+CREATE TRIGGER UpdateLoanTotals
+AFTER UPDATE ON Loan
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.Status <=> NEW.Status AND OLD.BalanceAmount = NEW.BalanceAmount
+            AND OLD.LoanAmount = NEW.LoanAmount AND OLD.InterestRate = NEW.InterestRate
+            AND OLD.CustomerID = NEW.CustomerID AND OLD.AgentID = NEW.AgentID) THEN
+        UPDATE CustomerLoanTotals
+        SET TotalLoans = TotalLoans - 1,
+            ActiveLoans = ActiveLoans - (OLD.Status <=> 'Active'),
+            DefaultedLoans = DefaultedLoans - (OLD.Status <=> 'Defaulted'),
+            TotalLoanAmount = TotalLoanAmount - OLD.LoanAmount,
+            TotalBalance = TotalBalance - OLD.BalanceAmount
+        WHERE CustomerID = OLD.CustomerID;
+        INSERT INTO CustomerLoanTotals (CustomerID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, TotalBalance)
+        VALUES (NEW.CustomerID, 1, NEW.Status <=> 'Active', NEW.Status <=> 'Defaulted', NEW.LoanAmount, NEW.BalanceAmount)
+        ON DUPLICATE KEY UPDATE TotalLoans = TotalLoans + 1,
+                                ActiveLoans = ActiveLoans + (NEW.Status <=> 'Active'),
+                                DefaultedLoans = DefaultedLoans + (NEW.Status <=> 'Defaulted'),
+                                TotalLoanAmount = TotalLoanAmount + NEW.LoanAmount,
+                                TotalBalance = TotalBalance + NEW.BalanceAmount;
+
+        -- A payment only moves the balance, which the agent totals do not track
+        IF NOT (OLD.Status <=> NEW.Status AND OLD.LoanAmount = NEW.LoanAmount
+                AND OLD.InterestRate = NEW.InterestRate AND OLD.AgentID = NEW.AgentID) THEN
+            UPDATE AgentLoanTotals
+            SET TotalLoans = TotalLoans - 1,
+                ActiveLoans = ActiveLoans - (OLD.Status <=> 'Active'),
+                DefaultedLoans = DefaultedLoans - (OLD.Status <=> 'Defaulted'),
+                TotalLoanAmount = TotalLoanAmount - OLD.LoanAmount,
+                InterestRateSum = InterestRateSum - OLD.InterestRate
+            WHERE AgentID = OLD.AgentID;
+            INSERT INTO AgentLoanTotals (AgentID, TotalLoans, ActiveLoans, DefaultedLoans, TotalLoanAmount, InterestRateSum)
+            VALUES (NEW.AgentID, 1, NEW.Status <=> 'Active', NEW.Status <=> 'Defaulted', NEW.LoanAmount, NEW.InterestRate)
+            ON DUPLICATE KEY UPDATE TotalLoans = TotalLoans + 1,
+                                    ActiveLoans = ActiveLoans + (NEW.Status <=> 'Active'),
+                                    DefaultedLoans = DefaultedLoans + (NEW.Status <=> 'Defaulted'),
+                                    TotalLoanAmount = TotalLoanAmount + NEW.LoanAmount,
+                                    InterestRateSum = InterestRateSum + NEW.InterestRate;
+        END IF;
+    END IF;
+END//
+
+CREATE TRIGGER RemoveLoanFromTotals
+AFTER DELETE ON Loan
+FOR EACH ROW
+BEGIN
+    UPDATE CustomerLoanTotals
+    SET TotalLoans = TotalLoans - 1,
+        ActiveLoans = ActiveLoans - (OLD.Status <=> 'Active'),
+        DefaultedLoans = DefaultedLoans - (OLD.Status <=> 'Defaulted'),
+        TotalLoanAmount = TotalLoanAmount - OLD.LoanAmount,
+        TotalBalance = TotalBalance - OLD.BalanceAmount
+    WHERE CustomerID = OLD.CustomerID;
+    UPDATE AgentLoanTotals
+    SET TotalLoans = TotalLoans - 1,
+        ActiveLoans = ActiveLoans - (OLD.Status <=> 'Active'),
+        DefaultedLoans = DefaultedLoans - (OLD.Status <=> 'Defaulted'),
+        TotalLoanAmount = TotalLoanAmount - OLD.LoanAmount,
+        InterestRateSum = InterestRateSum - OLD.InterestRate
+    WHERE AgentID = OLD.AgentID;
+END//
+
+-- MySQL does not fire triggers for rows removed by ON DELETE CASCADE, so a customer's or
+-- vehicle's loans are deleted explicitly first and RemoveLoanFromTotals sees each of them
+CREATE TRIGGER RemoveCustomerLoans
+BEFORE DELETE ON Customer
+FOR EACH ROW
+BEGIN
+    DELETE FROM Loan
+    WHERE CustomerID = OLD.CustomerID
+       OR VehicleID IN (SELECT VehicleID FROM Vehicle WHERE CustomerID = OLD.CustomerID);
+END//
+
+CREATE TRIGGER RemoveVehicleLoans
+BEFORE DELETE ON Vehicle
+FOR EACH ROW
+BEGIN
+    DELETE FROM Loan WHERE VehicleID = OLD.VehicleID;
+END//
+
+-- New customers and agents start with an empty totals row
+CREATE TRIGGER AddCustomerTotals
+AFTER INSERT ON Customer
+FOR EACH ROW
+BEGIN
+    INSERT IGNORE INTO CustomerLoanTotals (CustomerID) VALUES (NEW.CustomerID);
+END//
+
+CREATE TRIGGER AddAgentTotals
+AFTER INSERT ON Agent
+FOR EACH ROW
+BEGIN
+    INSERT IGNORE INTO AgentLoanTotals (AgentID) VALUES (NEW.AgentID);
+END//
+
 DELIMITER ;
 
+-- The sample customers, agents and loans above were inserted before the triggers existed
+CALL RefreshLoanTotals();
+
 -- =============================================
 -- Views
 -- =============================================
 
--- View for customer loan summary
+-- View for customer loan summary: one primary-key join per customer onto the maintained totals
 CREATE VIEW CustomerLoanSummary AS
 SELECT 
     c.CustomerID,
     CONCAT(c.FirstName, ' ', c.LastName) AS CustomerName,
     c.Phone,
     c.Email,
-    COUNT(l.LoanID) AS TotalLoans,
-    SUM(CASE WHEN l.Status = 'Active' THEN 1 ELSE 0 END) AS ActiveLoans,
-    SUM(CASE WHEN l.Status = 'Defaulted' THEN 1 ELSE 0 END) AS DefaultedLoans,
-    SUM(l.LoanAmount) AS TotalLoanAmount,
-    SUM(l.BalanceAmount) AS TotalBalance,
-    CalculateCreditScore(c.CustomerID) AS CreditScore
-FROM Customer c
-LEFT JOIN Loan l ON c.CustomerID = l.CustomerID
-GROUP BY c.CustomerID, c.FirstName, c.LastName, c.Phone, c.Email;
-
--- View for agent performance
+    t.TotalLoans,
+    t.ActiveLoans,
+    t.DefaultedLoans,
+    t.TotalLoanAmount,
+    t.TotalBalance,
+    t.CreditScore
+FROM CustomerLoanTotals t
+JOIN Customer c ON t.CustomerID = c.CustomerID;
+
+-- View for agent performance, likewise read from AgentLoanTotals
 CREATE VIEW AgentPerformance AS
 SELECT 
     a.AgentID,
     a.Name AS AgentName,
     b.BranchName,
     a.Role,
-    COUNT(l.LoanID) AS TotalLoansManaged,
-    SUM(l.LoanAmount) AS TotalLoanVolume,
-    AVG(l.InterestRate) AS AvgInterestRate,
-    SUM(CASE WHEN l.Status = 'Active' THEN 1 ELSE 0 END) AS ActiveLoans,
-    SUM(CASE WHEN l.Status = 'Defaulted' THEN 1 ELSE 0 END) AS DefaultedLoans,
-    (COUNT(l.LoanID) - SUM(CASE WHEN l.Status = 'Defaulted' THEN 1 ELSE 0 END)) / COUNT(l.LoanID) * 100 AS SuccessRate
-FROM Agent a
-LEFT JOIN Loan l ON a.AgentID = l.AgentID
-LEFT JOIN Branch b ON a.BranchID = b.BranchID
-GROUP BY a.AgentID, a.Name, b.BranchName, a.Role;
+    t.TotalLoans AS TotalLoansManaged,
+    t.TotalLoanAmount AS TotalLoanVolume,
+    t.InterestRateSum / NULLIF(t.TotalLoans, 0) AS AvgInterestRate,
+    t.ActiveLoans,
+    t.DefaultedLoans,
+    (t.TotalLoans - t.DefaultedLoans) / NULLIF(t.TotalLoans, 0) * 100 AS SuccessRate
+FROM AgentLoanTotals t
+JOIN Agent a ON t.AgentID = a.AgentID
+LEFT JOIN Branch b ON a.BranchID = b.BranchID;
 
 -- View for overdue installments
 CREATE VIEW OverdueInstallments AS
@@ -640,6 +824,8 @@ CREATE INDEX idx_loan_status ON Loan(Status);
 CREATE INDEX idx_installment_loan ON Installment(LoanID);
 CREATE INDEX idx_installment_due_date ON Installment(DueDate);
 CREATE INDEX idx_installment_status ON Installment(Status);
+-- Overdue scan: candidate lookup by status and due date
+CREATE INDEX idx_installment_status_due ON Installment(Status, DueDate);
 CREATE INDEX idx_transaction_loan ON TransactionLogger(LoanID);
 CREATE INDEX idx_transaction_date ON TransactionLogger(TransactionDate);
 CREATE INDEX idx_vehicle_customer ON Vehicle(CustomerID);
@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import mysql.connector
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+# Upper bounds (ms) of the checkout wait histogram buckets; the last bucket is open ended
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class _PoolEntry:
+    """A physical connection plus the bookkeeping the pool keeps about it"""
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # SQL text -> (SQL text, prepared cursor), least recently used first
+        self.statements = OrderedDict()
+
+
+class PooledConnection:
+    """Connection handed out by ConnectionPool; close() returns it to the pool"""
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise PoolError("Connection has already been returned to the pool")
+        return getattr(entry.cnx, name)
+
+    def prepared_cursor(self, query, cache_size):
+        """Return (cursor, sql, hit) for a server-side prepared statement cached on this connection.
+
+        Callers must execute the returned sql object rather than their own copy
+        of the text: the connector only skips re-preparing when it is handed the
+        identical string it prepared.
+        """
+        statements = self._entry.statements
+        cached = statements.get(query)
+        if cached is not None:
+            statements.move_to_end(query)
+            return cached[1], cached[0], True
+
+        cursor = self._entry.cnx.cursor(prepared=True)
+        statements[query] = (query, cursor)
+        while len(statements) > cache_size:
+            _, (_, old_cursor) = statements.popitem(last=False)
+            try:
+                old_cursor.close()
+            except Error:
+                pass
+        return cursor, query, False
+
+    def evict_prepared(self, query):
+        cached = self._entry.statements.pop(query, None)
+        if cached is not None:
+            try:
+                cached[1].close()
+            except Error:
+                pass
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.release(entry)
+
+
+class ConnectionPool:
+    """Thread-safe MySQL connection pool with overflow, checkout timeout and stats.
+
+    Up to pool_size connections are kept open between checkouts; max_overflow
+    extra connections may be opened under load and are closed when returned.
+    A checkout that finds the pool exhausted waits up to timeout seconds
+    before raising PoolError.  Connections idle for longer than recycle
+    seconds are reopened, and pre_ping validates a connection before it is
+    handed out.
+    """
+    def __init__(self, pool_size=5, max_overflow=0, timeout=30, recycle=3600, pre_ping=True, **connect_args):
+        if pool_size <= 0:
+            raise ValueError("pool_size must be positive")
+        self.pool_size = pool_size
+        self.max_overflow = max(0, max_overflow)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.connect_args = connect_args
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._entries = set()
+        self._opening = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_hist = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def _open(self):
+        return _PoolEntry(mysql.connector.connect(**self.connect_args))
+
+    def _discard(self, entry):
+        self._entries.discard(entry)
+        try:
+            entry.cnx.close()
+        except Error:
+            pass
+
+    def _validate(self, entry):
+        """Return a usable entry, reopening the connection if it is stale or dead"""
+        now = time.monotonic()
+        stale = self.recycle and now - entry.last_used > self.recycle
+        if not stale and self.pre_ping:
+            try:
+                entry.cnx.ping(reconnect=False)
+            except Error:
+                stale = True
+        if not stale:
+            return entry
+
+        logging.debug("Reopening stale pooled database connection")
+        # Keep holding the slot while reopening, so other threads cannot open past the limit
+        with self._cond:
+            self._opening += 1
+            self._discard(entry)
+        fresh = None
+        try:
+            fresh = self._open()
+        finally:
+            with self._cond:
+                self._opening -= 1
+                if fresh is not None:
+                    self._entries.add(fresh)
+        return fresh
+
+    def _record_wait(self, waited):
+        ms = waited * 1000
+        for i, bound in enumerate(WAIT_BUCKETS_MS):
+            if ms <= bound:
+                break
+        else:
+            i = len(WAIT_BUCKETS_MS)
+        self._wait_hist[i] += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+    def get_connection(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        entry = None
+        with self._cond:
+            if self._closed:
+                raise PoolError("Connection pool has been closed")
+            while True:
+                if self._idle:
+                    # LIFO so the most recently used (warmest) connection is reused first
+                    entry = self._idle.pop()
+                    break
+                if len(self._entries) + self._opening < self.pool_size + self.max_overflow:
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._failures += 1
+                    raise PoolError(f"Timed out after {self.timeout}s waiting for a database connection "
+                                    f"({self._in_use} in use)")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if entry is None:
+                try:
+                    entry = self._open()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if entry is not None:
+                            self._entries.add(entry)
+            else:
+                entry = self._validate(entry)
+        except Error:
+            with self._cond:
+                self._in_use -= 1
+                self._failures += 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checkouts += 1
+            self._record_wait(time.monotonic() - started)
+        return PooledConnection(self, entry)
+
+    def release(self, entry):
+        healthy = True
+        try:
+            # Leave nothing behind for the next borrower
+            entry.cnx.consume_results()
+            if entry.cnx.in_transaction:
+                entry.cnx.rollback()
+        except Error:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            entry.last_used = time.monotonic()
+            # Overflow connections are closed rather than kept idle
+            if healthy and not self._closed and entry in self._entries and len(self._entries) <= self.pool_size:
+                self._idle.append(entry)
+            else:
+                self._discard(entry)
+            self._cond.notify()
+
+    def close_all(self):
+        """Close idle connections; connections still checked out are closed on return"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self):
+        """Snapshot of pool usage: occupancy, checkout waits, failures and connection ages"""
+        with self._cond:
+            now = time.monotonic()
+            ages = [now - e.created_at for e in self._entries]
+            labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open': len(self._entries),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'checkout_failures': self._failures,
+                'wait_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+                'wait_histogram': dict(zip(labels, self._wait_hist)),
+                'connection_age_min_s': round(min(ages), 1) if ages else 0.0,
+                'connection_age_max_s': round(max(ages), 1) if ages else 0.0,
+                'connection_age_avg_s': round(sum(ages) / len(ages), 1) if ages else 0.0,
+            }
@@ -1,5 +1,6 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, messagebox
+from mysql.connector import Error
 
 class DemoQueries:
     def __init__(self, parent, db):
@@ -79,28 +80,39 @@ class DemoQueries:
             'nested_query': "NESTED QUERY: Customers with above average loan amounts using subqueries. Demonstrates correlated subqueries and nested SELECT statements.",
             'aggregate_join': "AGGREGATE WITH JOIN: Branch performance summary with GROUP BY, HAVING, and multiple aggregate functions (COUNT, SUM, AVG, MAX, MIN).",
             'complex_join': "COMPLEX JOIN: Loan details with multiple table joins (5 tables) and aggregate calculations. Shows relational database power.",
-            'view_demo': "VIEW DEMO: Using CustomerLoanSummary view that combines data from multiple tables with calculated credit scores.",
+            'view_demo': "VIEW DEMO: Using CustomerLoanSummary view that joins customers to their trigger-maintained loan totals and credit scores.",
             'trigger_demo': "TRIGGER DEMO: Showing overdue installments with auto-calculated late fees (trigger automatically updates status and fees).",
-            'function_demo': "FUNCTION DEMO: Using CalculateCreditScore function to compute customer ratings. Shows user-defined functions in action.",
+            'function_demo': "FUNCTION DEMO: Customer ratings from the credit scores that triggers keep in CustomerLoanTotals (the table CalculateCreditScore reads).",
             'procedure_demo': "PROCEDURE DEMO: Loans ready for CreateLoanInstallments procedure. Stored procedures automate complex operations."
         }
         
         self.desc_label.config(text=descriptions.get(query_type, ""))
         
-        results = self.db.execute_complex_query(query_type)
-        
-        if results and len(results) > 0:
-            columns = list(results[0].keys())
-            self.results_tree['columns'] = columns
-            
-            for col in columns:
-                self.results_tree.heading(col, text=col)
-                # Auto-adjust column width based on content
-                col_width = max(80, len(col) * 8)
-                self.results_tree.column(col, width=col_width, minwidth=80)
-            
-            for row in results:
-                values = [row.get(col, '') for col in columns]
-                self.results_tree.insert('', 'end', values=values)
-        else:
-            self.desc_label.config(text="No results returned or error in query execution")
\ No newline at end of file
+        columns = None
+        shown = 0
+        try:
+            # Stream results so large joins render chunk by chunk
+            for results in self.db.iter_complex_query(query_type):
+                if columns is None:
+                    columns = list(results[0].keys())
+                    self.results_tree['columns'] = columns
+                    
+                    for col in columns:
+                        self.results_tree.heading(col, text=col)
+                        # Auto-adjust column width based on content
+                        col_width = max(80, len(col) * 8)
+                        self.results_tree.column(col, width=col_width, minwidth=80)
+                
+                for row in results:
+                    values = [row.get(col, '') for col in columns]
+                    self.results_tree.insert('', 'end', values=values)
+                shown += len(results)
+                self.results_tree.update_idletasks()
+        except Error as e:
+            # Keep whatever rows already arrived, but say the list is incomplete
+            messagebox.showerror("Query Error", f"Query failed after {shown} rows: {e}")
+            self.desc_label.config(text=f"Query failed after {shown} rows: {e}")
+            return
+        
+        if columns is None:
+            self.desc_label.config(text="No results returned")
\ No newline at end of file
@@ -8,49 +8,42 @@
 import io
 import math
 import logging
-# Add near other imports:
-from fpdf import FPDF
-from datetime import datetime, date
-from tkinter import Toplevel, Frame, Label, Entry, Button, Text, Scrollbar, END, messagebox
+from datetime import date
+from tkinter import Toplevel, Frame, Label, Entry, Button, Text, Scrollbar, END, PhotoImage, StringVar, TclError, messagebox
 from tkinter import ttk
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from background import BackgroundRunner
+from charts import CHARTS, cached_chart, render_chart
+from foreclosure import foreclose_loans
+from overdue import scan_overdue
+from report_renderer import load_loan_report, render_loan_report
+from utils import LoanCalculator
 
 logger = logging.getLogger(__name__)
 
 # ----- Utilities (EMI + amortization) -----
 def calculate_emi(principal, annual_rate, tenure_months):
-    monthly_rate = annual_rate / (12 * 100)
-    if monthly_rate == 0:
-        return round(principal / tenure_months, 2)
-    emi = (principal * monthly_rate * (1 + monthly_rate) ** tenure_months) / ((1 + monthly_rate) ** tenure_months - 1)
-    return round(emi, 2)
+    # Same paise-exact EMI as loan creation; zero rates are allowed here
+    return float(LoanCalculator.calculate_emi_batch([principal], [annual_rate], [tenure_months])[0])
 
 def amortization_schedule(principal, annual_rate, tenure_months, start_date=None):
-    monthly_rate = annual_rate / (12 * 100)
-    emi = calculate_emi(principal, annual_rate, tenure_months)
-    schedule = []
-    remaining = principal
-    for m in range(1, tenure_months + 1):
-        interest = round(remaining * monthly_rate, 2)
-        principal_paid = round(emi - interest, 2)
-        if m == tenure_months:
-            # adjust last payment to avoid rounding leftover
-            principal_paid = round(remaining, 2)
-            emi = round(principal_paid + interest, 2)
-        remaining = round(remaining - principal_paid, 2)
-        due_date = (start_date or date.today()).replace(day=1) if start_date else date.today()
-        schedule.append({
-            'month': m,
-            'due_date': due_date,
-            'emi': emi,
-            'principal': principal_paid,
-            'interest': interest,
-            'remaining': remaining
-        })
-    return emi, schedule
+    """
+    EMI and month-by-month schedule, from the same engine loan creation uses
+    (LoanCalculator.calculate_installments).
+    """
+    installments = LoanCalculator.calculate_installments(principal, annual_rate, tenure_months,
+                                                         start_date or date.today())
+    schedule = [{
+        'month': m,
+        'due_date': inst['due_date'],
+        'emi': inst['total_amount'],
+        'principal': inst['principal_amount'],
+        'interest': inst['interest_amount'],
+        'remaining': inst['remaining_balance']
+    } for m, inst in enumerate(installments, start=1)]
+    return installments[0]['total_amount'], schedule
 
 # ----- EMI Calculator Window -----
 def show_emi_calculator(parent=None):
@@ -97,187 +90,70 @@ def show_emi_calculator(parent=None):
     Button(win, text="Calculate", command=compute, bg='#3498db', fg='white').pack(pady=6)
 
 # ----- PDF Export (Loan report) -----
-from fpdf import FPDF
-import os
-from datetime import datetime
-import logging
-from tkinter import messagebox
-
-logger = logging.getLogger(__name__)
-
-def generate_loan_pdf(db, loan_id, filename=None, parent=None):
+def generate_loan_pdf(db, loan_id, filename=None, parent=None, notify=True):
     """
-    Generates a PDF with loan, customer, vehicle, installments summary using fpdf2.
+    Generates a PDF with loan, customer, vehicle, installments summary (see report_renderer).
     Uses a Unicode TTF (DejaVuSans.ttf) if available; otherwise falls back to ASCII 'Rs '.
     Returns path to generated file or None on failure.
+    Pass notify=False when running off the Tk thread; no message boxes are shown then.
     """
     try:
-        loan_q = """
-            SELECT l.*, c.FirstName, c.LastName, c.Phone, c.Email,
-                   v.VehicleNo, v.Make, v.Model, v.Year, v.MarketValue
-            FROM Loan l
-            JOIN Customer c ON l.CustomerID = c.CustomerID
-            JOIN Vehicle v ON l.VehicleID = v.VehicleID
-            WHERE l.LoanID = %s
-        """
-        rows = db.execute_query(loan_q, (loan_id,))
-        if not rows:
-            messagebox.showerror("Error", "Loan not found")
+        data = load_loan_report(db, loan_id)
+        if data is None:
+            logger.error(f"Loan {loan_id} not found for PDF export")
+            if notify:
+                messagebox.showerror("Error", "Loan not found")
             return None
-        loan = rows[0]
-
-        inst_q = "SELECT DueDate, TotalAmount, Status, LateFee, PaidDate FROM Installment WHERE LoanID=%s ORDER BY DueDate"
-        insts = db.execute_query(inst_q, (loan_id,)) or []
-
-        # Compose filename
-        fname = filename or f"LoanReport_{loan_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        pdf = FPDF(format='A4', unit='mm')
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
-
-        # Attempt to load a Unicode TTF font (DejaVuSans.ttf) from ./fonts/DejaVuSans.ttf
-        fonts_folder = os.path.join(os.getcwd(), "fonts")
-        dejavu_path = os.path.join(fonts_folder, "DejaVuSans.ttf")
-        use_unicode_font = False
-        if os.path.isfile(dejavu_path):
-            try:
-                # Register font for unicode (uni=True)
-                pdf.add_font("DejaVu", "", dejavu_path, uni=True)
-                pdf.add_font("DejaVu", "B", dejavu_path, uni=True)
-                pdf.set_font("DejaVu", size=11)
-                use_unicode_font = True
-            except Exception:
-                logger.exception("Failed to register DejaVu font, will fallback to Helvetica")
-                pdf.set_font("Helvetica", size=11)
-        else:
-            # Try system fonts by common paths (optional) - fallback will be used if not found
-            # You may add other candidate paths here if you know them, e.g. windows fonts.
-            pdf.set_font("Helvetica", size=11)
-
-        # helper for currency formatting that uses ₹ only if unicode font is available
-        def money(val):
-            if val is None:
-                return ""
-            try:
-                amount = float(val)
-            except Exception:
-                return str(val)
-            if use_unicode_font:
-                return f"₹{amount:,.2f}"
-            else:
-                return f"Rs {amount:,.2f}"
-
-        # Header
-        pdf.set_font(pdf.font_family, style='B', size=14)
-        pdf.cell(0, 10, f"Loan Report - Loan ID: {loan_id}", ln=True)
-        pdf.ln(2)
-
-        # Customer details
-        if use_unicode_font:
-            pdf.set_font("DejaVu", size=10)
-        else:
-            pdf.set_font("Helvetica", size=10)
-
-        pdf.cell(100, 6, f"Customer: {loan.get('FirstName','')} {loan.get('LastName','')}", ln=0)
-        pdf.cell(0, 6, f"Phone: {loan.get('Phone','')}", ln=1)
-        pdf.cell(0, 6, f"Email: {loan.get('Email','')}", ln=1)
-        pdf.ln(2)
-
-        # Loan summary
-        loan_amount = loan.get('LoanAmount') or 0
-        balance = loan.get('BalanceAmount') or 0
-        status = loan.get('Status') or ''
-        pdf.cell(0, 6, f"Loan Amount: {money(loan_amount)}    Balance: {money(balance)}    Status: {status}", ln=1)
-        pdf.ln(4)
-
-        # Vehicle details
-        pdf.cell(0, 6, f"Vehicle: {loan.get('VehicleNo','')}  -  {loan.get('Make','')} {loan.get('Model','')} ({loan.get('Year','')})", ln=1)
-        mv = loan.get('MarketValue')
-        if mv:
-            pdf.cell(0, 6, f"Market Value: {money(mv)}", ln=1)
-        pdf.ln(6)
-
-        # Installments table header
-        pdf.set_font(pdf.font_family, style='B', size=10)
-        col_widths = [30, 40, 40, 30, 40]  # DueDate, Amount, Status, LateFee, PaidDate
-        headers = ['Due Date', 'Amount', 'Status', 'Late Fee', 'Paid Date']
-        for i, h in enumerate(headers):
-            pdf.cell(col_widths[i], 7, h, border=1, ln=0, align='C')
-        pdf.ln()
-
-        # Table rows
-        pdf.set_font(pdf.font_family, size=9)
-        for inst in insts:
-            due = str(inst.get('DueDate') or '')
-            amt = money(inst.get('TotalAmount')) if inst.get('TotalAmount') is not None else ''
-            st = str(inst.get('Status') or '')
-            lf = money(inst.get('LateFee')) if inst.get('LateFee') is not None else ''
-            pd = str(inst.get('PaidDate') or '')
-            row = [due, amt, st, lf, pd]
-            # If a cell is too long it will wrap because of auto page break; keep it simple
-            for i, cell in enumerate(row):
-                # ensure cell text is string
-                text = cell if isinstance(cell, str) else str(cell)
-                pdf.cell(col_widths[i], 6, text, border=1)
-            pdf.ln()
-
-        pdf.ln(6)
-        pdf.set_font(pdf.font_family, size=9)
-        pdf.cell(0, 6, f"Generated on: {datetime.now().isoformat()}", ln=1)
-
-        # Save PDF
-        pdf.output(fname)
-        messagebox.showinfo("PDF Generated", f"Loan PDF saved to {fname}")
+
+        fname = render_loan_report(data, filename)
+        if notify:
+            messagebox.showinfo("PDF Generated", f"Loan PDF saved to {fname}")
         return fname
 
     except Exception as e:
-        logger.exception("PDF generation (fpdf unicode-safe) failed")
-        messagebox.showerror("Error", f"Failed to generate PDF: {e}")
+        logger.exception("PDF generation failed")
+        if notify:
+            messagebox.showerror("Error", f"Failed to generate PDF: {e}")
         return None
 
 # ----- Graph Analytics (Admin) -----
+def _show_chart(label, path):
+    if not path or path == getattr(label, 'chart_path', None):
+        return
+    try:
+        image = PhotoImage(file=path)
+    except TclError as e:
+        # Removed by a newer render in the meantime; the next refresh brings the current one
+        logger.warning(f"Could not load chart image {path}: {e}")
+        return
+    label.config(image=image, text='')
+    label.image = image  # Tk drops the image once Python no longer references it
+    label.chart_path = path
+
+
 def show_admin_graphs(db, parent=None):
+    """Charts are drawn to PNG on the worker pool (see charts.py); the last cached image shows at once"""
     try:
         win = Toplevel(parent)
         win.title("Admin Analytics")
         win.geometry("900x600")
+        status_var = StringVar()
+        Label(win, textvariable=status_var, anchor='w').pack(side='bottom', fill='x')
+        tasks = BackgroundRunner(win, status_var)
+        win.bind('<Destroy>', lambda e: tasks.close() if e.widget is win else None, add='+')
 
-        # Example 1: Loan status pie chart
-        q = "SELECT Status, COUNT(*) as cnt FROM Loan GROUP BY Status"
-        rows = db.execute_query(q)
-        labels = [r['Status'] or 'Unknown' for r in rows] if rows else []
-        sizes = [r['cnt'] for r in rows] if rows else []
-
-        fig1 = plt.Figure(figsize=(4,3))
-        ax1 = fig1.add_subplot(111)
-        if sizes:
-            ax1.pie(sizes, labels=labels, autopct='%1.1f%%')
-        ax1.set_title("Loan Status Distribution")
-
-        canvas1 = FigureCanvasTkAgg(fig1, win)
-        canvas1.get_tk_widget().pack(side='left', fill='both', expand=True)
-
-        # Example 2: Monthly collection (bar)
-        q2 = """
-            SELECT DATE_FORMAT(TransactionDate, '%Y-%m') as mon, SUM(DebitAmount) as amt
-            FROM TransactionLogger
-            WHERE TransactionType = 'EMI Payment'
-            GROUP BY mon
-            ORDER BY mon DESC LIMIT 12
-        """
-        rows2 = db.execute_query(q2)
-        mon = [r['mon'] for r in rows2][::-1] if rows2 else []
-        amt = [r['amt'] for r in rows2][::-1] if rows2 else []
-
-        fig2 = plt.Figure(figsize=(4,3))
-        ax2 = fig2.add_subplot(111)
-        if mon:
-            ax2.bar(mon, amt)
-            ax2.set_xticklabels(mon, rotation=45, ha='right')
-        ax2.set_title("Monthly EMI Collection")
-
-        canvas2 = FigureCanvasTkAgg(fig2, win)
-        canvas2.get_tk_widget().pack(side='right', fill='both', expand=True)
+        for name, side in (('loan_status', 'left'), ('monthly_collection', 'right')):
+            chart = Label(win, text="Loading chart...")
+            chart.pack(side=side, fill='both', expand=True)
+            _show_chart(chart, cached_chart(name))
+
+            def failed(error, chart=chart):
+                if getattr(chart, 'chart_path', None) is None:
+                    chart.config(text=f"Chart unavailable: {error}")
+
+            tasks.submit(name, render_chart, db, name, label=CHARTS[name][0],
+                         on_done=lambda path, chart=chart: _show_chart(chart, path) if path else failed("no data"),
+                         on_error=failed)
 
     except Exception as e:
         logger.exception("Graph display failed")
@@ -290,49 +166,39 @@ def simulate_notification(parent, title, message):
     messagebox.showinfo(title, message)
 
 # ----- Foreclosure (transactional) -----
-def foreclose_loan(db, loan_id, agent_id=None, parent=None):
+def foreclosure_quote_message(quote):
+    """Breakdown of a foreclosure.quote_loan result for a confirmation dialog"""
+    return (f"Payoff as of {quote['as_of']}: ₹{quote['payoff']:,.2f}\n\n"
+            f"Principal outstanding: ₹{quote['principal_outstanding']:,.2f}\n"
+            f"Arrears: ₹{quote['arrears']:,.2f}\n"
+            f"Accrued interest: ₹{quote['accrued_interest']:,.2f}\n"
+            f"Late fees: ₹{quote['late_fees']:,.2f}\n"
+            f"Foreclosure charge: ₹{quote['foreclosure_charge']:,.2f}\n\n"
+            f"(Remaining balance on schedule: ₹{quote['balance']:,.2f})")
+
+def foreclose_loan(db, loan_id, agent_id=None, parent=None, notify=True):
     """
-    Foreclose a loan: compute remaining balance, mark all installments Paid,
-    update Loan status to Closed, log a transaction for remaining amount.
+    Foreclose a loan at its foreclosure quote: mark all installments Paid,
+    update Loan status to Closed, log a transaction for the payoff amount.
+    Returns the foreclosure.foreclose_loans summary, or None on failure.
+    Pass notify=False when running off the Tk thread and show the outcome
+    with show_foreclosure_result() on the UI thread instead.
     """
-    try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        # Get remaining balance
-        cursor.execute("SELECT BalanceAmount FROM Loan WHERE LoanID=%s FOR UPDATE", (loan_id,))
-        row = cursor.fetchone()
-        if not row:
-            messagebox.showerror("Error", "Loan not found")
-            conn.close(); return False
-        remaining = float(row[0])
-        if remaining <= 0:
-            messagebox.showinfo("Info", "Loan already closed or no balance")
-            conn.close(); return True
-
-        # Mark installments paid and set paid date to today (for pending/overdue)
-        cursor.execute("UPDATE Installment SET Status='Paid', PaidDate=CURDATE() WHERE LoanID=%s AND Status!='Paid'", (loan_id,))
-
-        # Update loan
-        cursor.execute("UPDATE Loan SET BalanceAmount=0, Status='Closed' WHERE LoanID=%s", (loan_id,))
-
-        # Log transaction: assume DebitAmount = remaining (customer paid), CreditAmount = 0
-        cursor.execute("""INSERT INTO TransactionLogger (LoanID, DebitAmount, CreditAmount, BalanceAfterTransaction, Remarks, TransactionType)
-                          VALUES (%s, %s, %s, %s, %s, %s)""",
-                       (loan_id, remaining, 0, 0, 'Foreclosure payment', 'Prepayment'))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        messagebox.showinfo("Success", f"Loan {loan_id} foreclosed. Amount: ₹{remaining:,.2f}")
-        return True
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        logger.exception("Foreclosure failed")
-        messagebox.showerror("Error", f"Failed to foreclose loan: {e}")
+    result = foreclose_loans(db, [loan_id])
+    if notify:
+        show_foreclosure_result(loan_id, result)
+    return result
+
+def show_foreclosure_result(loan_id, result):
+    """Message box for a foreclose_loan result; True if the loan was closed"""
+    if result is None:
+        messagebox.showerror("Error", "Failed to foreclose loan, see the log for details")
         return False
+    if not result['closed']:
+        messagebox.showinfo("Info", "Loan already closed or no balance")
+        return False
+    messagebox.showinfo("Success", f"Loan {loan_id} foreclosed. Amount: ₹{result['amount']:,.2f}")
+    return True
 
 # ----- Customer Profile viewer/editor -----
 def show_customer_profile(db, customer_id, parent=None):
@@ -369,6 +235,7 @@ def show_customer_profile(db, customer_id, parent=None):
                 conn.commit()
                 cur.close()
                 conn.close()
+                db.invalidate_cache('Customer')
                 messagebox.showinfo("Saved", "Customer profile updated")
                 win.destroy()
             except Exception as e:
@@ -429,41 +296,18 @@ def show_vehicle_history(db, vehicle_no, parent=None):
 # ----- Overdue Scan (apply late fees) -----
 def run_overdue_scan(db, parent=None):
     """
-    Finds overdue installments, applies late fees, updates statuses, and returns summary.
+    Marks past-due installments Overdue with their late fee (see overdue.scan_overdue) and reports the result.
     """
-    try:
-        conn = db.get_connection()
-        cur = conn.cursor()
-        # Find installments that are past due and not marked paid/overdue
-        cur.execute("""
-            SELECT InstallmentID, LoanID, DueDate, TotalAmount, Status
-            FROM Installment
-            WHERE DueDate < CURDATE() AND Status IN ('Pending','Partial')
-        """)
-        rows = cur.fetchall()
-        updated = 0
-        for r in rows:
-            inst_id, loan_id, due, amt, status = r
-            # compute late fee: 2% of amount for each month overdue (rounded)
-            cur.execute("SELECT DATEDIFF(CURDATE(), DueDate) FROM Installment WHERE InstallmentID=%s", (inst_id,))
-            days = cur.fetchone()[0] or 0
-            months = max(1, (days + 14)//30)
-            late_fee = round(min(0.02 * months, 0.20) * float(amt),2)  # capped 20%
-            cur.execute("UPDATE Installment SET Status='Overdue', LateFee=%s WHERE InstallmentID=%s", (late_fee, inst_id))
-            updated += 1
-        conn.commit()
-        cur.close()
-        conn.close()
-        messagebox.showinfo("Overdue Scan", f"Marked {updated} installments as overdue and applied late fees.")
-        return updated
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        logger.exception("Overdue scan failed")
-        messagebox.showerror("Error", f"Overdue scan failed: {e}")
+    summary = scan_overdue(db)
+    if summary is None:
+        messagebox.showerror("Error", "Overdue scan failed, see the log for details")
         return 0
+    messagebox.showinfo("Overdue Scan", overdue_scan_message(summary))
+    return summary['rows']
+
+def overdue_scan_message(summary):
+    return (f"Marked {summary['rows']} installments as overdue and applied late fees.\n"
+            f"{summary['seconds']}s ({summary['rows_per_sec']} rows/sec)")
 
 # ----- Simple search helper used by UI (returns list of dicts) -----
 def search_loans(db, term):
@@ -0,0 +1,284 @@
+# foreclosure.py
+# Foreclosure (early payoff) quotes and closures for one loan or thousands, e.g.
+#   python foreclosure.py 12 15 18 --as-of 2024-03-31            # quote only
+#   python foreclosure.py 12 15 18 --execute                     # close them
+# No tkinter here; enhancements.foreclose_loan and the agent dashboard call into it.
+
+import argparse
+import logging
+import sys
+import time
+from datetime import date
+
+import numpy as np
+from mysql.connector import Error
+
+from database import Database
+from money import Money, to_db, to_paise, to_rupees, mul_rate
+from query_stats import StatementTimer
+from utils import DateUtils, FORECLOSURE_CHARGE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Every installment of the given loans (paid ones too: they date the start of the current period)
+INSTALLMENTS_QUERY = """
+    SELECT i.LoanID, i.DueDate, i.PrincipalAmount, i.InterestAmount, i.TotalAmount, i.Status,
+           l.SanctionDate, l.BalanceAmount
+    FROM Installment i
+    JOIN Loan l ON i.LoanID = l.LoanID
+    WHERE i.LoanID IN ({ids})
+    ORDER BY i.LoanID, i.DueDate
+"""
+
+QUOTE_FIELDS = ('principal_outstanding', 'arrears', 'accrued_interest', 'late_fees', 'foreclosure_charge',
+                'payoff', 'balance')
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _quote_rows(rows, as_of):
+    """Quote every loan in rows (INSTALLMENTS_QUERY output, as tuples) in one vectorised pass.
+
+    Per loan:
+      arrears               unpaid installments due on or before as_of, in full
+      late_fees             late fee on those, per DateUtils.late_fee_batch
+      principal_outstanding principal of the installments not yet due
+      accrued_interest      the next installment's interest, pro rata for the
+                            days of its period already run
+      foreclosure_charge    FORECLOSURE_CHARGE_RATE of principal_outstanding
+      payoff                the sum of all of the above
+    balance is Loan.BalanceAmount (every unpaid installment in full) for
+    comparison.  Amounts are computed in paise and returned in rupees.
+    """
+    loan = np.array([r[0] for r in rows], dtype=np.int64)
+    due = np.array([r[1] for r in rows], dtype='datetime64[D]')
+    principal = to_paise([r[2] for r in rows])
+    interest = to_paise([r[3] for r in rows])
+    total = to_paise([r[4] for r in rows])
+    unpaid = np.array([r[5] != 'Paid' for r in rows], dtype=bool)
+    as_of_day = np.datetime64(as_of, 'D')
+
+    # Rows are ordered by loan and due date, so each loan is one contiguous run
+    loans, first = np.unique(loan, return_index=True)
+    balance = to_paise([rows[k][7] for k in first])
+
+    is_due = unpaid & (due <= as_of_day)
+    is_future = unpaid & (due > as_of_day)
+    arrears = np.add.reduceat(np.where(is_due, total, 0), first)
+    fees = to_paise(DateUtils.late_fee_batch(due, to_rupees(total), as_of)['late_fee'])
+    late_fees = np.add.reduceat(np.where(is_due, fees, 0), first)
+    principal_outstanding = np.add.reduceat(np.where(is_future, principal, 0), first)
+
+    # The current period runs from the previous due date (or sanction) to the next unpaid due date
+    period_start = np.empty_like(due)
+    period_start[1:] = due[:-1]
+    period_start[first] = np.array([rows[k][6] for k in first], dtype='datetime64[D]')
+    future_rows = np.flatnonzero(is_future)
+    next_loans, next_index = np.unique(loan[future_rows], return_index=True)
+    next_rows = future_rows[next_index]
+    period = (due[next_rows] - period_start[next_rows]).astype(np.int64)
+    elapsed = (as_of_day - period_start[next_rows]).astype(np.int64)
+    fraction = np.clip(elapsed / np.maximum(period, 1), 0, 1)
+    accrued_interest = np.zeros(len(loans), dtype=np.int64)
+    accrued_interest[np.searchsorted(loans, next_loans)] = mul_rate(interest[next_rows], fraction)
+
+    charge = mul_rate(principal_outstanding, FORECLOSURE_CHARGE_RATE)
+    payoff = arrears + late_fees + principal_outstanding + accrued_interest + charge
+    quote = {
+        'principal_outstanding': principal_outstanding,
+        'arrears': arrears,
+        'accrued_interest': accrued_interest,
+        'late_fees': late_fees,
+        'foreclosure_charge': charge,
+        'payoff': payoff,
+        'balance': balance,
+    }
+    quote = {key: to_rupees(values) for key, values in quote.items()}
+    quote['loan_id'] = loans
+    return quote
+
+
+def _empty_quote():
+    quote = {key: np.zeros(0) for key in QUOTE_FIELDS}
+    quote['loan_id'] = np.zeros(0, dtype=np.int64)
+    return quote
+
+
+def _concat_quotes(parts):
+    if not parts:
+        return _empty_quote()
+    return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+
+def quote_foreclosure(db, loan_ids, as_of=None, chunk_size=1000):
+    """Foreclosure quotes for many loans as of a date (default DateUtils.today()).
+
+    Installments are fetched chunk_size loans per query and every chunk is
+    quoted with array operations.  Returns a dict of arrays aligned on
+    'loan_id' (sorted; loans with no installments are left out) with the
+    fields in QUOTE_FIELDS, or None on a database error.
+    """
+    as_of = as_of or DateUtils.today()
+    loan_ids = sorted({int(i) for i in loan_ids})
+    parts = []
+    for start in range(0, len(loan_ids), chunk_size):
+        ids = loan_ids[start:start + chunk_size]
+        rows = db.execute_query(INSTALLMENTS_QUERY.format(ids=_placeholders(ids)), tuple(ids))
+        if rows is None:
+            return None
+        if rows:
+            parts.append(_quote_rows([tuple(r.values()) for r in rows], as_of))
+    return _concat_quotes(parts)
+
+
+def quote_loan(db, loan_id, as_of=None):
+    """Foreclosure quote for one loan as a dict of floats; {} if it has no installments, None on error"""
+    quote = quote_foreclosure(db, [loan_id], as_of)
+    if quote is None:
+        return None
+    if not len(quote['loan_id']):
+        return {}
+    result = {key: float(quote[key][0]) for key in QUOTE_FIELDS}
+    result['loan_id'] = int(loan_id)
+    result['as_of'] = as_of or DateUtils.today()
+    return result
+
+
+def _execute(db, cursor, query, params, many=False):
+    timer = StatementTimer()
+    if many:
+        cursor.executemany(query, params)
+        count = len(params)
+    else:
+        cursor.execute(query, params)
+        count = cursor.rowcount
+    timer.lap('execute')
+    db.query_stats.record(query, timer, count)
+
+
+def foreclose_loans(db, loan_ids, as_of=None, chunk_size=500, progress=None):
+    """Pay off and close loans at their foreclosure quote, chunk_size loans per transaction.
+
+    In each chunk the loans with a balance are locked, quoted, their unpaid
+    installments marked Paid on as_of, the loans Closed with a zero balance,
+    and one Prepayment transaction per loan logged for the payoff amount.
+    Loans without a balance (already closed, or unknown ids) are skipped.
+    progress, if given, is called as progress(loans_done, closed_so_far).
+
+    Returns a dict with requested, closed, skipped, amount, quotes (loan id
+    to payoff), chunks, seconds and loans_per_sec, or None on error; chunks
+    committed before the error are kept.
+    """
+    as_of = as_of or DateUtils.today()
+    loan_ids = sorted({int(i) for i in loan_ids})
+    started = time.perf_counter()
+    closed = 0
+    chunks = 0
+    amount = Money(0)
+    quotes = {}
+    conn = None
+    try:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        for start in range(0, len(loan_ids), chunk_size):
+            ids = loan_ids[start:start + chunk_size]
+            query = f"SELECT LoanID FROM Loan WHERE LoanID IN ({_placeholders(ids)}) AND BalanceAmount > 0 FOR UPDATE"
+            _execute(db, cursor, query, tuple(ids))
+            open_ids = [r[0] for r in cursor.fetchall()]
+            if open_ids:
+                _execute(db, cursor, INSTALLMENTS_QUERY.format(ids=_placeholders(open_ids)) + " FOR UPDATE",
+                         tuple(open_ids))
+                rows = cursor.fetchall()
+                quote = _quote_rows(rows, as_of) if rows else _empty_quote()
+                payoff = dict(zip(quote['loan_id'].tolist(), quote['payoff'].tolist()))
+
+                in_list = _placeholders(open_ids)
+                _execute(db, cursor, f"UPDATE Installment SET Status = 'Paid', PaidDate = %s "
+                                     f"WHERE LoanID IN ({in_list}) AND Status <> 'Paid'", (as_of,) + tuple(open_ids))
+                _execute(db, cursor, f"UPDATE Loan SET BalanceAmount = 0, Status = 'Closed' WHERE LoanID IN ({in_list})",
+                         tuple(open_ids))
+                remarks = {int(loan): (f"Foreclosure payment: principal {p:.2f}, arrears {a:.2f}, interest {i:.2f}, "
+                                       f"late fees {f:.2f}, charge {c:.2f}")
+                           for loan, p, a, i, f, c in zip(quote['loan_id'], quote['principal_outstanding'],
+                                                          quote['arrears'], quote['accrued_interest'],
+                                                          quote['late_fees'], quote['foreclosure_charge'])}
+                _execute(db, cursor, """INSERT INTO TransactionLogger
+                                        (LoanID, DebitAmount, CreditAmount, BalanceAfterTransaction, Remarks, TransactionType)
+                                        VALUES (%s, %s, %s, %s, %s, %s)""",
+                         [(loan, to_db(payoff.get(loan, 0)), 0, 0, remarks.get(loan, 'Foreclosure payment'), 'Prepayment')
+                          for loan in open_ids], many=True)
+                conn.commit()
+                db.invalidate_cache('Installment', 'Loan', 'TransactionLogger')
+
+                closed += len(open_ids)
+                for loan in open_ids:
+                    quotes[loan] = payoff.get(loan, 0.0)
+                    amount += quotes[loan]
+            else:
+                conn.rollback()
+            chunks += 1
+            if progress:
+                progress(min(start + chunk_size, len(loan_ids)), closed)
+        cursor.close()
+    except Error as e:
+        logger.error(f"Foreclosure failed after {closed} loans: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        'as_of': as_of,
+        'requested': len(loan_ids),
+        'closed': closed,
+        'skipped': len(loan_ids) - closed,
+        'amount': float(amount),
+        'quotes': quotes,
+        'chunks': chunks,
+        'seconds': round(elapsed, 3),
+        'loans_per_sec': round(len(loan_ids) / elapsed, 1) if elapsed > 0 else float(len(loan_ids)),
+    }
+    logger.info(f"Foreclosure as of {as_of}: {closed} of {len(loan_ids)} loans closed for "
+                f"{summary['amount']:,.2f} in {chunks} chunks, {summary['seconds']}s")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Quote or execute loan foreclosures")
+    parser.add_argument('loan_ids', nargs='+', type=int)
+    parser.add_argument('--as-of', type=date.fromisoformat, default=DateUtils.today(),
+                        help="payoff date (YYYY-MM-DD, default $LOAN_AS_OF or today)")
+    parser.add_argument('--execute', action='store_true', help="close the loans instead of only quoting them")
+    parser.add_argument('--chunk-size', type=int, default=500, help="loans per transaction")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    try:
+        db = Database()
+    except Exception as e:
+        logging.error(f"Cannot connect to database: {e}")
+        return 1
+    try:
+        if args.execute:
+            result = foreclose_loans(db, args.loan_ids, args.as_of, args.chunk_size)
+        else:
+            result = quote_foreclosure(db, args.loan_ids, args.as_of)
+            if result is not None:
+                print('LoanID\t' + '\t'.join(QUOTE_FIELDS))
+                for k, loan in enumerate(result['loan_id']):
+                    print(f"{loan}\t" + '\t'.join(f"{result[key][k]:.2f}" for key in QUOTE_FIELDS))
+    finally:
+        db.close()
+    return 0 if result is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# money.py
+# Exact rupee arithmetic on integer paise, matching the DECIMAL(…,2) columns in the schema.
+# Money is the scalar type; the array helpers do the same on NumPy int64 paise for whole books.
+
+from decimal import Decimal, ROUND_HALF_UP
+from functools import total_ordering
+
+import numpy as np
+
+
+@total_ordering
+class Money:
+    """A rupee amount held as whole paise; rounding (half up) happens only when multiplying by a rate"""
+    __slots__ = ('paise',)
+
+    def __init__(self, paise=0):
+        self.paise = int(paise)
+
+    @classmethod
+    def of(cls, value):
+        """Money from rupees given as int, float, str, Decimal or Money; None is zero"""
+        if isinstance(value, Money):
+            return value
+        if value is None:
+            return cls(0)
+        return cls(int((Decimal(str(value)) * 100).to_integral_value(ROUND_HALF_UP)))
+
+    def to_decimal(self):
+        """Decimal rupees with two places, for DECIMAL columns"""
+        return Decimal(self.paise).scaleb(-2)
+
+    def __float__(self):
+        return self.paise / 100
+
+    def __add__(self, other):
+        return Money(self.paise + Money.of(other).paise)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.paise - Money.of(other).paise)
+
+    def __rsub__(self, other):
+        return Money(Money.of(other).paise - self.paise)
+
+    def __neg__(self):
+        return Money(-self.paise)
+
+    def __mul__(self, factor):
+        if isinstance(factor, int):
+            return Money(self.paise * factor)
+        return Money(int((Decimal(self.paise) * Decimal(str(factor))).to_integral_value(ROUND_HALF_UP)))
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if isinstance(other, (Money, int, float, str, Decimal)):
+            return self.paise == Money.of(other).paise
+        return NotImplemented
+
+    def __lt__(self, other):
+        return self.paise < Money.of(other).paise
+
+    def __hash__(self):
+        return hash(self.paise)
+
+    def __bool__(self):
+        return self.paise != 0
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __format__(self, spec):
+        return format(self.to_decimal(), spec)
+
+
+def to_db(value):
+    """Decimal for a DECIMAL(…,2) parameter, exact whatever the input type"""
+    return Money.of(value).to_decimal()
+
+
+# ----- Array helpers (int64 paise) -----
+
+def to_paise(rupees):
+    """Array of rupee amounts with at most two decimals (e.g. DECIMAL column values) to int64 paise"""
+    return np.rint(np.asarray(rupees, dtype=float) * 100).astype(np.int64)
+
+
+def to_rupees(paise):
+    return np.asarray(paise, dtype=np.int64) / 100
+
+
+def mul_rate(paise, rate):
+    """paise * rate rounded half up to whole paise, element-wise (amounts must be non-negative)"""
+    return np.floor(np.asarray(paise, dtype=np.int64) * np.asarray(rate, dtype=float) + 0.5).astype(np.int64)
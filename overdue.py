@@ -0,0 +1,158 @@
+# overdue.py
+# Set-based delinquency processing: marks past-due installments Overdue, keeps their capped late
+# fees current and moves loans to Closed/Defaulted.  No tkinter here so the batch runner can import
+# it; run_overdue_scan in enhancements wraps scan_overdue for the UI.
+
+import logging
+import time
+
+from mysql.connector import Error
+
+from query_stats import StatementTimer
+from utils import DateUtils, LATE_FEE_RATE_PER_MONTH, LATE_FEE_CAP, DEFAULT_AFTER_DAYS
+
+logger = logging.getLogger(__name__)
+
+LATE_FEE_SQL = (f"ROUND(TotalAmount * LEAST({LATE_FEE_RATE_PER_MONTH} * "
+                f"GREATEST(1, FLOOR((DATEDIFF(%s, DueDate) + 14) / 30)), {LATE_FEE_CAP}), 2)")
+
+
+def _run_in_ranges(db, job, table, key, where, where_params, assign, assign_params, tables,
+                   fee_sql=None, chunk_size=50000, dry_run=False, progress=None, start_id=None):
+    """Apply UPDATE table SET assign WHERE where to the matching rows, one key range per commit.
+
+    Only the ranges between the first and last matching key are visited,
+    chunk_size keys at a time.  With dry_run the rows are counted (and
+    fee_sql summed) instead of updated.
+    """
+    range_sql = f"SELECT MIN({key}), MAX({key}) FROM {table} WHERE {where} AND {key} >= %s"
+    if dry_run:
+        statement = (f"SELECT COUNT(*), COALESCE(SUM({fee_sql or '0'}), 0) FROM {table} "
+                     f"WHERE {key} BETWEEN %s AND %s AND {where}")
+        lead_params = assign_params if fee_sql else ()
+    else:
+        statement = f"UPDATE {table} SET {assign} WHERE {key} BETWEEN %s AND %s AND {where}"
+        lead_params = assign_params
+
+    conn = None
+    done = 0
+    fees = 0.0
+    chunks = 0
+    last_id = None
+    started = time.perf_counter()
+    try:
+        conn = db.get_connection(readonly=dry_run)
+        cursor = conn.cursor()
+        cursor.execute(range_sql, tuple(where_params) + (start_id or 0,))
+        low, high = cursor.fetchone()
+
+        lo = low
+        while low is not None and lo <= high:
+            hi = min(lo + chunk_size - 1, high)
+            timer = StatementTimer()
+            cursor.execute(statement, tuple(lead_params) + (lo, hi) + tuple(where_params))
+            if dry_run:
+                count, fee_total = cursor.fetchone()
+                fees += float(fee_total or 0)
+            else:
+                count = cursor.rowcount
+                conn.commit()
+                db.invalidate_cache(*tables)
+            timer.lap('execute')
+            db.query_stats.record(statement, timer, count)
+
+            done += count
+            chunks += 1
+            last_id = hi
+            if progress:
+                progress(done, last_id)
+            lo = hi + 1
+        cursor.close()
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            'job': job,
+            'dry_run': dry_run,
+            'rows': done,
+            'late_fees': round(fees, 2) if dry_run and fee_sql else None,
+            'chunks': chunks,
+            'last_id': last_id,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(done / elapsed, 1) if elapsed > 0 else float(done),
+        }
+        logger.info(f"{job}{' (dry run)' if dry_run else ''}: {done} rows in {chunks} chunks, "
+                    f"{summary['seconds']}s ({summary['rows_per_sec']} rows/sec)")
+        return summary
+    except Error as e:
+        logger.error(f"{job} failed after {done} rows (last {key} {last_id}): {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def scan_overdue(db, as_of=None, chunk_size=50000, dry_run=False, progress=None, start_id=None):
+    """Mark every Pending/Partial installment due before as_of as Overdue and set its late fee.
+
+    Works through InstallmentID ranges of chunk_size ids with one UPDATE and
+    one commit per range, so locks are held only briefly and a failure keeps
+    the ranges already done.  With dry_run nothing is written; the same
+    ranges are counted and the fees they would get are summed instead.
+    start_id resumes an interrupted scan.  progress, if given, is called as
+    progress(rows_so_far, last_id) after each range.
+
+    Returns a dict with as_of, rows, late_fees (dry run only), chunks,
+    last_id, seconds and rows_per_sec, or None on error.
+    """
+    as_of = as_of or DateUtils.today()
+    summary = _run_in_ranges(
+        db, f"Overdue scan as of {as_of}", 'Installment', 'InstallmentID',
+        "DueDate < %s AND Status IN ('Pending', 'Partial')", (as_of,),
+        f"Status = 'Overdue', LateFee = {LATE_FEE_SQL}", (as_of,), ('Installment',),
+        fee_sql=LATE_FEE_SQL, chunk_size=chunk_size, dry_run=dry_run, progress=progress, start_id=start_id)
+    if summary is not None:
+        summary['as_of'] = as_of
+    return summary
+
+
+def refresh_late_fees(db, as_of=None, chunk_size=50000, dry_run=False, progress=None, start_id=None):
+    """Bring the late fee of installments already Overdue up to date for as_of.
+
+    The fee grows with each month overdue, so it is recomputed nightly; rows
+    whose fee is already right are left alone.  Same options and result as
+    scan_overdue.
+    """
+    as_of = as_of or DateUtils.today()
+    summary = _run_in_ranges(
+        db, f"Late fee refresh as of {as_of}", 'Installment', 'InstallmentID',
+        f"Status = 'Overdue' AND DueDate < %s AND LateFee <> {LATE_FEE_SQL}", (as_of, as_of),
+        f"LateFee = {LATE_FEE_SQL}", (as_of,), ('Installment',),
+        fee_sql=f"{LATE_FEE_SQL} - LateFee", chunk_size=chunk_size, dry_run=dry_run,
+        progress=progress, start_id=start_id)
+    if summary is not None:
+        summary['as_of'] = as_of
+    return summary
+
+
+def close_paid_loans(db, chunk_size=50000, dry_run=False, progress=None, start_id=None):
+    """Close Active loans whose balance has been paid off"""
+    return _run_in_ranges(
+        db, "Close paid loans", 'Loan', 'LoanID',
+        "Status = 'Active' AND BalanceAmount <= 0", (),
+        "Status = 'Closed'", (), ('Loan', 'TransactionLogger'),
+        chunk_size=chunk_size, dry_run=dry_run, progress=progress, start_id=start_id)
+
+
+def default_delinquent_loans(db, as_of=None, chunk_size=50000, dry_run=False, progress=None, start_id=None):
+    """Mark Active loans Defaulted once an installment is DEFAULT_AFTER_DAYS overdue as of as_of"""
+    as_of = as_of or DateUtils.today()
+    return _run_in_ranges(
+        db, f"Default delinquent loans as of {as_of}", 'Loan', 'LoanID',
+        f"""Status = 'Active' AND EXISTS (
+                SELECT 1 FROM Installment i
+                WHERE i.LoanID = Loan.LoanID AND i.Status = 'Overdue'
+                AND i.DueDate <= DATE_SUB(%s, INTERVAL {DEFAULT_AFTER_DAYS} DAY))""", (as_of,),
+        "Status = 'Defaulted'", (), ('Loan', 'TransactionLogger'),
+        chunk_size=chunk_size, dry_run=dry_run, progress=progress, start_id=start_id)
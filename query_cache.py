@@ -0,0 +1,132 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Base tables behind each view, so cached view results are invalidated by writes to them
+VIEW_TABLES = {
+    'customerloansummary': ('customer', 'customerloantotals'),
+    'agentperformance': ('agent', 'agentloantotals', 'branch'),
+    'overdueinstallments': ('installment', 'loan', 'customer', 'agent'),
+}
+
+# Tables each stored procedure writes
+PROCEDURE_TABLES = {
+    'processemipayment': ('installment', 'loan', 'transactionlogger'),
+    'createloaninstallments': ('installment',),
+    'refreshloantotals': ('customerloantotals', 'agentloantotals'),
+}
+
+# Tables written as a side effect of triggers on another table
+TRIGGER_TABLES = {
+    'loan': ('transactionlogger', 'customerloantotals', 'agentloantotals'),  # LogLoanStatusChange, the totals triggers
+    'customer': ('customerloantotals', 'loan', 'agentloantotals'),  # AddCustomerTotals, RemoveCustomerLoans
+    'vehicle': ('loan', 'customerloantotals', 'agentloantotals'),  # RemoveVehicleLoans
+    'agent': ('agentloantotals',),  # AddAgentTotals
+}
+
+READ_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+`?(\w+)`?', re.IGNORECASE)
+WRITE_TABLE_RE = re.compile(
+    r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?',
+    re.IGNORECASE)
+
+
+def _expand(tables):
+    expanded = set()
+    for table in tables:
+        table = table.lower()
+        expanded.add(table)
+        expanded.update(VIEW_TABLES.get(table, ()))
+        expanded.update(TRIGGER_TABLES.get(table, ()))
+    return expanded
+
+
+def tables_read(query):
+    """Lower-cased base tables a SELECT reads (views are expanded to their tables)"""
+    return _expand(READ_TABLE_RE.findall(query))
+
+
+def tables_written(query):
+    """Lower-cased tables a write statement changes, including trigger side effects"""
+    match = WRITE_TABLE_RE.match(query)
+    return _expand([match.group(1)]) if match else set()
+
+
+def procedure_tables(procedure_name):
+    return _expand(PROCEDURE_TABLES.get(procedure_name.lower(), ()))
+
+
+class QueryCache:
+    """In-process LRU of SELECT results with per-entry TTL and table-tag invalidation.
+
+    Each entry remembers the tables it read.  A write to any of those tables
+    drops the entry, and bumps a per-table version so a read that was already
+    in flight when the write happened is not stored afterwards.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, tables, rows)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return cached rows for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[2])
+
+    def snapshot(self, tables):
+        """Current versions of tables; pass to put() to detect writes made during the read"""
+        with self._lock:
+            return tuple(self._versions.get(t, 0) for t in sorted(tables))
+
+    def put(self, key, rows, ttl, tables, snapshot):
+        with self._lock:
+            if tuple(self._versions.get(t, 0) for t in sorted(tables)) != snapshot:
+                return
+            self._entries[key] = (time.monotonic() + ttl, frozenset(tables), list(rows))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        # Also the tables written by triggers on them, and the base tables behind any view named
+        tables = _expand(tables)
+        if not tables:
+            return
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            stale = [key for key, (_, tags, _) in self._entries.items() if tags & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,156 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+slow_logger = logging.getLogger('slow_query')
+
+
+def normalise_sql(query):
+    """Collapse a statement to its shape: literals become ?, whitespace is squeezed, IN lists fold"""
+    text = _STRING_RE.sub('?', query)
+    text = _NUMBER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('IN (...)', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def estimate_payload(rows):
+    """Rough byte size of a result set, extrapolated from its first row"""
+    if not rows:
+        return 0
+    first = rows[0]
+    values = first.values() if isinstance(first, dict) else first
+    return sum(len(str(v)) for v in values) * len(rows)
+
+
+class StatementTimer:
+    """Splits the wall time of one database call into checkout, execute and fetch phases"""
+    __slots__ = ('last', 'checkout', 'execute', 'fetch')
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.checkout = 0.0
+        self.execute = 0.0
+        self.fetch = 0.0
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        setattr(self, phase, getattr(self, phase) + now - self.last)
+        self.last = now
+
+    def pause(self):
+        """Restart the clock without charging the gap to any phase (e.g. while a caller consumes a chunk)"""
+        self.last = time.perf_counter()
+
+    @property
+    def total(self):
+        return self.checkout + self.execute + self.fetch
+
+
+class _StatementStats:
+    __slots__ = ('calls', 'errors', 'checkout', 'execute', 'fetch', 'rows', 'payload', 'max', 'recent')
+
+    def __init__(self, window):
+        self.calls = 0
+        self.errors = 0
+        self.checkout = 0.0
+        self.execute = 0.0
+        self.fetch = 0.0
+        self.rows = 0
+        self.payload = 0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class QueryStats:
+    """Per-statement latency, row and payload counters with rolling percentiles and a slow log.
+
+    Statements are grouped by their normalised text.  Percentiles are taken
+    over the last `window` calls of each statement.  Calls slower than
+    slow_ms are written to the 'slow_query' logger, which gets its own file
+    handler when slow_log is set.
+    """
+    def __init__(self, window=500, slow_ms=500, slow_log=None):
+        self.window = window
+        self.slow_ms = slow_ms
+        self._stats = {}
+        self._lock = threading.Lock()
+        if slow_log and not slow_logger.handlers:
+            handler = logging.FileHandler(slow_log, delay=True)
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+            slow_logger.addHandler(handler)
+            slow_logger.setLevel(logging.INFO)
+            slow_logger.propagate = False
+
+    def record(self, query, timer, rows=0, payload=0, error=False, params=None):
+        key = normalise_sql(query)
+        total = timer.total
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats(self.window)
+            stats.calls += 1
+            stats.errors += 1 if error else 0
+            stats.checkout += timer.checkout
+            stats.execute += timer.execute
+            stats.fetch += timer.fetch
+            stats.rows += rows
+            stats.payload += payload
+            stats.max = max(stats.max, total)
+            stats.recent.append(total)
+
+        if self.slow_ms and total * 1000 >= self.slow_ms:
+            slow_logger.warning(
+                f"{total * 1000:.1f} ms (checkout {timer.checkout * 1000:.1f}, execute {timer.execute * 1000:.1f}, "
+                f"fetch {timer.fetch * 1000:.1f}) rows={rows} bytes~{payload} params={params!r}: {key}")
+
+    def rows(self):
+        """One dict per statement, slowest total time first"""
+        with self._lock:
+            items = [(key, s, sorted(s.recent)) for key, s in self._stats.items()]
+        result = []
+        for key, s, ordered in items:
+            calls = s.calls or 1
+            result.append({
+                'Statement': key,
+                'Calls': s.calls,
+                'Errors': s.errors,
+                'TotalMs': round((s.checkout + s.execute + s.fetch) * 1000, 1),
+                'P50Ms': round(_percentile(ordered, 50) * 1000, 2),
+                'P95Ms': round(_percentile(ordered, 95) * 1000, 2),
+                'P99Ms': round(_percentile(ordered, 99) * 1000, 2),
+                'MaxMs': round(s.max * 1000, 2),
+                'AvgCheckoutMs': round(s.checkout / calls * 1000, 2),
+                'AvgExecuteMs': round(s.execute / calls * 1000, 2),
+                'AvgFetchMs': round(s.fetch / calls * 1000, 2),
+                'AvgRows': round(s.rows / calls, 1),
+                'AvgBytes': int(s.payload / calls),
+            })
+        result.sort(key=lambda r: r['TotalMs'], reverse=True)
+        return result
+
+    def format_table(self, limit=20):
+        rows = self.rows()[:limit]
+        header = f"{'calls':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'wait':>7} {'rows':>8} {'bytes':>9}  statement"
+        lines = [header, '-' * len(header)]
+        for r in rows:
+            lines.append(f"{r['Calls']:>7} {r['P50Ms']:>8} {r['P95Ms']:>8} {r['P99Ms']:>8} {r['MaxMs']:>8} "
+                         f"{r['AvgCheckoutMs']:>7} {r['AvgRows']:>8} {r['AvgBytes']:>9}  {r['Statement'][:100]}")
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,320 @@
+# report_renderer.py
+# Loan report PDFs without tkinter.  The font is found, subset and written once per process, the page
+# layout is built once, and each export only formats its own rows; enhancements.generate_loan_pdf
+# wraps render_loan_report for the dashboards.
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+from fpdf import FPDF
+
+logger = logging.getLogger(__name__)
+
+# fontTools logs every glyph it subsets at DEBUG, which buried app.log when the app runs at DEBUG
+logging.getLogger('fontTools').setLevel(logging.WARNING)
+
+FONT_DIRS = (
+    os.path.join(os.getcwd(), 'fonts'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'),
+    '/usr/share/fonts/truetype/dejavu',
+)
+
+# Characters a report can contain: Latin (names, addresses), punctuation and the rupee sign.
+# Subsetting DejaVu to these once makes registering it in each document ~10x cheaper.
+REPORT_UNICODES = (list(range(0x20, 0x250)) + list(range(0x2000, 0x2070)) + list(range(0x20A0, 0x20D0)))
+
+
+def _find_font(filename):
+    override = os.getenv('REPORT_FONT_DIR')
+    for folder in ((override,) if override else ()) + FONT_DIRS:
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _subset_font(path):
+    """Cached subset of the TTF at path, shared by every process through the temp directory"""
+    from fontTools import subset
+
+    st = os.stat(path)
+    key = hashlib.md5(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+    target = os.path.join(tempfile.gettempdir(), f"loan_report_{os.path.basename(path)[:-4]}_{key}.ttf")
+    if os.path.isfile(target):
+        return target
+
+    options = subset.Options(notdef_outline=True, recommended_glyphs=True, layout_features=[], hinting=False)
+    options.drop_tables += ['FFTM']
+    font = subset.load_font(path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=REPORT_UNICODES)
+    subsetter.subset(font)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    subset.save_font(font, tmp, options)
+    os.replace(tmp, target)
+    return target
+
+
+@lru_cache(maxsize=1)
+def report_fonts():
+    """{style: path} of the report fonts ('' and, if available, 'B'), or {} to use Helvetica"""
+    fonts = {}
+    for style, filename in (('', 'DejaVuSans.ttf'), ('B', 'DejaVuSans-Bold.ttf')):
+        path = _find_font(filename)
+        if path is None:
+            continue
+        try:
+            fonts[style] = _subset_font(path)
+        except Exception:
+            logger.exception(f"Could not subset {path}, embedding the full font")
+            fonts[style] = path
+    if '' not in fonts:
+        logger.warning("DejaVuSans.ttf not found in fonts/, reports use Helvetica and 'Rs'")
+        return {}
+    return fonts
+
+
+class ReportTemplate:
+    """Layout shared by every loan report: fonts, currency prefix and the two tables"""
+    TITLE = "Loan Report - Loan ID: {loan_id}"
+    INSTALLMENT_COLUMNS = ('Due Date', 'Amount', 'Status', 'Late Fee', 'Paid Date')
+    INSTALLMENT_WIDTHS = (30, 40, 40, 30, 40)
+    TRANSACTION_COLUMNS = ('Date', 'Type', 'Debit', 'Credit', 'Balance', 'Remarks')
+    TRANSACTION_WIDTHS = (32, 28, 26, 26, 30, 48)
+    REMARKS_CHARS = 28
+    ROW_HEIGHT = 6
+
+    def __init__(self, fonts):
+        self.fonts = fonts
+        self.family = 'DejaVu' if fonts else 'Helvetica'
+        self.bold = 'B' if not fonts or 'B' in fonts else ''
+        self.currency = '₹' if fonts else 'Rs '
+
+    def money(self, value):
+        if value is None:
+            return ""
+        try:
+            return f"{self.currency}{float(value):,.2f}"
+        except (TypeError, ValueError):
+            return str(value)
+
+    def installment_row(self, inst):
+        return (str(inst.get('DueDate') or ''), self.money(inst.get('TotalAmount')), str(inst.get('Status') or ''),
+                self.money(inst.get('LateFee')), str(inst.get('PaidDate') or ''))
+
+    def transaction_row(self, txn):
+        remarks = txn.get('Remarks') or ''
+        if len(remarks) > self.REMARKS_CHARS:
+            remarks = remarks[:self.REMARKS_CHARS - 3] + '...'
+        when = txn.get('TransactionDate')
+        return (when.strftime('%Y-%m-%d %H:%M') if hasattr(when, 'strftime') else str(when or ''),
+                str(txn.get('TransactionType') or ''), self.money(txn.get('DebitAmount')),
+                self.money(txn.get('CreditAmount')), self.money(txn.get('BalanceAfterTransaction')), remarks)
+
+    def new_document(self):
+        pdf = FPDF(format='A4', unit='mm')
+        pdf.set_auto_page_break(auto=True, margin=15)
+        for style, path in self.fonts.items():
+            pdf.add_font(self.family, style, path)
+        return pdf
+
+    def table_header(self, pdf, columns, widths):
+        pdf.set_font(self.family, style=self.bold, size=10)
+        for width, heading in zip(widths, columns):
+            pdf.cell(width, 7, heading, border=1, align='C')
+        pdf.ln()
+        pdf.set_font(self.family, size=9)
+
+    def table(self, pdf, columns, widths, rows, heading=None, always=False):
+        """Draw rows (any iterable, consumed once) as a table whose header repeats on every page.
+
+        Without always, nothing (not even the heading) is drawn when rows is empty.
+        """
+        started = False
+        for row in rows:
+            if not started:
+                self._table_start(pdf, columns, widths, heading)
+                started = True
+            if pdf.will_page_break(self.ROW_HEIGHT):
+                pdf.add_page()
+                self.table_header(pdf, columns, widths)
+            for width, text in zip(widths, row):
+                pdf.cell(width, self.ROW_HEIGHT, text, border=1)
+            pdf.ln()
+        if always and not started:
+            self._table_start(pdf, columns, widths, heading)
+
+    def _table_start(self, pdf, columns, widths, heading):
+        if heading:
+            pdf.ln(4)
+            pdf.set_font(self.family, style=self.bold, size=12)
+            pdf.cell(0, 8, heading, new_x='LMARGIN', new_y='NEXT')
+        self.table_header(pdf, columns, widths)
+
+
+@lru_cache(maxsize=1)
+def report_template():
+    return ReportTemplate(report_fonts())
+
+
+class LoanReportData:
+    """Everything one loan report prints, already formatted as strings.
+
+    installments and transactions are iterables of row tuples: lists when
+    built with from_rows, generators over a streaming cursor when built by
+    load_loan_report (those can be rendered only once).
+    """
+    __slots__ = ('loan_id', 'title', 'lines', 'installments', 'transactions')
+
+    def __init__(self, loan_id, title, lines, installments, transactions=()):
+        self.loan_id = loan_id
+        self.title = title
+        self.lines = lines
+        self.installments = installments
+        self.transactions = transactions
+
+    @staticmethod
+    def header_lines(loan, template=None):
+        """Customer, loan and vehicle lines for the top of the report"""
+        money = (template or report_template()).money
+        lines = [
+            (f"Customer: {loan.get('FirstName', '')} {loan.get('LastName', '')}", f"Phone: {loan.get('Phone', '')}"),
+            (f"Email: {loan.get('Email', '')}",),
+            None,
+            (f"Loan Amount: {money(loan.get('LoanAmount') or 0)}    Balance: {money(loan.get('BalanceAmount') or 0)}"
+             f"    Status: {loan.get('Status') or ''}",),
+            None,
+            (f"Vehicle: {loan.get('VehicleNo', '')}  -  {loan.get('Make', '')} {loan.get('Model', '')} "
+             f"({loan.get('Year', '')})",),
+        ]
+        if loan.get('MarketValue'):
+            lines.append((f"Market Value: {money(loan['MarketValue'])}",))
+        return lines
+
+    @classmethod
+    def from_rows(cls, loan, installments, transactions=(), template=None, title=None):
+        """Build the report from the loan header row and its installment/transaction rows (query dicts)"""
+        t = template or report_template()
+        loan_id = loan.get('LoanID')
+        return cls(loan_id, title or t.TITLE.format(loan_id=loan_id), cls.header_lines(loan, t),
+                   [t.installment_row(inst) for inst in installments],
+                   [t.transaction_row(txn) for txn in transactions])
+
+
+# Recent renders, for render_stats()
+_recent = deque(maxlen=500)
+_recent_lock = threading.Lock()
+
+
+def render_loan_report_bytes(data, template=None):
+    """Draw data (a LoanReportData); returns (PDF bytes, page count).
+
+    The time taken, page count and size are kept for render_stats().
+    """
+    t = template or report_template()
+    started = time.perf_counter()
+    pdf = t.new_document()
+    pdf.add_page()
+
+    pdf.set_font(t.family, style=t.bold, size=14)
+    pdf.cell(0, 10, data.title, new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(2)
+    pdf.set_font(t.family, size=10)
+    for line in data.lines:
+        if line is None:
+            pdf.ln(3)
+        elif len(line) == 2:
+            pdf.cell(100, 6, line[0])
+            pdf.cell(0, 6, line[1], new_x='LMARGIN', new_y='NEXT')
+        else:
+            pdf.cell(0, 6, line[0], new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(6)
+
+    t.table(pdf, t.INSTALLMENT_COLUMNS, t.INSTALLMENT_WIDTHS, data.installments, always=True)
+    t.table(pdf, t.TRANSACTION_COLUMNS, t.TRANSACTION_WIDTHS, data.transactions, heading="Transactions")
+
+    pdf.ln(6)
+    pdf.cell(0, 6, f"Generated on: {datetime.now().isoformat()}", new_x='LMARGIN', new_y='NEXT')
+
+    content = bytes(pdf.output())
+    elapsed = time.perf_counter() - started
+    with _recent_lock:
+        _recent.append((elapsed, len(content), pdf.pages_count))
+    return content, pdf.pages_count
+
+
+def render_loan_report(data, filename=None, template=None):
+    """Draw data (a LoanReportData) and write it to filename; returns the path"""
+    started = time.perf_counter()
+    content, pages = render_loan_report_bytes(data, template)
+    fname = filename or f"LoanReport_{data.loan_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    with open(fname, 'wb') as f:
+        f.write(content)
+    logger.info(f"Loan report {data.loan_id}: {pages} pages, {len(content)} bytes, "
+                f"{(time.perf_counter() - started) * 1000:.1f}ms -> {fname}")
+    return fname
+
+
+def render_stats():
+    """Count, average/max milliseconds, average KB and pages of the recent renders in this process"""
+    with _recent_lock:
+        recent = list(_recent)
+    if not recent:
+        return {'reports': 0}
+    seconds = [r[0] for r in recent]
+    return {
+        'reports': len(recent),
+        'avg_ms': round(sum(seconds) / len(recent) * 1000, 1),
+        'max_ms': round(max(seconds) * 1000, 1),
+        'avg_kb': round(sum(r[1] for r in recent) / len(recent) / 1024, 1),
+        'pages': sum(r[2] for r in recent),
+    }
+
+
+LOAN_HEADER_QUERY = """
+    SELECT l.*, c.FirstName, c.LastName, c.Phone, c.Email,
+           v.VehicleNo, v.Make, v.Model, v.Year, v.MarketValue
+    FROM Loan l
+    JOIN Customer c ON l.CustomerID = c.CustomerID
+    JOIN Vehicle v ON l.VehicleID = v.VehicleID
+    WHERE l.LoanID = %s
+"""
+
+INSTALLMENTS_QUERY = "SELECT DueDate, TotalAmount, Status, LateFee, PaidDate FROM Installment WHERE LoanID=%s ORDER BY DueDate"
+
+TRANSACTIONS_QUERY = """
+    SELECT TransactionDate, TransactionType, DebitAmount, CreditAmount, BalanceAfterTransaction, Remarks
+    FROM TransactionLogger
+    WHERE LoanID = %s
+    ORDER BY TransactionDate, TransactionID
+"""
+
+
+def _stream_rows(db, query, params, format_row, chunk_size):
+    for chunk in db.iter_query(query, params, chunk_size=chunk_size):
+        for row in chunk:
+            yield format_row(row)
+
+
+def load_loan_report(db, loan_id, chunk_size=500):
+    """LoanReportData for loan_id, or None if the loan does not exist.
+
+    Only the header row is read up front.  Installments and then
+    transactions are pulled from a streaming cursor chunk_size rows at a
+    time while the report is drawn, so no list of a loan's history is ever
+    built and a long history costs only its PDF pages.
+    """
+    rows = db.execute_query(LOAN_HEADER_QUERY, (loan_id,))
+    if not rows:
+        return None
+    t = report_template()
+    return LoanReportData(loan_id, t.TITLE.format(loan_id=loan_id), LoanReportData.header_lines(rows[0], t),
+                          _stream_rows(db, INSTALLMENTS_QUERY, (loan_id,), t.installment_row, chunk_size),
+                          _stream_rows(db, TRANSACTIONS_QUERY, (loan_id,), t.transaction_row, chunk_size))
@@ -0,0 +1,270 @@
+# repricing.py
+# Re-checks every active loan against the lending policy in utils (or proposed limits) and reprices
+# the ones whose rate falls outside it, e.g.
+#   python repricing.py --max-rate 22 --dry-run
+# Loans are streamed in chunks, so memory does not grow with the book.  Every loan that breaks a
+# rule or gets a new rate is written to a CSV diff report.
+
+import argparse
+import csv
+import logging
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+from mysql.connector import Error
+
+from database import Database
+from money import to_db, to_paise, to_rupees
+from query_stats import StatementTimer
+from utils import (LoanCalculator, DateUtils, MAX_LTV_PERCENT, MIN_INTEREST_RATE, MAX_INTEREST_RATE,
+                   MIN_TENURE_MONTHS, MAX_TENURE_MONTHS)
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_LOANS_QUERY = """
+    SELECT l.LoanID, l.LoanAmount, l.InterestRate, l.TenureMonths, l.EMAmount, v.MarketValue
+    FROM Loan l
+    JOIN Vehicle v ON l.VehicleID = v.VehicleID
+    WHERE l.Status = 'Active'
+    ORDER BY l.LoanID
+"""
+
+# Only instalments not yet due are repriced; anything already due keeps the amount that was billed.
+# The placeholders for the LoanID list are filled in per chunk.
+PENDING_INSTALLMENTS_QUERY = """
+    SELECT InstallmentID, LoanID, PrincipalAmount, TotalAmount
+    FROM Installment
+    WHERE Status = 'Pending' AND DueDate >= %s AND LoanID IN ({ids})
+    ORDER BY LoanID, DueDate
+"""
+
+UPDATE_INSTALLMENT = """
+    UPDATE Installment SET PrincipalAmount = %s, InterestAmount = %s, TotalAmount = %s
+    WHERE InstallmentID = %s
+"""
+
+UPDATE_LOAN = """
+    UPDATE Loan SET InterestRate = %s, EMAmount = %s,
+           TotalPayable = TotalPayable + %s, BalanceAmount = BalanceAmount + %s
+    WHERE LoanID = %s
+"""
+
+REPORT_COLUMNS = ('LoanID', 'Action', 'Issues', 'LTV', 'OldRate', 'NewRate', 'OldEMI', 'NewEMI',
+                  'RemainingInstallments', 'OldRemaining', 'NewRemaining')
+
+
+def _reprice_chunk(db, as_of, loan_ids, new_rates, dry_run):
+    """New schedules for the pending instalments of loan_ids, written in one transaction.
+
+    Returns {loan_id: (remaining, old_total, new_total, new_emi)} for the
+    loans that had instalments left to reprice.
+    """
+    conn = None
+    try:
+        conn = db.get_connection(readonly=dry_run)
+        cursor = conn.cursor()
+        query = PENDING_INSTALLMENTS_QUERY.format(ids=', '.join(['%s'] * len(loan_ids)))
+        if not dry_run:
+            # Lock the rows so a payment cannot land between reading and rewriting them
+            query += " FOR UPDATE"
+        timer = StatementTimer()
+        cursor.execute(query, (as_of,) + tuple(int(i) for i in loan_ids))
+        rows = cursor.fetchall()
+        timer.lap('execute')
+        db.query_stats.record(query, timer, len(rows))
+        if not rows:
+            conn.rollback()
+            return {}
+
+        installment_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        row_loans = np.array([r[1] for r in rows], dtype=np.int64)
+        principal = to_paise([r[2] for r in rows])
+        old_total = to_paise([r[3] for r in rows])
+
+        # Rows come ordered by loan, so each loan is one contiguous run.  A loan with no principal left
+        # (e.g. prepaid in full but still Active) has nothing to reprice and is left out.
+        loans, first, remaining = np.unique(row_loans, return_index=True, return_counts=True)
+        has_principal = np.repeat(np.add.reduceat(principal, first) > 0, remaining)
+        if not has_principal.all():
+            installment_ids, row_loans, principal, old_total = (
+                a[has_principal] for a in (installment_ids, row_loans, principal, old_total))
+            rows = [r for r, keep in zip(rows, has_principal) if keep]
+            if not rows:
+                conn.rollback()
+                return {}
+            loans, first, remaining = np.unique(row_loans, return_index=True, return_counts=True)
+        outstanding = np.add.reduceat(principal, first)
+        old_totals = np.add.reduceat(old_total, first)
+        rate_of = dict(zip(loan_ids, new_rates))
+        rates = np.array([rate_of[loan] for loan in loans], dtype=float)
+
+        schedule = LoanCalculator.amortization_batch_paise(to_rupees(outstanding), rates, remaining)
+        loan_index = np.repeat(np.arange(len(loans)), remaining)
+        position = np.arange(len(rows)) - np.repeat(first, remaining)
+        new_principal = schedule['principal'][loan_index, position]
+        new_interest = schedule['interest'][loan_index, position]
+        new_totals = np.add.reduceat(new_principal + new_interest, first)
+
+        if not dry_run:
+            timer = StatementTimer()
+            cursor.executemany(UPDATE_INSTALLMENT, [
+                (to_db(p / 100), to_db(i / 100), to_db((p + i) / 100), int(inst))
+                for p, i, inst in zip(new_principal, new_interest, installment_ids)])
+            timer.lap('execute')
+            db.query_stats.record(UPDATE_INSTALLMENT, timer, len(rows))
+            timer = StatementTimer()
+            cursor.executemany(UPDATE_LOAN, [
+                (float(rate), to_db(emi / 100), to_db((new - old) / 100), to_db((new - old) / 100), int(loan))
+                for loan, rate, emi, old, new in zip(loans, rates, schedule['emi'], old_totals, new_totals)])
+            timer.lap('execute')
+            db.query_stats.record(UPDATE_LOAN, timer, len(loans))
+            conn.commit()
+            db.invalidate_cache('Loan', 'Installment')
+        else:
+            conn.rollback()
+        cursor.close()
+
+        return {int(loan): (int(count), old / 100, new / 100, emi / 100)
+                for loan, count, old, new, emi in zip(loans, remaining, old_totals, new_totals, schedule['emi'])}
+    except Error:
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+def reprice_book(db, as_of=None, rate_shift=0.0, max_ltv=MAX_LTV_PERCENT, min_rate=MIN_INTEREST_RATE,
+                 max_rate=MAX_INTEREST_RATE, min_tenure=MIN_TENURE_MONTHS, max_tenure=MAX_TENURE_MONTHS,
+                 chunk_size=2000, dry_run=False, report_path=None, progress=None):
+    """Validate every active loan against the given limits and reprice the ones that need it.
+
+    A loan's new rate is its current rate plus rate_shift, clamped to
+    [min_rate, max_rate]; loans whose rate changes get a fresh reducing-
+    balance schedule for their outstanding principal over the instalments
+    not yet due, and a new EMI.  LTV and tenure breaches cannot be fixed by
+    repricing, so they are only reported.  Each chunk of loans is validated
+    and repriced with array operations and committed as one transaction; with
+    dry_run nothing is written but the report is the same.  progress, if
+    given, is called as progress(loans_so_far, repriced_so_far).
+
+    Returns a dict with loans, flagged counts, repriced, installments,
+    emi_before/emi_after totals, report, seconds and loans_per_sec, or None
+    on error.  Chunks committed before an error are kept.
+    """
+    as_of = as_of or DateUtils.today()
+    report_path = report_path or f"Repricing_{as_of.isoformat()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    started = time.perf_counter()
+    summary = {
+        'as_of': as_of,
+        'dry_run': dry_run,
+        'loans': 0,
+        'ltv_breaches': 0,
+        'rate_breaches': 0,
+        'tenure_breaches': 0,
+        'repriced': 0,
+        'installments': 0,
+        'emi_before': 0.0,
+        'emi_after': 0.0,
+        'report': report_path,
+    }
+
+    try:
+        with open(report_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_COLUMNS)
+            for chunk in db.iter_query(ACTIVE_LOANS_QUERY, chunk_size=chunk_size):
+                loan_ids = np.array([r['LoanID'] for r in chunk], dtype=np.int64)
+                rates = np.array([float(r['InterestRate']) for r in chunk])
+                emis = np.array([float(r['EMAmount']) for r in chunk])
+                checks = LoanCalculator.validate_loan_parameters_batch(
+                    [float(r['LoanAmount']) for r in chunk], [float(r['MarketValue']) for r in chunk],
+                    rates, [r['TenureMonths'] for r in chunk], max_ltv=max_ltv, min_rate=min_rate,
+                    max_rate=max_rate, min_tenure=min_tenure, max_tenure=max_tenure)
+
+                new_rates = np.round(np.clip(rates + rate_shift, min_rate, max_rate), 2)
+                changed = new_rates != rates
+                repriced = _reprice_chunk(db, as_of, loan_ids[changed].tolist(),
+                                          new_rates[changed].tolist(), dry_run) if changed.any() else {}
+
+                summary['loans'] += len(chunk)
+                summary['ltv_breaches'] += int((~checks['ltv_ok']).sum())
+                summary['rate_breaches'] += int((~checks['rate_ok']).sum())
+                summary['tenure_breaches'] += int((~checks['tenure_ok']).sum())
+                summary['repriced'] += len(repriced)
+                summary['installments'] += sum(r[0] for r in repriced.values())
+
+                for k in np.flatnonzero(changed | ~checks['valid']):
+                    loan_id = int(loan_ids[k])
+                    issues = [name for name, ok in (('LTV', checks['ltv_ok'][k]), ('Rate', checks['rate_ok'][k]),
+                                                    ('Tenure', checks['tenure_ok'][k])) if not ok]
+                    if loan_id in repriced:
+                        count, old_total, new_total, new_emi = repriced[loan_id]
+                        action = 'Would reprice' if dry_run else 'Repriced'
+                        summary['emi_before'] += emis[k]
+                        summary['emi_after'] += new_emi
+                        writer.writerow((loan_id, action, ' '.join(issues), f"{checks['ltv'][k]:.1f}",
+                                         f"{rates[k]:.2f}", f"{new_rates[k]:.2f}", f"{emis[k]:.2f}",
+                                         f"{new_emi:.2f}", count, f"{old_total:.2f}", f"{new_total:.2f}"))
+                    else:
+                        action = 'Flagged' if issues else 'Nothing due'
+                        writer.writerow((loan_id, action, ' '.join(issues), f"{checks['ltv'][k]:.1f}",
+                                         f"{rates[k]:.2f}", f"{rates[k]:.2f}", f"{emis[k]:.2f}",
+                                         f"{emis[k]:.2f}", 0, '', ''))
+
+                if progress:
+                    progress(summary['loans'], summary['repriced'])
+    except (Error, OSError, ValueError) as e:
+        logger.error(f"Repricing failed after {summary['loans']} loans ({summary['repriced']} repriced): {e}")
+        return None
+
+    elapsed = time.perf_counter() - started
+    summary['emi_before'] = round(float(summary['emi_before']), 2)
+    summary['emi_after'] = round(float(summary['emi_after']), 2)
+    summary['seconds'] = round(elapsed, 3)
+    summary['loans_per_sec'] = round(summary['loans'] / elapsed, 1) if elapsed > 0 else float(summary['loans'])
+    logger.info(f"Repricing{' (dry run)' if dry_run else ''} as of {as_of}: {summary['loans']} loans, "
+                f"{summary['repriced']} repriced ({summary['installments']} installments), "
+                f"{summary['ltv_breaches']} LTV / {summary['rate_breaches']} rate / "
+                f"{summary['tenure_breaches']} tenure breaches, {summary['seconds']}s; report {report_path}")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-validate and reprice the active loan book")
+    parser.add_argument('--as-of', type=date.fromisoformat, default=DateUtils.today(),
+                        help="instalments due on or after this date are repriced (default $LOAN_AS_OF or today)")
+    parser.add_argument('--rate-shift', type=float, default=0.0, help="percentage points added to every rate")
+    parser.add_argument('--max-ltv', type=float, default=MAX_LTV_PERCENT)
+    parser.add_argument('--min-rate', type=float, default=MIN_INTEREST_RATE)
+    parser.add_argument('--max-rate', type=float, default=MAX_INTEREST_RATE)
+    parser.add_argument('--min-tenure', type=int, default=MIN_TENURE_MONTHS)
+    parser.add_argument('--max-tenure', type=int, default=MAX_TENURE_MONTHS)
+    parser.add_argument('--chunk-size', type=int, default=2000, help="loans per transaction")
+    parser.add_argument('--dry-run', action='store_true', help="write the report without changing any loan")
+    parser.add_argument('--report', help="CSV diff report path (default Repricing_<as-of>_<timestamp>.csv)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    try:
+        db = Database()
+    except Exception as e:
+        logging.error(f"Cannot connect to database: {e}")
+        return 1
+    try:
+        summary = reprice_book(db, args.as_of, args.rate_shift, args.max_ltv, args.min_rate, args.max_rate,
+                               args.min_tenure, args.max_tenure, args.chunk_size, args.dry_run, args.report)
+    finally:
+        db.close()
+    return 0 if summary is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# rollups.py
+# Pre-aggregated reporting tables kept current from a high-water mark.  CollectionRollup sums the
+# TransactionLogger per month, branch, agent and type, so the Monthly Collection report and the admin
+# charts read a few hundred rows instead of grouping the whole ledger through DATE_FORMAT().
+# CustomerLoanTotals and AgentLoanTotals are kept current by Loan triggers; refresh_loan_totals rebuilds them.
+# No tkinter here; the batch runner's 'collections' stage and the admin views call into it.
+
+import argparse
+import logging
+import sys
+import time
+
+from mysql.connector import Error
+
+from database import Database
+from query_stats import StatementTimer
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_ROLLUP = 'CollectionRollup'
+
+# TransactionLogger is append-only, so each new TransactionID range is added onto the sums once.
+# Month is a DATE so the primary key also serves range scans by month.
+COLLECTION_ROLLUP_SQL = """
+    INSERT INTO CollectionRollup (Month, BranchID, AgentID, TransactionType, Transactions, DebitAmount, CreditAmount)
+    SELECT DATE_FORMAT(t.TransactionDate, '%Y-%m-01'), l.BranchID, l.AgentID, t.TransactionType,
+           COUNT(*), SUM(t.DebitAmount), SUM(t.CreditAmount)
+    FROM TransactionLogger t
+    JOIN Loan l ON t.LoanID = l.LoanID
+    WHERE t.TransactionID BETWEEN %s AND %s
+    GROUP BY 1, 2, 3, 4
+    ON DUPLICATE KEY UPDATE Transactions = Transactions + VALUES(Transactions),
+                            DebitAmount = DebitAmount + VALUES(DebitAmount),
+                            CreditAmount = CreditAmount + VALUES(CreditAmount)
+"""
+
+MONTHLY_COLLECTION_QUERY = """
+    SELECT DATE_FORMAT(Month, '%Y-%m') as Month,
+           SUM(DebitAmount) as TotalCollection,
+           SUM(Transactions) as TotalTransactions
+    FROM CollectionRollup
+    WHERE TransactionType = 'EMI Payment'
+    GROUP BY Month
+    ORDER BY Month DESC
+"""
+
+# The same figures from the ledger itself, for when the rollup cannot be brought up to date
+LEDGER_MONTHLY_COLLECTION_QUERY = """
+    SELECT DATE_FORMAT(TransactionDate, '%Y-%m') as Month,
+           SUM(DebitAmount) as TotalCollection,
+           COUNT(*) as TotalTransactions
+    FROM TransactionLogger
+    WHERE TransactionType = 'EMI Payment'
+    GROUP BY DATE_FORMAT(TransactionDate, '%Y-%m')
+    ORDER BY Month DESC
+"""
+
+
+def _execute(db, cursor, query, params):
+    timer = StatementTimer()
+    cursor.execute(query, params)
+    timer.lap('execute')
+    db.query_stats.record(query, timer, cursor.rowcount)
+
+
+def refresh_collection_rollup(db, chunk_size=100000, settle_seconds=60, progress=None):
+    """Fold TransactionLogger rows added since the watermark into CollectionRollup.
+
+    Works through TransactionID ranges of chunk_size ids; each range and
+    the watermark move in one transaction, so a failure or a concurrent
+    refresh never counts a row twice (the watermark row is locked first).
+    Rows younger than settle_seconds are left for the next run, so an
+    insert whose id was allocated but not yet committed is not skipped.
+    progress, if given, is called as progress(rows_so_far, last_id).
+
+    Returns a dict with rows (ledger rows folded in), chunks, last_id,
+    seconds and rows_per_sec, or None on error.
+    """
+    conn = None
+    done = 0
+    chunks = 0
+    last_id = None
+    started = time.perf_counter()
+    try:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        _execute(db, cursor, "INSERT IGNORE INTO RollupWatermark (RollupName, LastID) VALUES (%s, 0)",
+                 (COLLECTION_ROLLUP,))
+        _execute(db, cursor, "SELECT COALESCE(MAX(TransactionID), 0) FROM TransactionLogger "
+                             "WHERE TransactionDate < NOW() - INTERVAL %s SECOND", (settle_seconds,))
+        target = cursor.fetchone()[0]
+        conn.commit()
+
+        while True:
+            _execute(db, cursor, "SELECT LastID FROM RollupWatermark WHERE RollupName = %s FOR UPDATE",
+                     (COLLECTION_ROLLUP,))
+            last_id = cursor.fetchone()[0]
+            if last_id >= target:
+                conn.rollback()
+                break
+            hi = min(last_id + chunk_size, target)
+            _execute(db, cursor, COLLECTION_ROLLUP_SQL, (last_id + 1, hi))
+            _execute(db, cursor, "SELECT COUNT(*) FROM TransactionLogger WHERE TransactionID BETWEEN %s AND %s",
+                     (last_id + 1, hi))
+            count = cursor.fetchone()[0]
+            _execute(db, cursor, "UPDATE RollupWatermark SET LastID = %s WHERE RollupName = %s",
+                     (hi, COLLECTION_ROLLUP))
+            conn.commit()
+            db.invalidate_cache('CollectionRollup', 'RollupWatermark')
+
+            done += count
+            chunks += 1
+            last_id = hi
+            if progress:
+                progress(done, last_id)
+        cursor.close()
+    except Error as e:
+        logger.error(f"Collection rollup refresh failed after {done} rows (last TransactionID {last_id}): {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        'rows': done,
+        'chunks': chunks,
+        'last_id': last_id,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(done / elapsed, 1) if elapsed > 0 else float(done),
+    }
+    if chunks:
+        logger.info(f"Collection rollup: {done} ledger rows in {chunks} chunks up to TransactionID {last_id}, "
+                    f"{summary['seconds']}s")
+    return summary
+
+
+def rebuild_collection_rollup(db, chunk_size=100000, progress=None):
+    """Empty CollectionRollup and rebuild it from the whole ledger.
+
+    For repair: after ledger rows were edited or deleted, or a loan moved
+    to another branch or agent.  Same result as refresh_collection_rollup.
+    """
+    conn = None
+    try:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        # Lock the watermark first so a concurrent refresh waits for the reset
+        _execute(db, cursor, "INSERT IGNORE INTO RollupWatermark (RollupName, LastID) VALUES (%s, 0)",
+                 (COLLECTION_ROLLUP,))
+        _execute(db, cursor, "SELECT LastID FROM RollupWatermark WHERE RollupName = %s FOR UPDATE",
+                 (COLLECTION_ROLLUP,))
+        cursor.fetchone()
+        _execute(db, cursor, "DELETE FROM CollectionRollup", ())
+        _execute(db, cursor, "UPDATE RollupWatermark SET LastID = 0 WHERE RollupName = %s", (COLLECTION_ROLLUP,))
+        conn.commit()
+        cursor.close()
+        db.invalidate_cache('CollectionRollup', 'RollupWatermark')
+    except Error as e:
+        logger.error(f"Collection rollup reset failed: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            conn.close()
+    return refresh_collection_rollup(db, chunk_size, settle_seconds=0, progress=progress)
+
+
+def monthly_collections(db, months=None, refresh=False):
+    """EMI collections per month, newest first (Month 'YYYY-MM', TotalCollection, TotalTransactions).
+
+    With refresh=True the rollup is brought up to date first; if that
+    fails, the totals are grouped straight from TransactionLogger instead
+    (slow, but not stale).
+    """
+    query = MONTHLY_COLLECTION_QUERY
+    if refresh and refresh_collection_rollup(db) is None:
+        logger.warning("Collection rollup could not be refreshed; reading monthly collections from the ledger")
+        query = LEDGER_MONTHLY_COLLECTION_QUERY
+    return db.execute_query(query + (f" LIMIT {int(months)}" if months else ""))
+
+
+def refresh_loan_totals(db):
+    """Rebuild the customer and agent loan totals (and credit scores) set-wise with RefreshLoanTotals.
+
+    The Loan triggers keep them current; this repairs any drift, e.g. after
+    loans were changed with the triggers disabled.  Returns a dict with
+    customers, agents, avg_score and seconds, or None on error.
+    """
+    started = time.perf_counter()
+    rows = db.call_procedure('RefreshLoanTotals')
+    if not rows:
+        return None
+    summary = {
+        'customers': int(rows[0]['Customers']),
+        'agents': int(rows[0]['Agents']),
+        'avg_score': float(rows[0]['AvgCreditScore'] or 0),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Loan totals: {summary['customers']} customers and {summary['agents']} agents rebuilt, "
+                f"average credit score {summary['avg_score']:.0f}, {summary['seconds']}s")
+    return summary
+
+
+def collection_rollup_lag(db):
+    """Watermark of CollectionRollup and how many ledger rows are past it, or None on error"""
+    rows = db.execute_query("""
+        SELECT w.LastID, w.UpdatedAt,
+               (SELECT COUNT(*) FROM TransactionLogger t WHERE t.TransactionID > w.LastID) as Pending
+        FROM RollupWatermark w
+        WHERE w.RollupName = %s
+    """, (COLLECTION_ROLLUP,))
+    if rows is None:
+        return None
+    return rows[0] if rows else {'LastID': 0, 'UpdatedAt': None, 'Pending': None}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the monthly collection rollup or the loan totals")
+    parser.add_argument('--rebuild', action='store_true', help="empty the rollup and rebuild it from the whole ledger")
+    parser.add_argument('--loan-totals', action='store_true',
+                        help="rebuild the customer and agent loan totals (and credit scores) instead")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="TransactionIDs per transaction")
+    parser.add_argument('--settle-seconds', type=int, default=60,
+                        help="leave ledger rows younger than this for the next refresh")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    try:
+        db = Database()
+    except Exception as e:
+        logging.error(f"Cannot connect to database: {e}")
+        return 1
+    try:
+        if args.loan_totals:
+            summary = refresh_loan_totals(db)
+        elif args.rebuild:
+            summary = rebuild_collection_rollup(db, args.chunk_size)
+        else:
+            summary = refresh_collection_rollup(db, args.chunk_size, args.settle_seconds)
+    finally:
+        db.close()
+    return 0 if summary is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
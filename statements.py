@@ -0,0 +1,231 @@
+# statements.py
+# Monthly statements for every active loan (optionally one branch) in one run, e.g.
+#   python statements.py --branch 3                     # Statements_branch3_<as-of>.zip
+#   python statements.py --output statements/2024-03    # a directory instead of a zip
+# Loans and installments are read with a few set-based queries per chunk and the PDFs are drawn in a
+# process pool; finished statements are written out as they arrive, with a manifest.csv at the end.
+
+import argparse
+import csv
+import hashlib
+import io
+import logging
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date
+
+from database import Database
+from report_renderer import LoanReportData, render_loan_report_bytes
+from utils import DateUtils
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_LOANS_QUERY = """
+    SELECT l.*, c.FirstName, c.LastName, c.Phone, c.Email,
+           v.VehicleNo, v.Make, v.Model, v.Year, v.MarketValue
+    FROM Loan l
+    JOIN Customer c ON l.CustomerID = c.CustomerID
+    JOIN Vehicle v ON l.VehicleID = v.VehicleID
+    WHERE l.Status = 'Active' AND l.SanctionDate <= %s {branch_filter}
+    ORDER BY l.LoanID
+"""
+
+STATEMENT_INSTALLMENTS_QUERY = """
+    SELECT LoanID, DueDate, TotalAmount, Status, LateFee, PaidDate
+    FROM Installment
+    WHERE LoanID IN ({ids}) AND DueDate <= %s
+    ORDER BY LoanID, DueDate
+"""
+
+STATEMENT_TRANSACTIONS_QUERY = """
+    SELECT LoanID, TransactionDate, TransactionType, DebitAmount, CreditAmount, BalanceAfterTransaction, Remarks
+    FROM TransactionLogger
+    WHERE LoanID IN ({ids}) AND TransactionDate < %s + INTERVAL 1 DAY
+    ORDER BY LoanID, TransactionDate, TransactionID
+"""
+
+MANIFEST_COLUMNS = ('LoanID', 'Customer', 'VehicleNo', 'File', 'Pages', 'Bytes', 'SHA256')
+
+
+def _render_batch(batch):
+    """Process pool worker: [(file name, LoanReportData)] -> [(file name, loan id, pdf bytes, pages)]"""
+    results = []
+    for name, data in batch:
+        content, pages = render_loan_report_bytes(data)
+        results.append((name, data.loan_id, content, pages))
+    return results
+
+
+class _ZipSink:
+    """Statements go into a zip written as <path>.part and renamed when complete"""
+    def __init__(self, path):
+        self.path = path
+        self.part = path + '.part'
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # PDF streams are already compressed, so the archive stores them as they are
+        self.zip = zipfile.ZipFile(self.part, 'w', zipfile.ZIP_STORED)
+
+    def write(self, name, content):
+        self.zip.writestr(name, content)
+
+    def close(self, ok):
+        self.zip.close()
+        if ok:
+            os.replace(self.part, self.path)
+        else:
+            os.remove(self.part)
+
+
+class _DirSink:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(content)
+
+    def close(self, ok):
+        pass
+
+
+def _rows_by_loan(db, query, ids, as_of):
+    rows = db.execute_query(query.format(ids=', '.join(['%s'] * len(ids))), tuple(ids) + (as_of,))
+    if rows is None:
+        raise RuntimeError(f"statement query failed for loans {ids[0]}..{ids[-1]}")
+    by_loan = {loan_id: [] for loan_id in ids}
+    for row in rows:
+        by_loan[row['LoanID']].append(row)
+    return by_loan
+
+
+def _statement_reports(db, loans, as_of):
+    """(file name, LoanReportData) for a chunk of loan header rows, with one query per child table"""
+    ids = [loan['LoanID'] for loan in loans]
+    installments = _rows_by_loan(db, STATEMENT_INSTALLMENTS_QUERY, ids, as_of)
+    transactions = _rows_by_loan(db, STATEMENT_TRANSACTIONS_QUERY, ids, as_of)
+    return [(f"Statement_{loan['LoanID']}_{as_of.isoformat()}.pdf",
+             LoanReportData.from_rows(loan, installments[loan['LoanID']], transactions[loan['LoanID']],
+                                      title=f"Loan Statement - Loan ID: {loan['LoanID']} - as of {as_of.isoformat()}"))
+            for loan in loans]
+
+
+def generate_statements(db, branch_id=None, as_of=None, output=None, workers=None, chunk_size=200,
+                        batch_size=20, progress=None):
+    """Render a statement PDF for every active loan (in branch_id, if given) into a zip or directory.
+
+    output ending in .zip (the default, Statements_<branch>_<as-of>.zip)
+    gives an archive; anything else is a directory.  A statement lists the
+    installments due and the transactions made up to as_of, so re-running
+    a past date gives the same figures; which loans get one still follows
+    their current status (Active and sanctioned by as_of), as loan status
+    has no history.  Loan headers are streamed chunk_size at a time with
+    their installments fetched in one query per chunk (and transactions in
+    another); PDFs are drawn batch_size per task on `workers` processes
+    (default STATEMENT_WORKERS or the CPU count) with a bounded
+    number of tasks in flight, and written as they finish.  A manifest.csv
+    lists every statement with its page count, size and SHA-256.
+    progress, if given, is called as progress(statements_done, pages_done).
+
+    Returns a dict with output, statements, pages, bytes, seconds,
+    pages_per_sec and statements_per_sec, or None on error (a partial zip
+    is removed).
+    """
+    as_of = as_of or DateUtils.today()
+    scope = f"branch{branch_id}" if branch_id is not None else "all"
+    output = output or f"Statements_{scope}_{as_of.isoformat()}.zip"
+    workers = workers or int(os.getenv('STATEMENT_WORKERS', os.cpu_count() or 1))
+    query = STATEMENT_LOANS_QUERY.format(branch_filter="AND l.BranchID = %s" if branch_id is not None else "")
+    params = (as_of, branch_id) if branch_id is not None else (as_of,)
+
+    started = time.perf_counter()
+    sink = _ZipSink(output) if output.endswith('.zip') else _DirSink(output)
+    manifest = []
+    meta = {}
+    totals = {'statements': 0, 'pages': 0, 'bytes': 0}
+    ok = False
+
+    def collect(future):
+        for name, loan_id, content, pages in future.result():
+            sink.write(name, content)
+            customer, vehicle = meta.pop(loan_id)
+            manifest.append((loan_id, customer, vehicle, name, pages, len(content),
+                             hashlib.sha256(content).hexdigest()))
+            totals['statements'] += 1
+            totals['pages'] += pages
+            totals['bytes'] += len(content)
+        if progress:
+            progress(totals['statements'], totals['pages'])
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            for loans in db.iter_query(query, params, chunk_size=chunk_size):
+                for loan in loans:
+                    meta[loan['LoanID']] = (f"{loan['FirstName']} {loan['LastName']}", loan['VehicleNo'])
+                reports = _statement_reports(db, loans, as_of)
+                for start in range(0, len(reports), batch_size):
+                    in_flight.add(pool.submit(_render_batch, reports[start:start + batch_size]))
+                    # Keep the queue short so memory stays flat however many loans there are
+                    while len(in_flight) >= workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+            for future in in_flight:
+                collect(future)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(MANIFEST_COLUMNS)
+        writer.writerows(sorted(manifest))
+        sink.write('manifest.csv', buffer.getvalue().encode('utf-8'))
+        ok = True
+    except Exception as e:
+        logger.error(f"Statement run failed after {totals['statements']} statements: {e}")
+        return None
+    finally:
+        sink.close(ok)
+
+    elapsed = time.perf_counter() - started
+    summary = dict(totals, output=output, as_of=as_of, workers=workers, seconds=round(elapsed, 3),
+                   pages_per_sec=round(totals['pages'] / elapsed, 1) if elapsed > 0 else 0.0,
+                   statements_per_sec=round(totals['statements'] / elapsed, 1) if elapsed > 0 else 0.0)
+    logger.info(f"Statements ({scope}, as of {as_of}): {totals['statements']} statements, {totals['pages']} pages, "
+                f"{totals['bytes']} bytes in {summary['seconds']}s ({summary['pages_per_sec']} pages/sec, "
+                f"{workers} workers) -> {output}")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate statement PDFs for every active loan")
+    parser.add_argument('--branch', type=int, help="only loans of this BranchID")
+    parser.add_argument('--as-of', type=date.fromisoformat, default=DateUtils.today(),
+                        help="statement date (YYYY-MM-DD, default $LOAN_AS_OF or today)")
+    parser.add_argument('--output', help="zip file or directory (default Statements_<branch>_<as-of>.zip)")
+    parser.add_argument('--workers', type=int, help="rendering processes (default $STATEMENT_WORKERS or CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=200, help="loans per installments query")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    try:
+        db = Database()
+    except Exception as e:
+        logging.error(f"Cannot connect to database: {e}")
+        return 1
+    try:
+        summary = generate_statements(db, args.branch, args.as_of, args.output, args.workers, args.chunk_size)
+    finally:
+        db.close()
+    return 0 if summary is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
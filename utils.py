@@ -1,8 +1,33 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime
+import calendar
 import math
 import hashlib
+import os
+from functools import lru_cache
 from typing import Union
 
+import numpy as np
+
+from money import Money, to_paise, to_rupees, mul_rate
+
+# Late fee: 2% of the instalment per month overdue (a part month of 15+ days counts), capped at 20%.
+# overdue.py builds its SQL from these, and the UpdateInstallmentStatus trigger applies the same rule.
+LATE_FEE_RATE_PER_MONTH = 0.02
+LATE_FEE_CAP = 0.20
+
+# A loan with an instalment this many days overdue is Defaulted and eligible for seizure
+DEFAULT_AFTER_DAYS = 90
+
+# Foreclosure charge on the principal still outstanding when a loan is paid off early (foreclosure.py)
+FORECLOSURE_CHARGE_RATE = 0.02
+
+# Lending policy checked by validate_loan_parameters (and, for the whole book, by repricing.py)
+MAX_LTV_PERCENT = 80
+MIN_INTEREST_RATE = 5
+MAX_INTEREST_RATE = 25
+MIN_TENURE_MONTHS = 6
+MAX_TENURE_MONTHS = 84
+
 class LoanCalculator:
     @staticmethod
     def calculate_emi(principal, annual_rate, tenure_months):
@@ -12,85 +37,244 @@ class LoanCalculator:
         
         monthly_rate = annual_rate / (12 * 100)
         if monthly_rate == 0:  # Handle zero interest case
-            return round(principal / tenure_months, 2)
+            return float(Money.of(principal) * (1 / tenure_months))
         
-        emi = (principal * monthly_rate * math.pow(1 + monthly_rate, tenure_months)) / \
-              (math.pow(1 + monthly_rate, tenure_months) - 1)
-        return round(emi, 2)
+        growth = math.pow(1 + monthly_rate, tenure_months)
+        return float(Money.of(principal) * (monthly_rate * growth / (growth - 1)))
+    
+    @staticmethod
+    def _emi_paise(principal_paise, monthly_rates, tenures):
+        growth = np.power(1 + monthly_rates, tenures)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(monthly_rates > 0, monthly_rates * growth / (growth - 1), 1 / tenures)
+        return mul_rate(principal_paise, factor)
+    
+    @staticmethod
+    def calculate_emi_batch(principals, annual_rates, tenures):
+        """Vectorised calculate_emi: one EMI per loan for arrays of principal, rate and tenure.
+
+        Zero rates are allowed and give principal / tenure.
+        """
+        principal_paise = to_paise(principals)
+        rates = np.asarray(annual_rates, dtype=float) / (12 * 100)
+        tenures = np.asarray(tenures, dtype=int)
+        if (principal_paise <= 0).any() or (rates < 0).any() or (tenures <= 0).any():
+            raise ValueError("Principal and tenure must be positive and rate non-negative")
+        return to_rupees(LoanCalculator._emi_paise(principal_paise, rates, tenures))
+    
+    @staticmethod
+    def amortization_batch_paise(principals, annual_rates, tenures):
+        """Reducing-balance schedules for many loans in one pass, in int64 paise.
+
+        Interest is rounded half up to the paisa each month and the last
+        instalment clears whatever is left, so every row satisfies
+        payment == principal + interest exactly and principals sum to the loan.
+        Returns a dict of arrays: 'emi' has shape (n,); 'payment', 'principal',
+        'interest' and 'balance' have shape (n, max tenure), with month m in
+        column m - 1 and zeros after each loan's own tenure.
+        """
+        principal_paise = to_paise(principals)
+        rates = np.asarray(annual_rates, dtype=float) / (12 * 100)
+        tenures = np.asarray(tenures, dtype=int)
+        if (principal_paise <= 0).any() or (rates < 0).any() or (tenures <= 0).any():
+            raise ValueError("Principal and tenure must be positive and rate non-negative")
+        emi = LoanCalculator._emi_paise(principal_paise, rates, tenures)
+        
+        n = len(principal_paise)
+        months = int(tenures.max()) if n else 0
+        principal = np.zeros((n, months), dtype=np.int64)
+        interest = np.zeros((n, months), dtype=np.int64)
+        balance = np.zeros((n, months), dtype=np.int64)
+        
+        # Loop over months (at most 84), vectorised across every loan in the book
+        remaining = principal_paise.copy()
+        for m in range(1, months + 1):
+            live = tenures >= m
+            month_interest = np.where(live, mul_rate(remaining, rates), 0)
+            month_principal = np.where(tenures == m, remaining, np.minimum(emi - month_interest, remaining))
+            month_principal = np.where(live, month_principal, 0)
+            remaining = remaining - month_principal
+            
+            col = m - 1
+            principal[:, col] = month_principal
+            interest[:, col] = month_interest
+            balance[:, col] = remaining
+        
+        return {
+            'emi': emi,
+            'payment': principal + interest,
+            'principal': principal,
+            'interest': interest,
+            'balance': balance,
+        }
+    
+    @staticmethod
+    def amortization_batch(principals, annual_rates, tenures):
+        """amortization_batch_paise with every array converted to rupees"""
+        return {key: to_rupees(values)
+                for key, values in LoanCalculator.amortization_batch_paise(principals, annual_rates, tenures).items()}
     
     @staticmethod
     def calculate_total_payable(emi, tenure_months):
         """Calculate total payable amount"""
         if emi <= 0 or tenure_months <= 0:
             raise ValueError("EMI and tenure must be positive")
-        return round(emi * tenure_months, 2)
+        return float(Money.of(emi) * int(tenure_months))
     
     @staticmethod
     def calculate_installments(loan_amount, interest_rate, tenure_months, start_date):
-        """Calculate installment schedule"""
+        """Calculate installment schedule.
+
+        This is the one schedule used everywhere (loan creation, EMI calculator,
+        PDFs): reducing-balance EMI with instalment m due m calendar months
+        after start_date, clamped to month end like MySQL's DATE_ADD.
+        Schedules are memoised (see schedule_cache_stats); each call gets its
+        own copy of the rows.
+        """
         if loan_amount <= 0 or interest_rate < 0 or tenure_months <= 0:
             raise ValueError("Invalid loan parameters")
         
-        monthly_interest = interest_rate / (12 * 100)
-        monthly_principal = loan_amount / tenure_months
-        installments = []
-        
-        remaining_balance = loan_amount
-        
-        for month in range(1, tenure_months + 1):
-            due_date = start_date + timedelta(days=30 * month)
-            interest_amount = remaining_balance * monthly_interest
-            total_amount = monthly_principal + interest_amount
-            remaining_balance -= monthly_principal
-            
-            installments.append({
-                'due_date': due_date,
-                'principal_amount': round(monthly_principal, 2),
-                'interest_amount': round(interest_amount, 2),
-                'total_amount': round(total_amount, 2),
-                'remaining_balance': round(remaining_balance, 2)
-            })
-        
-        return installments
+        rows = _cached_schedule(round(float(loan_amount), 2), round(float(interest_rate), 4),
+                                int(tenure_months), start_date)
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def schedule_cache_stats():
+        info = _cached_schedule.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_rate': round(info.hits / lookups, 3) if lookups else 0.0,
+            'entries': info.currsize,
+            'max_entries': info.maxsize,
+        }
+    
+    @staticmethod
+    def clear_schedule_cache():
+        _cached_schedule.cache_clear()
     
     @staticmethod
     def validate_loan_parameters(loan_amount, market_value, interest_rate, tenure):
         """Validate loan parameters against business rules"""
         errors = []
         
-        # Loan-to-value ratio (should not exceed 80%)
+        # Loan-to-value ratio
         ltv_ratio = (loan_amount / market_value) * 100
-        if ltv_ratio > 80:
-            errors.append(f"Loan amount exceeds 80% of vehicle value (LTV: {ltv_ratio:.1f}%)")
+        if ltv_ratio > MAX_LTV_PERCENT:
+            errors.append(f"Loan amount exceeds {MAX_LTV_PERCENT}% of vehicle value (LTV: {ltv_ratio:.1f}%)")
         
         # Interest rate bounds
-        if interest_rate < 5 or interest_rate > 25:
-            errors.append("Interest rate must be between 5% and 25%")
+        if interest_rate < MIN_INTEREST_RATE or interest_rate > MAX_INTEREST_RATE:
+            errors.append(f"Interest rate must be between {MIN_INTEREST_RATE}% and {MAX_INTEREST_RATE}%")
         
         # Tenure bounds
-        if tenure < 6 or tenure > 84:
-            errors.append("Loan tenure must be between 6 and 84 months")
+        if tenure < MIN_TENURE_MONTHS or tenure > MAX_TENURE_MONTHS:
+            errors.append(f"Loan tenure must be between {MIN_TENURE_MONTHS} and {MAX_TENURE_MONTHS} months")
         
         return errors
+    
+    @staticmethod
+    def validate_loan_parameters_batch(loan_amounts, market_values, interest_rates, tenures,
+                                       max_ltv=MAX_LTV_PERCENT, min_rate=MIN_INTEREST_RATE,
+                                       max_rate=MAX_INTEREST_RATE, min_tenure=MIN_TENURE_MONTHS,
+                                       max_tenure=MAX_TENURE_MONTHS):
+        """Vectorised validate_loan_parameters for arrays of loans.
+
+        The limits default to the current policy and can be overridden to
+        check the book against proposed ones.  Returns a dict of arrays:
+        'ltv' (percent) and the boolean masks 'ltv_ok', 'rate_ok',
+        'tenure_ok' and 'valid'.
+        """
+        amounts = np.asarray(loan_amounts, dtype=float)
+        values = np.asarray(market_values, dtype=float)
+        rates = np.asarray(interest_rates, dtype=float)
+        tenures = np.asarray(tenures, dtype=int)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ltv = np.where(values > 0, amounts / values * 100, np.inf)
+        ltv_ok = ltv <= max_ltv
+        rate_ok = (rates >= min_rate) & (rates <= max_rate)
+        tenure_ok = (tenures >= min_tenure) & (tenures <= max_tenure)
+        return {
+            'ltv': ltv,
+            'ltv_ok': ltv_ok,
+            'rate_ok': rate_ok,
+            'tenure_ok': tenure_ok,
+            'valid': ltv_ok & rate_ok & tenure_ok,
+        }
+
+# Quotes repeat the same few products all day, so schedules are kept in a bounded LRU
+@lru_cache(maxsize=int(os.getenv('SCHEDULE_CACHE_SIZE', 1024)))
+def _cached_schedule(loan_amount, interest_rate, tenure_months, start_date):
+    batch = LoanCalculator.amortization_batch([loan_amount], [interest_rate], [tenure_months])
+    installments = []
+    for month in range(1, tenure_months + 1):
+        col = month - 1
+        installments.append({
+            'due_date': DateUtils.add_months(start_date, month),
+            'principal_amount': float(batch['principal'][0, col]),
+            'interest_amount': float(batch['interest'][0, col]),
+            'total_amount': float(batch['payment'][0, col]),
+            'remaining_balance': float(batch['balance'][0, col])
+        })
+    return tuple(installments)
 
 class DateUtils:
     @staticmethod
-    def is_overdue(due_date):
-        return due_date < datetime.now().date()
+    def add_months(start_date, months):
+        """Same day `months` calendar months later, clamped to the last day of a shorter month"""
+        month_index = start_date.month - 1 + months
+        year = start_date.year + month_index // 12
+        month = month_index % 12 + 1
+        return start_date.replace(year=year, month=month, day=min(start_date.day, calendar.monthrange(year, month)[1]))
+    
+    @staticmethod
+    def today():
+        """Business date used when no as_of is given: LOAN_AS_OF (YYYY-MM-DD) if set, else today.
+
+        Pinning LOAN_AS_OF makes overdue and late-fee figures reproducible.
+        """
+        pinned = os.getenv('LOAN_AS_OF')
+        return date.fromisoformat(pinned) if pinned else datetime.now().date()
+    
+    @staticmethod
+    def is_overdue(due_date, as_of=None):
+        return due_date < (as_of or DateUtils.today())
     
     @staticmethod
-    def calculate_late_fee(due_date, total_amount):
-        if not DateUtils.is_overdue(due_date):
+    def calculate_late_fee(due_date, total_amount, as_of=None):
+        as_of = as_of or DateUtils.today()
+        if not DateUtils.is_overdue(due_date, as_of):
             return 0
         
-        days_overdue = (datetime.now().date() - due_date).days
+        days_overdue = (as_of - due_date).days
         if days_overdue <= 0:
             return 0
         
         # 2% per month or part thereof, capped at 20%
         months_overdue = max(1, (days_overdue + 14) // 30)  # Give 15-day grace period
-        late_fee_percentage = min(0.02 * months_overdue, 0.20)  # Cap at 20%
-        return round(total_amount * late_fee_percentage, 2)
+        late_fee_percentage = min(LATE_FEE_RATE_PER_MONTH * months_overdue, LATE_FEE_CAP)
+        return float(Money.of(total_amount) * late_fee_percentage)
+    
+    @staticmethod
+    def late_fee_batch(due_dates, amounts, as_of=None):
+        """Vectorised calculate_late_fee for many unpaid installments against one as-of date.
+
+        Returns a dict of arrays: 'days_overdue' (0 when not yet due),
+        'months_overdue' (0 when not overdue, else at least 1) and 'late_fee'
+        in rupees, rounded half up to the paisa like the SQL in overdue.py.
+        """
+        as_of = np.datetime64(as_of or DateUtils.today(), 'D')
+        due = np.asarray(due_dates, dtype='datetime64[D]')
+        days = np.maximum((as_of - due).astype(np.int64), 0)
+        months = np.where(days > 0, np.maximum(1, (days + 14) // 30), 0)
+        pct = np.minimum(LATE_FEE_RATE_PER_MONTH * months, LATE_FEE_CAP)
+        return {
+            'days_overdue': days,
+            'months_overdue': months,
+            'late_fee': to_rupees(mul_rate(to_paise(amounts), pct)),
+        }
     
     @staticmethod
     def validate_date(date_string, date_format='%Y-%m-%d'):